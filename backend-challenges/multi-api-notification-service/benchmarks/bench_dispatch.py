@@ -0,0 +1,55 @@
+"""
+Benchmark of the newsletter dispatcher against the local stand-in mail service.
+
+Sends the newsletter to a large number of generated subscribers and reports
+the throughput and the number of (billed) calls to the mail service. Run
+from the service directory:
+
+    python benchmarks/bench_dispatch.py [subscribers] [fail_every]
+"""
+# module imports
+import asyncio
+import os
+import sys
+from itertools import cycle, islice
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import mail_stub  # noqa: E402
+from newsletter_dispatcher import send_newsletter, subscribed_users  # noqa: E402
+
+
+def generated_users(count):
+    """
+    Subscribers generated from the users of users.json
+
+    :param count: number of subscribers
+    :return: generator of user records
+    """
+    for number, user in enumerate(islice(cycle(list(subscribed_users())), count)):
+        yield dict(user, id=number, email='%d.%s' % (number, user['email']))
+
+
+async def main(count, fail_every):
+    """
+    Run the benchmark
+
+    :param count: number of subscribers
+    :param fail_every: let the mail service fail every n-th call, 0 to never fail
+    :return: None
+    """
+    state = mail_stub.MailStubState(fail_every=fail_every)
+    runner, url = await mail_stub.start(state)
+    try:
+        report = await send_newsletter(url, generated_users(count), backoff=0.01)
+    finally:
+        await runner.cleanup()
+    print(report)
+    print('mail service: %d calls (%d failed, %d rejected), %d messages accepted, batch sizes %d-%d' % (
+        state.calls, state.failed_calls, state.rejected_calls, state.messages,
+        min(state.batch_sizes), max(state.batch_sizes)))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+                     int(sys.argv[2]) if len(sys.argv) > 2 else 0))
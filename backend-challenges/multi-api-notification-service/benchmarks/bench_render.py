@@ -0,0 +1,69 @@
+"""
+Benchmark of the template rendering of the notification service.
+
+Renders the newsletter for 1M users with the compiled, cached template and
+compares it with re-reading the template file and replacing the placeholders
+with a regular expression for every user. Run from the service directory:
+
+    python benchmarks/bench_render.py [messages]
+"""
+# module imports
+import json
+import os
+import sys
+import time
+from itertools import cycle, islice
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from template_service import PLACEHOLDER, TEMPLATE_DIR, USER_FIELDS, TemplateCache  # noqa: E402
+
+# the naive variant is slow, so it renders a smaller number of messages
+NAIVE_MESSAGES = 50000
+
+
+def naive_render(path, user):
+    """
+    Read the template and replace the placeholders, as done per user before
+
+    :param path: the template file
+    :param user: the user record
+    :return: the rendered text
+    """
+    with open(path, encoding='utf-8') as stream:
+        text = stream.read()
+    return PLACEHOLDER.sub(lambda match: str(USER_FIELDS[match.group(1)](user)), text)
+
+
+def main(messages):
+    """
+    Run the benchmark
+
+    :param messages: number of messages rendered with the compiled template
+    :return: None
+    """
+    with open(os.path.join(TEMPLATE_DIR, 'users.json'), encoding='utf-8') as stream:
+        users = json.load(stream)
+    path = os.path.join(TEMPLATE_DIR, 'templateNewsletter.txt')
+
+    naive_messages = min(messages, NAIVE_MESSAGES)
+    start = time.perf_counter()
+    for user in islice(cycle(users), naive_messages):
+        naive_render(path, user)
+    naive = (time.perf_counter() - start) / naive_messages
+
+    cache = TemplateCache()
+    start = time.perf_counter()
+    total = 0
+    for text in cache.get_by_key('newsletter').render_many(islice(cycle(users), messages)):
+        total += len(text)
+    compiled = (time.perf_counter() - start) / messages
+
+    print('naive (read + regex per user): %8.2f us/message  %10.0f messages/s' % (naive * 1e6, 1 / naive))
+    print('compiled template:             %8.2f us/message  %10.0f messages/s' % (compiled * 1e6, 1 / compiled))
+    print('rendered %d messages (%.1f MB) in %.2f s, %.1fx faster' % (
+        messages, total / 1e6, compiled * messages, naive / compiled))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
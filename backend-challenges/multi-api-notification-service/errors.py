@@ -0,0 +1,27 @@
+# module imports
+from flask import jsonify
+
+# machine-readable error codes returned by the API
+TEMPLATE_NOT_FOUND = 'template_not_found'
+TEMPLATE_INVALID = 'template_invalid'
+TEMPLATE_UNAVAILABLE = 'template_unavailable'
+
+# the HTTP status code sent with each error code
+ERROR_STATUS = {
+    TEMPLATE_NOT_FOUND: 404,
+    TEMPLATE_INVALID: 500,
+    TEMPLATE_UNAVAILABLE: 503,
+}
+
+
+def error_response(code, msg):
+    """
+    Build the JSON response for a failed request
+
+    :param code: one of the error codes defined in this module
+    :param msg: the human readable error message
+    :return: the response object
+    """
+    response = jsonify({"error": {"code": code, "message": msg}})
+    response.status_code = ERROR_STATUS[code]
+    return response
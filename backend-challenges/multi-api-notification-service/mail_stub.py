@@ -0,0 +1,99 @@
+"""
+A local stand-in for the imaginary, pay-per-request mail service, used by the
+tests and benchmarks of the newsletter dispatcher.
+
+It accepts ``POST /send`` with a JSON body ``{"messages": [...]}``, rejects
+batches smaller than the minimum batch size and counts the (billed) calls.
+
+Usage:
+
+    python mail_stub.py --port 5002
+"""
+# module imports
+import argparse
+from aiohttp import web
+
+MIN_BATCH = 10
+
+
+class MailStubState(object):
+    """
+    Counters of the stand-in mail service
+    """
+    def __init__(self, min_batch=MIN_BATCH, fail_every=0, fail_status=503):
+        """
+        :param min_batch: smallest batch accepted
+        :param fail_every: answer every n-th call with fail_status, 0 to never fail
+        :param fail_status: the status code of the failed calls
+        """
+        self.min_batch = min_batch
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.calls = 0
+        self.failed_calls = 0
+        self.rejected_calls = 0
+        self.messages = 0
+        self.batch_sizes = []
+
+
+# key of the MailStubState in the application
+STATE = web.AppKey('state', MailStubState)
+
+
+async def send(request):
+    """
+    The POST /send handler
+
+    :param request: the aiohttp request
+    :return: the JSON response
+    """
+    state = request.app[STATE]
+    state.calls += 1
+    if state.fail_every and state.calls % state.fail_every == 0:
+        state.failed_calls += 1
+        return web.json_response({"error": {"code": "unavailable"}}, status=state.fail_status)
+    data = await request.json()
+    messages = data.get('messages') or []
+    if len(messages) < state.min_batch:
+        state.rejected_calls += 1
+        return web.json_response({"error": {"code": "batch_too_small"}}, status=400)
+    state.messages += len(messages)
+    state.batch_sizes.append(len(messages))
+    return web.json_response({"msg": "Success", "accepted": len(messages)})
+
+
+def create_app(state=None):
+    """
+    Create the aiohttp application of the stand-in mail service
+
+    :param state: the MailStubState to record calls in
+    :return: the application
+    """
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app[STATE] = state if state is not None else MailStubState()
+    app.router.add_post('/send', send)
+    return app
+
+
+async def start(state=None, host='127.0.0.1', port=0):
+    """
+    Start the stand-in mail service in the running event loop
+
+    :param state: the MailStubState to record calls in
+    :param host: the interface to listen on
+    :param port: the port, 0 for a free port
+    :return: tuple of the AppRunner (to clean up) and the URL of the send endpoint
+    """
+    runner = web.AppRunner(create_app(state), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, 'http://%s:%d/send' % (host, runner.addresses[0][1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the stand-in mail service.')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--fail-every', type=int, default=0, help='answer every n-th call with HTTP 503')
+    args = parser.parse_args()
+    web.run_app(create_app(MailStubState(fail_every=args.fail_every)), port=args.port)
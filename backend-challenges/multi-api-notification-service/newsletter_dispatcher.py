@@ -0,0 +1,426 @@
+"""
+The newsletter use-case of the Notification-Service: the newsletter template
+is rendered for every subscribed user and the messages are sent to the mail
+service in batches.
+
+The mail service is billed per request, so it is only called with batches of
+at least MIN_BATCH messages. Batches are filled up to a maximum number of
+messages and bytes, and sent over a pooled HTTP client with a bounded number
+of concurrent calls. The queue between rendering and sending is bounded too,
+so rendering waits when the mail service is slower (backpressure). Calls the
+mail service refused, or that could not connect, are retried with
+exponential backoff and jitter.
+
+Usage:
+
+    python newsletter_dispatcher.py --mail-url http://localhost:5002/send
+"""
+# module imports
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import aiohttp
+from template_service import TEMPLATE_DIR, cache
+
+MIN_BATCH = 10
+MAX_BATCH = 500
+# upper bound of the message bodies in one batch, keeps the request size reasonable
+MAX_BATCH_BYTES = 1024 * 1024
+CONCURRENCY = 8
+RETRIES = 3
+BACKOFF = 0.1
+TIMEOUT = 30
+# number of users rendered per task of the worker pool
+RENDER_CHUNK = 2000
+NEWSLETTER_KEY = 'newsletter'
+# characters read from the users file at once
+READ_CHUNK = 64 * 1024
+# upper bound of the characters of one user record in the users file
+MAX_RECORD_SIZE = 1024 * 1024
+_WHITESPACE = ' \t\n\r'
+# the characters that change the state of the object scanner, outside of and inside strings
+_OBJECT_TOKENS = re.compile(r'["{}]')
+_STRING_TOKENS = re.compile(r'["\\]')
+
+
+def iter_json_objects(stream, chunk_size=READ_CHUNK, max_size=MAX_RECORD_SIZE):
+    """
+    Parse a file containing a JSON array of objects, such as users.json,
+    while it is read. The end of every object is found by counting its braces
+    outside of strings, then the object is decoded on its own, so a malformed
+    object fails as soon as it was read.
+
+    :param stream: text file object positioned at the start of the array
+    :param chunk_size: number of characters read at once
+    :param max_size: maximum number of characters of one object
+    :return: generator of the decoded objects
+    """
+    buffer = ''
+    position = 0
+    eof = False
+    # start of the object being scanned, None between objects
+    start = None
+    depth = 0
+    in_string = False
+    # the characters allowed next between objects
+    expected = '['
+    while True:
+        # an escaped character is read together with its backslash
+        if len(buffer) - position < 2 and not eof:
+            keep = position if start is None else start
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[keep:] + chunk, position - keep
+            if start is not None:
+                start = 0
+                if len(buffer) > max_size:
+                    raise ValueError('JSON object larger than %d characters' % max_size)
+            continue
+        if position >= len(buffer):
+            raise ValueError('Unexpected end of file inside the JSON array')
+        if start is None:
+            char = buffer[position]
+            position += 1
+            if char in _WHITESPACE:
+                continue
+            if char not in expected:
+                raise ValueError('Expected %s in the JSON array, found %r' % (' or '.join(expected), char))
+            if char == ']':
+                return
+            if char == '{':
+                start, depth = position - 1, 1
+            # no "]" after ",", the array must not end with a comma
+            expected = {'[': '{]', '{': ',]', ',': '{'}[char]
+            continue
+        match = (_STRING_TOKENS if in_string else _OBJECT_TOKENS).search(buffer, position)
+        if match is None:
+            position = len(buffer)
+            continue
+        token = match.group()
+        position = match.end()
+        if token == '\\':
+            position += 1
+        elif token == '"':
+            in_string = not in_string
+        elif token == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if not depth:
+                yield json.loads(buffer[start:position])
+                start = None
+
+
+def subscribed_users(path=os.path.join(TEMPLATE_DIR, 'users.json')):
+    """
+    The users that subscribed to the newsletter. The file is parsed while it
+    is read, so the users are never all in memory.
+
+    :param path: the users JSON file
+    :return: generator of user records
+    """
+    with open(path, encoding='utf-8') as stream:
+        for user in iter_json_objects(stream):
+            if user.get('subscribedNewsletter'):
+                yield user
+
+
+def _render_chunk(key, users):
+    """
+    Render a template for a chunk of users; runs in the worker processes
+
+    :param key: the template key
+    :param users: list of user records
+    :return: list of message dicts
+    """
+    template = cache.get_by_key(key)
+    return [{'to': user['email'], 'user': user['id'], 'body': body}
+            for user, body in zip(users, template.render_many(users))]
+
+
+def _chunks(iterable, size):
+    """
+    Split an iterable into lists of at most size elements
+
+    :param iterable: the iterable to split
+    :param size: the maximum number of elements per list
+    :return: generator of lists
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def render_messages(users, key=NEWSLETTER_KEY, workers=1, chunk_size=RENDER_CHUNK):
+    """
+    Render a template for every user. With more than one worker, chunks of
+    users are rendered in a process pool; rendering is cheap, so this only
+    pays off for very large numbers of users.
+
+    :param users: iterable of user records
+    :param key: the template key
+    :param workers: number of worker processes, 1 to render in this process
+    :param chunk_size: number of users per task of the worker pool
+    :return: generator of message dicts with 'to', 'user' and 'body'
+    """
+    if workers <= 1:
+        for chunk in _chunks(users, chunk_size):
+            yield from _render_chunk(key, chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for chunk in _chunks(users, chunk_size):
+            pending.append(executor.submit(_render_chunk, key, chunk))
+            # keep a bounded number of chunks in flight
+            if len(pending) >= 2 * workers:
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+
+def batch_messages(messages, min_batch=MIN_BATCH, max_batch=MAX_BATCH, max_bytes=MAX_BATCH_BYTES):
+    """
+    Pack messages into batches of min_batch to max_batch messages. A batch is
+    closed early when its bodies exceed max_bytes, but never below min_batch.
+    If the last batch would be too small, it is combined with the previous one
+    if that fits into max_batch (and max_bytes, unless the result would be
+    large enough for two batches), otherwise the two are split evenly. Only if
+    there are fewer than min_batch messages in total, or the two can neither
+    be combined nor split (e.g. min_batch == max_batch), a smaller last batch
+    is produced.
+
+    :param messages: iterable of message dicts
+    :param min_batch: the minimum number of messages per batch
+    :param max_batch: the maximum number of messages per batch
+    :param max_bytes: the maximum size of the message bodies per batch
+    :return: generator of lists of messages
+    """
+    if min_batch < 1 or max_batch < min_batch:
+        raise ValueError('Invalid batch sizes: min %d, max %d' % (min_batch, max_batch))
+    # the last full batch is held back, it may be needed to fill up the last one
+    previous = None
+    batch = []
+    size = 0
+    for message in messages:
+        length = len(message['body'])
+        if len(batch) >= max_batch or (len(batch) >= min_batch and size + length > max_bytes):
+            if previous is not None:
+                yield previous
+            previous, batch, size = batch, [], 0
+        batch.append(message)
+        size += length
+    if previous is None or len(batch) >= min_batch:
+        if previous is not None:
+            yield previous
+        if batch:
+            yield batch
+        return
+    combined = previous + batch
+    combined_size = size + sum(len(message['body']) for message in previous)
+    splittable = len(combined) >= 2 * min_batch
+    if len(combined) <= max_batch and (combined_size <= max_bytes or not splittable):
+        yield combined
+    elif splittable:
+        # both halves have at least min_batch and, as combined < max_batch + min_batch, at most max_batch messages
+        half = len(combined) // 2
+        yield combined[:half]
+        yield combined[half:]
+    else:
+        yield previous
+        yield batch
+
+
+class DispatchReport(object):
+    """
+    The result of a dispatch run
+    """
+    def __init__(self):
+        self.messages = 0
+        self.batches = 0
+        self.calls = 0
+        self.failed_batches = 0
+        self.failed_messages = 0
+        self.seconds = 0.0
+
+    @property
+    def messages_per_second(self):
+        """
+        The throughput of the run
+
+        :return: messages sent per second
+        """
+        return self.messages / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return ('%d messages in %d batches, %d calls to the mail service, %d failed batches, '
+                '%.2f s, %.0f messages/s' % (self.messages, self.batches, self.calls, self.failed_batches,
+                                             self.seconds, self.messages_per_second))
+
+
+# status codes of calls the mail service refused without sending the messages
+_NOT_PROCESSED = (429, 503)
+
+
+class MailClient(object):
+    """
+    Client of the mail service. Connections are kept alive and pooled, with
+    at most `concurrency` open at the same time. Use as an async context manager.
+    """
+    def __init__(self, url, concurrency=CONCURRENCY, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        """
+        :param url: the send endpoint of the mail service
+        :param concurrency: maximum number of concurrent calls
+        :param retries: number of retries of a failed call
+        :param backoff: base delay of the exponential backoff in seconds
+        :param timeout: timeout of a call in seconds
+        """
+        self.url = url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.calls = 0
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def send_batch(self, batch):
+        """
+        Send one batch. Every call is billed and sends the messages, so a call
+        is only retried if the mail service certainly did not process it: it
+        could not be connected to, or answered with HTTP 429 or 503. After a
+        timeout, a dropped connection or another server error the messages may
+        have been sent, the batch is reported as failed instead.
+
+        :param batch: list of message dicts
+        :return: True if the mail service accepted the batch
+        """
+        payload = {'messages': [{'to': message['to'], 'body': message['body']} for message in batch]}
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # full jitter: a random delay up to the exponential backoff
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+            self.calls += 1
+            try:
+                async with self._session.post(self.url, json=payload) as response:
+                    await response.read()
+                    if response.status < 300:
+                        return True
+                    if response.status not in _NOT_PROCESSED:
+                        # the request is wrong, or it may have been processed
+                        return False
+            except aiohttp.ClientConnectorError:
+                # the request was never sent
+                pass
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+        return False
+
+
+async def dispatch(batches, client, concurrency=CONCURRENCY):
+    """
+    Send batches with a bounded number of concurrent calls. Batches are taken
+    from the (synchronous) batches iterator in a thread, and at most
+    2 * concurrency batches wait for a sender at any time.
+
+    :param batches: iterable of lists of messages
+    :param client: an entered MailClient
+    :param concurrency: number of concurrent senders
+    :return: the DispatchReport
+    """
+    report = DispatchReport()
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    loop = asyncio.get_running_loop()
+    iterator = iter(batches)
+    calls_before = client.calls
+    start = time.perf_counter()
+
+    async def produce():
+        while True:
+            batch = await loop.run_in_executor(None, next, iterator, None)
+            if batch is None:
+                break
+            # waits while the queue is full
+            await queue.put(batch)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            report.batches += 1
+            if await client.send_batch(batch):
+                report.messages += len(batch)
+            else:
+                report.failed_batches += 1
+                report.failed_messages += len(batch)
+
+    await asyncio.gather(produce(), *[consume() for _ in range(concurrency)])
+    report.seconds = time.perf_counter() - start
+    report.calls = client.calls - calls_before
+    return report
+
+
+async def send_newsletter(url, users, min_batch=MIN_BATCH, max_batch=MAX_BATCH, max_bytes=MAX_BATCH_BYTES,
+                          concurrency=CONCURRENCY, workers=1, retries=RETRIES, backoff=BACKOFF):
+    """
+    Render the newsletter for the users and send it to the mail service
+
+    :param url: the send endpoint of the mail service
+    :param users: iterable of subscribed user records
+    :param min_batch: the minimum number of messages per call
+    :param max_batch: the maximum number of messages per call
+    :param max_bytes: the maximum size of the message bodies per call
+    :param concurrency: maximum number of concurrent calls
+    :param workers: number of processes rendering the messages
+    :param retries: number of retries of a failed call
+    :param backoff: base delay of the exponential backoff in seconds
+    :return: the DispatchReport
+    """
+    batches = batch_messages(render_messages(users, NEWSLETTER_KEY, workers), min_batch, max_batch, max_bytes)
+    async with MailClient(url, concurrency, retries, backoff) as client:
+        return await dispatch(batches, client, concurrency)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    :param argv: the command line arguments
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description='Send the newsletter to all subscribed users.')
+    parser.add_argument('--mail-url', required=True, help='the send endpoint of the mail service')
+    parser.add_argument('--users', default=os.path.join(TEMPLATE_DIR, 'users.json'), help='the users JSON file')
+    parser.add_argument('--min-batch', type=int, default=MIN_BATCH, help='minimum number of messages per call')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='maximum number of messages per call')
+    parser.add_argument('--max-bytes', type=int, default=MAX_BATCH_BYTES, help='maximum body bytes per call')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='maximum concurrent calls')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes rendering messages')
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(send_newsletter(args.mail_url, subscribed_users(args.users), args.min_batch,
+                                         args.max_batch, args.max_bytes, args.concurrency, args.workers))
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
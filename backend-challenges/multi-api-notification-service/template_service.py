@@ -0,0 +1,254 @@
+"""
+The Template-Service of the notification challenge. It returns a template
+by id or by key, and renders templates with user data.
+
+Templates are parsed once into a compiled form and cached; a cached template
+is recompiled when its file changes. Rendering a compiled template is a
+single str.format() call with the values of the placeholders, so rendering
+a large batch of users does not re-read or re-scan the template.
+
+Usage:
+
+    python template_service.py
+"""
+# module imports
+import os
+import re
+import threading
+import time
+from operator import itemgetter
+from flask import Flask, jsonify
+from flask_restful import Api, Resource
+import errors
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+# the available templates: id -> (key, file name)
+TEMPLATES = {
+    1: ('welcome', 'templateWelcome.txt'),
+    2: ('newsletter', 'templateNewsletter.txt'),
+}
+# placeholders look like {{user.name}}, whitespace inside the braces is allowed
+PLACEHOLDER = re.compile(r'{{\s*([\w.]+)\s*}}')
+SALUTATIONS = {'male': 'Mr.', 'female': 'Ms.'}
+# the values available to the templates, computed from a user record of users.json
+USER_FIELDS = {
+    'user.salutation': lambda user: SALUTATIONS.get(user.get('gender'), ''),
+    'user.name': itemgetter('sureName'),
+    'user.first_name': itemgetter('firstName'),
+    'user.identifier': itemgetter('id'),
+    'user.email': itemgetter('email'),
+}
+
+
+class CompiledTemplate(object):
+    """
+    A template parsed into its literal text and placeholders. The literal
+    segments are joined into a format string with one positional field per
+    placeholder.
+    """
+    def __init__(self, text, fields=None):
+        """
+        Parse the template text
+
+        :param text: the template text
+        :param fields: dict of placeholder name to function computing its value from a user
+        :raise KeyError: if the template uses an unknown placeholder
+        """
+        fields = USER_FIELDS if fields is None else fields
+        self.text = text
+        self.placeholders = []
+        segments = []
+        position = 0
+        for match in PLACEHOLDER.finditer(text):
+            segments.append(text[position:match.start()].replace('{', '{{').replace('}', '}}'))
+            segments.append('{%d}' % len(self.placeholders))
+            self.placeholders.append(match.group(1))
+            position = match.end()
+        segments.append(text[position:].replace('{', '{{').replace('}', '}}'))
+        self._format = ''.join(segments).format
+        self._getters = tuple(fields[name] for name in self.placeholders)
+
+    def render(self, user):
+        """
+        Render the template for a user
+
+        :param user: the user record
+        :return: the rendered text
+        """
+        return self._format(*[getter(user) for getter in self._getters])
+
+    def render_many(self, users):
+        """
+        Render the template for many users
+
+        :param users: iterable of user records
+        :return: generator of the rendered texts
+        """
+        render_format = self._format
+        getters = self._getters
+        for user in users:
+            yield render_format(*[getter(user) for getter in getters])
+
+
+class TemplateCache(object):
+    """
+    Caches compiled templates by id and by key. The template file is checked
+    for changes at most every check_interval seconds, and recompiled if its
+    modification time or size changed.
+    """
+    def __init__(self, templates=None, directory=TEMPLATE_DIR, check_interval=1.0):
+        """
+        :param templates: dict of id to (key, file name), defaults to TEMPLATES
+        :param directory: the directory containing the template files
+        :param check_interval: seconds between checks of a template file for changes
+        """
+        templates = TEMPLATES if templates is None else templates
+        self.directory = directory
+        self.check_interval = check_interval
+        self.ids = {template_id: name for template_id, (_, name) in templates.items()}
+        self.keys = {key: template_id for template_id, (key, _) in templates.items()}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _load(self, template_id):
+        """
+        Return the compiled template, compiling it if the file changed
+
+        :param template_id: the template id
+        :return: the CompiledTemplate
+        :raise FileNotFoundError: if the template file does not exist
+        :raise KeyError: if the template uses an unknown placeholder
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(template_id)
+        if entry is not None and now - entry[0] < self.check_interval:
+            return entry[2]
+        path = os.path.join(self.directory, self.ids[template_id])
+        status = os.stat(path)
+        version = (status.st_mtime_ns, status.st_size)
+        with self._lock:
+            entry = self._entries.get(template_id)
+            if entry is None or entry[1] != version:
+                with open(path, encoding='utf-8') as stream:
+                    compiled = CompiledTemplate(stream.read())
+            else:
+                compiled = entry[2]
+            self._entries[template_id] = (now, version, compiled)
+        return compiled
+
+    def get_by_id(self, template_id):
+        """
+        Get a compiled template by its id
+
+        :param template_id: the template id
+        :return: the CompiledTemplate, or None if there is no such template
+        """
+        if template_id not in self.ids:
+            return None
+        return self._load(template_id)
+
+    def get_by_key(self, key):
+        """
+        Get a compiled template by its key
+
+        :param key: the template key, e.g. 'welcome'
+        :return: the CompiledTemplate, or None if there is no such template
+        """
+        if key not in self.keys:
+            return None
+        return self._load(self.keys[key])
+
+    def invalidate(self, template_id=None):
+        """
+        Drop a template, or all templates, from the cache
+
+        :param template_id: the template id, None for all templates
+        :return: None
+        """
+        with self._lock:
+            if template_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(template_id, None)
+
+
+# the cache used by the API
+cache = TemplateCache()
+# api instance for Flask-restful
+api = Api()
+
+
+def create_app(test_config=None):
+    """
+    The application factory of the template service
+
+    :param test_config: optional mapping of config values
+    :return: the application instance
+    """
+    app = Flask(__name__)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    api.init_app(app)
+    return app
+
+
+def template_response(template_id, load):
+    """
+    Build the JSON response for a template
+
+    :param template_id: the template id
+    :param load: function without arguments returning the CompiledTemplate, or None if it does not exist
+    :return: the response object
+    """
+    try:
+        compiled = load()
+    except FileNotFoundError:
+        return errors.error_response(errors.TEMPLATE_UNAVAILABLE, 'The template file is missing!')
+    except KeyError as error:
+        return errors.error_response(errors.TEMPLATE_INVALID, 'The template uses the unknown placeholder %s!' % error)
+    if compiled is None:
+        return errors.error_response(errors.TEMPLATE_NOT_FOUND, 'The template does not exist!')
+    return jsonify({"msg": "Success", "data": {
+        'id': template_id, 'key': TEMPLATES[template_id][0], 'template': compiled.text,
+        'placeholders': compiled.placeholders
+    }})
+
+
+class TemplateByID(Resource):
+    """
+    This Resource returns a template by its id
+    """
+    def get(self, template_id):
+        """
+        The GET request handler
+
+        :param template_id: the template id
+        :return: JSON object containing the template
+        """
+        return template_response(template_id, lambda: cache.get_by_id(template_id))
+
+
+class TemplateByKey(Resource):
+    """
+    This Resource returns a template by its key
+    """
+    def get(self, key):
+        """
+        The GET request handler
+
+        :param key: the template key
+        :return: JSON object containing the template
+        """
+        return template_response(cache.keys.get(key), lambda: cache.get_by_key(key))
+
+
+# the resource endpoints for the service
+api.add_resource(TemplateByID, '/template/<int:template_id>/')
+api.add_resource(TemplateByKey, '/template/<string:key>/')
+
+
+if __name__ == '__main__':
+    app = create_app()
+    port = int(os.environ.get('PORT', 5001))
+    app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,220 @@
+import asyncio
+import io
+import json
+import pytest
+import mail_stub
+from newsletter_dispatcher import batch_messages, iter_json_objects, render_messages, send_newsletter, \
+    subscribed_users
+
+
+def _messages(count, length=10):
+    """
+    Generate messages
+    :param count: number of messages
+    :param length: length of each body
+    :return: list of message dicts
+    """
+    return [{'to': '%d@test.de' % number, 'user': number, 'body': 'x' * length} for number in range(count)]
+
+
+def _users(count):
+    """
+    Generate subscribed users
+    :param count: number of users
+    :return: list of user records
+    """
+    return [{'id': number, 'sureName': 'Doe', 'firstName': 'John', 'gender': 'male',
+             'email': '%d@test.de' % number, 'subscribedNewsletter': True} for number in range(count)]
+
+
+def _send(users, fail_every=0, fail_status=503, **kwargs):
+    """
+    Send the newsletter to a stand-in mail service
+    :param users: the users
+    :param fail_every: let every n-th call fail
+    :param fail_status: the status code of the failed calls
+    :return: tuple of the DispatchReport and the MailStubState
+    """
+    async def run():
+        state = mail_stub.MailStubState(fail_every=fail_every, fail_status=fail_status)
+        runner, url = await mail_stub.start(state)
+        try:
+            return await send_newsletter(url, users, backoff=0.001, **kwargs), state
+        finally:
+            await runner.cleanup()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('count', [10, 25, 100, 101, 105, 119, 999])
+def test_batch_messages(count):
+    """
+    All messages are sent once, in batches of at least 10 and at most 50
+    :param count: number of messages
+    :return: None
+    """
+    batches = list(batch_messages(_messages(count), 10, 50))
+    assert [message['user'] for batch in batches for message in batch] == list(range(count))
+    assert all(10 <= len(batch) <= 50 for batch in batches)
+
+
+def test_batch_messages_bytes():
+    """
+    Batches are closed at the byte limit, but never below the minimum size
+    :return: None
+    """
+    batches = list(batch_messages(_messages(100, length=100), 10, 50, max_bytes=2000))
+    assert [len(batch) for batch in batches] == [20] * 5
+    batches = list(batch_messages(_messages(30, length=100), 10, 50, max_bytes=100))
+    assert [len(batch) for batch in batches] == [10] * 3
+
+
+@pytest.mark.parametrize('count', [15, 19, 20, 29, 35])
+def test_batch_messages_tail(count):
+    """
+    A small last batch is never combined beyond the maximum size; if the
+    messages can not be split into batches of the allowed sizes, the last
+    batch is smaller
+    :param count: number of messages
+    :return: None
+    """
+    batches = list(batch_messages(_messages(count), 10, 10))
+    assert [message['user'] for batch in batches for message in batch] == list(range(count))
+    assert [len(batch) for batch in batches] == [10] * (count // 10) + ([count % 10] if count % 10 else [])
+    batches = list(batch_messages(_messages(count), 10, 12))
+    assert all(10 <= len(batch) <= 12 for batch in batches[:-1])
+    assert len(batches[-1]) <= 12
+
+
+def test_batch_messages_tail_bytes():
+    """
+    A small last batch is only combined with the previous one within the byte
+    limit, unless that would leave a batch below the minimum
+    :return: None
+    """
+    batches = list(batch_messages(_messages(45, length=100), 10, 50, max_bytes=4000))
+    assert [len(batch) for batch in batches] == [22, 23]
+    batches = list(batch_messages(_messages(15, length=100), 10, 50, max_bytes=500))
+    assert [len(batch) for batch in batches] == [15]
+
+
+def test_batch_messages_few():
+    """
+    With fewer messages than the minimum, a single smaller batch is produced
+    :return: None
+    """
+    assert [len(batch) for batch in batch_messages(_messages(3), 10, 50)] == [3]
+    assert list(batch_messages([], 10, 50)) == []
+    with pytest.raises(ValueError):
+        list(batch_messages(_messages(3), 10, 5))
+
+
+def test_iter_json_objects():
+    """
+    The objects of a JSON array are parsed while the file is read, also
+    across chunk boundaries and with braces and quotes in their strings
+    :return: None
+    """
+    users = _users(50) + [{'id': 50, 'note': 'tru\u00e9 "quoted" {\\} ' * 20, 'score': -1.5e3},
+                          {'id': 51, 'address': {'city': '}{', 'tags': [{}]}}]
+    text = json.dumps(users, indent=2)
+    assert list(iter_json_objects(io.StringIO(text), chunk_size=7)) == users
+    assert list(iter_json_objects(io.StringIO('[]'))) == []
+
+
+@pytest.mark.parametrize('invalid', ['[{"id": 1},]', '[{"id": 1},,{"id": 2}]', '[1]', '{"id": 1}', '[{"id": 1}'])
+def test_iter_json_objects_not_array_of_objects(invalid):
+    """
+    A file which is not an array of objects, e.g. with a trailing comma, fails
+    :param invalid: the file content
+    :return: None
+    """
+    with pytest.raises(ValueError):
+        list(iter_json_objects(io.StringIO(invalid)))
+
+
+class CountingStream(io.StringIO):
+    """
+    Stream counting the characters read
+    """
+    def __init__(self, text):
+        super(CountingStream, self).__init__(text)
+        self.characters = 0
+
+    def read(self, size=-1):
+        chunk = super(CountingStream, self).read(size)
+        self.characters += len(chunk)
+        return chunk
+
+
+@pytest.mark.parametrize('invalid', ['{"id": x}', '{"id": 1 "name": 2}', '{"id": 1} {"id": 2}'])
+def test_iter_json_objects_invalid(invalid):
+    """
+    An invalid object fails once it was read, not at the end of the file
+    :param invalid: the invalid object
+    :return: None
+    """
+    stream = CountingStream('[' + invalid + ', ' + json.dumps(_users(1000)) + ']')
+    with pytest.raises(ValueError):
+        list(iter_json_objects(stream, chunk_size=64))
+    assert stream.characters <= 128
+
+
+def test_iter_json_objects_limit():
+    """
+    An element that does not end is not buffered beyond the size limit
+    :return: None
+    """
+    stream = CountingStream('[{"id": "' + 'x' * 100000)
+    with pytest.raises(ValueError, match='larger than'):
+        list(iter_json_objects(stream, chunk_size=64, max_size=1000))
+    assert stream.characters < 2000
+
+
+def test_render_messages():
+    """
+    The newsletter is rendered for the subscribed users of users.json
+    :return: None
+    """
+    messages = list(render_messages(subscribed_users()))
+    assert len(messages) == 18
+    assert 44 not in [message['user'] for message in messages]
+    assert messages[0]['to'] == 'tom.turner@provider.de'
+    assert messages[0]['body'].startswith('Hello dear Mr. Turner,')
+    assert messages[0]['body'].endswith('/unsubscribe-newsletter/42\n\nBest Regards,\nYour Customer Support Team')
+
+
+def test_send_newsletter():
+    """
+    All messages reach the mail service in batches of the allowed size
+    :return: None
+    """
+    report, state = _send(_users(1234), max_batch=100, concurrency=4)
+    assert report.messages == state.messages == 1234
+    assert report.calls == state.calls == report.batches == 13
+    assert state.rejected_calls == 0
+    assert all(10 <= size <= 100 for size in state.batch_sizes)
+
+
+def test_send_newsletter_retries():
+    """
+    Failed calls are retried
+    :return: None
+    """
+    report, state = _send(_users(500), fail_every=3, max_batch=50)
+    assert report.messages == state.messages == 500
+    assert report.failed_batches == 0
+    assert report.calls == state.calls > report.batches
+
+
+@pytest.mark.parametrize('status', [500, 502, 504])
+def test_send_newsletter_no_retry_if_processed(status):
+    """
+    Calls that may have been processed by the mail service are not retried,
+    the messages are never sent twice
+    :param status: the status code of the failed calls
+    :return: None
+    """
+    report, state = _send(_users(500), fail_every=3, fail_status=status, max_batch=50)
+    assert report.calls == state.calls == report.batches == 10
+    assert report.failed_batches == state.failed_calls == 3
+    assert report.messages == state.messages == 350
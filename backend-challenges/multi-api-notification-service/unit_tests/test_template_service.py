@@ -0,0 +1,108 @@
+import os
+import pytest
+from flask import json
+import template_service
+from template_service import CompiledTemplate, TemplateCache, create_app
+
+USER = {"id": 42, "sureName": "Turner", "firstName": "Tom", "gender": "male",
+        "email": "tom.turner@provider.de", "subscribedNewsletter": True}
+
+
+@pytest.fixture()
+def client():
+    app = create_app({'TESTING': True})
+    return app.test_client()
+
+
+def test_render():
+    """
+    Placeholders are replaced and literal braces are kept
+    :return: None
+    """
+    template = CompiledTemplate('Hello {{user.salutation}} {{ user.name }} {x}\n/{{user.identifier}}')
+    assert template.placeholders == ['user.salutation', 'user.name', 'user.identifier']
+    assert template.render(USER) == 'Hello Mr. Turner {x}\n/42'
+    female = dict(USER, gender='female', sureName='Smith', id=44)
+    assert list(template.render_many([USER, female])) == [
+        'Hello Mr. Turner {x}\n/42', 'Hello Ms. Smith {x}\n/44'
+    ]
+
+
+def test_render_unknown_placeholder():
+    """
+    An unknown placeholder is reported when the template is compiled
+    :return: None
+    """
+    with pytest.raises(KeyError):
+        CompiledTemplate('Hello {{user.unknown}}')
+
+
+def test_cache(tmp_path):
+    """
+    Templates are compiled once and recompiled when the file changes
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    path = tmp_path / 'template.txt'
+    path.write_text('Hi {{user.name}}', encoding='utf-8')
+    cache = TemplateCache({7: ('test', 'template.txt')}, str(tmp_path), check_interval=0)
+    template = cache.get_by_key('test')
+    assert cache.get_by_id(7) is template
+    assert template.render(USER) == 'Hi Turner'
+
+    path.write_text('Good bye {{user.name}}', encoding='utf-8')
+    assert cache.get_by_id(7).render(USER) == 'Good bye Turner'
+    assert cache.get_by_id(8) is None
+    assert cache.get_by_key('unknown') is None
+
+
+def test_template_by_id(client):
+    """
+    Get the welcome template by id
+    :param client: client object of Flask
+    :return: None
+    """
+    response = client.get('/template/1/')
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 200
+    assert data["data"]["key"] == "welcome"
+    with open(os.path.join(os.path.dirname(__file__), '..', 'templateWelcome.txt'), encoding='utf-8') as stream:
+        assert data["data"]["template"] == stream.read()
+
+
+def test_template_by_key(client):
+    """
+    Get the newsletter template by key, and a template that does not exist
+    :param client: client object of Flask
+    :return: None
+    """
+    response = client.get('/template/newsletter/')
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 200
+    assert data["data"]["id"] == 2
+    assert data["data"]["placeholders"] == ["user.salutation", "user.name", "user.identifier"]
+
+    response = client.get('/template/unknown/')
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 404
+    assert data["error"]["code"] == "template_not_found"
+
+
+def test_template_errors(client, monkeypatch, tmp_path):
+    """
+    A missing template file and an unknown placeholder are reported as errors
+    :param client: client object of Flask
+    :param monkeypatch: the monkeypatch fixture
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    (tmp_path / 'invalid.txt').write_text('Hi {{user.unknown}}', encoding='utf-8')
+    cache = TemplateCache({7: ('invalid', 'invalid.txt'), 8: ('missing', 'missing.txt')}, str(tmp_path))
+    monkeypatch.setattr(template_service, 'cache', cache)
+    for path, status, code in (('/template/7/', 500, 'template_invalid'),
+                               ('/template/invalid/', 500, 'template_invalid'),
+                               ('/template/missing/', 503, 'template_unavailable')):
+        response = client.get(path)
+        data = json.loads(response.get_data(as_text=True))
+        assert response.status_code == status
+        assert data["error"]["code"] == code
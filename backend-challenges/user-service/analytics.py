@@ -0,0 +1,494 @@
+"""
+Course analytics for the data-engineer and fullstack challenges.
+
+The summary tables (CourseStats, UserStats and CourseRanking) are updated
+incrementally while certificates are ingested, so the analytics endpoints
+never have to aggregate the whole certificate table. This module can also
+recompute them from scratch to verify or repair them, and brings certificate
+tables created before the durations were stored up to date (see migrate).
+
+Usage (from the user-service directory):
+
+    python analytics.py --verify
+    python analytics.py --rebuild
+"""
+# module imports
+import argparse
+import sys
+from datetime import datetime
+from sqlalchemy import bindparam, exists, func, inspect, select, text
+from models import NO_START, Certificate, Course, CourseRanking, CourseStats, UserStats, db, duration_ms, \
+    upsert_insert
+
+# number of fastest and slowest completions kept per course
+TOP_K = 5
+FASTEST = 'fastest'
+SLOWEST = 'slowest'
+# number of users per lookup of existing certificates
+_LOOKUP_CHUNK = 500
+# number of certificates per update of the migration
+_MIGRATE_CHUNK = 5000
+
+
+def certificate_key(row):
+    """
+    The natural key of a certificate row
+
+    :param row: dict or row with course_id, user_external_id and started_at
+    :return: tuple identifying the certificate
+    """
+    return row['course_id'], row['user_external_id'], row['started_at']
+
+
+def existing_durations(connection, rows):
+    """
+    Look up the certificates of a batch that are already stored
+
+    :param connection: the database connection
+    :param rows: the certificate rows about to be written
+    :return: dict of certificate key to the stored duration (None if not completed)
+    """
+    keys = {certificate_key(row) for row in rows}
+    users = sorted({key[1] for key in keys})
+    table = Certificate.__table__
+    found = {}
+    for start in range(0, len(users), _LOOKUP_CHUNK):
+        result = connection.execute(
+            select(table.c.course_id, table.c.user_external_id, table.c.started_at, table.c.duration_ms)
+            .where(table.c.user_external_id.in_(users[start:start + _LOOKUP_CHUNK])))
+        for course_id, user_external_id, started_at, duration in result:
+            key = (course_id, user_external_id, started_at)
+            if key in keys:
+                found[key] = duration
+    return found
+
+
+def _add_totals(connection, model, key_column, deltas):
+    """
+    Add count and duration deltas to a running totals table
+
+    :param connection: the database connection
+    :param model: CourseStats or UserStats
+    :param key_column: name of the primary key column of the table
+    :param deltas: dict of key to [count delta, duration delta]
+    :return: None
+    """
+    rows = [{key_column: key, 'certificate_count': count, 'total_duration_ms': total}
+            for key, (count, total) in deltas.items() if count or total]
+    if not rows:
+        return
+    table = model.__table__
+    statement = upsert_insert(connection, table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[key_column],
+        set_={'certificate_count': table.c.certificate_count + statement.excluded.certificate_count,
+              'total_duration_ms': table.c.total_duration_ms + statement.excluded.total_duration_ms})
+    connection.execute(statement, rows)
+
+
+def _ranked(entries, kind, top_k):
+    """
+    Select the fastest or slowest entries
+
+    :param entries: iterable of (user_external_id, started_at, duration_ms) tuples
+    :param kind: FASTEST or SLOWEST
+    :param top_k: number of entries to keep
+    :return: list of the selected entries in rank order
+    """
+    sign = 1 if kind == FASTEST else -1
+    return sorted(entries, key=lambda entry: (sign * entry[2], entry[0], entry[1] or datetime.min))[:top_k]
+
+
+def _ranking_from_certificates(connection, course_id, top_k):
+    """
+    Compute the ranking of a course from the certificate table
+
+    :param connection: the database connection
+    :param course_id: the course id
+    :param top_k: number of entries per kind
+    :return: dict of kind to list of (user_external_id, started_at, duration_ms)
+    """
+    table = Certificate.__table__
+    query = select(table.c.user_external_id, table.c.started_at, table.c.duration_ms) \
+        .where(table.c.course_id == course_id, table.c.duration_ms.isnot(None))
+    return {
+        FASTEST: [tuple(row) for row in connection.execute(
+            query.order_by(table.c.duration_ms, table.c.user_external_id, table.c.started_at).limit(top_k))],
+        SLOWEST: [tuple(row) for row in connection.execute(
+            query.order_by(table.c.duration_ms.desc(), table.c.user_external_id, table.c.started_at).limit(top_k))],
+    }
+
+
+def _write_ranking(connection, course_id, ranking):
+    """
+    Replace the stored ranking of a course
+
+    :param connection: the database connection
+    :param course_id: the course id
+    :param ranking: dict of kind to list of (user_external_id, started_at, duration_ms)
+    :return: None
+    """
+    table = CourseRanking.__table__
+    connection.execute(table.delete().where(table.c.course_id == course_id))
+    rows = [{'course_id': course_id, 'kind': kind, 'position': position, 'user_external_id': entry[0],
+             'started_at': entry[1], 'duration_ms': entry[2]}
+            for kind, entries in ranking.items() for position, entry in enumerate(entries, 1)]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def _update_ranking(connection, course_id, candidates, changed, top_k):
+    """
+    Merge new completions into the stored ranking of a course. If a certificate
+    that is part of the ranking changed, the course is recomputed instead,
+    since it may have to be replaced by one that is not stored.
+
+    :param connection: the database connection
+    :param course_id: the course id
+    :param candidates: list of (user_external_id, started_at, duration_ms) of the changed certificates
+    :param changed: set of keys of the changed certificates that were stored before
+    :param top_k: number of entries per kind
+    :return: None
+    """
+    table = CourseRanking.__table__
+    stored = {}
+    for kind, user_external_id, started_at, duration in connection.execute(
+            select(table.c.kind, table.c.user_external_id, table.c.started_at, table.c.duration_ms)
+            .where(table.c.course_id == course_id).order_by(table.c.kind, table.c.position)):
+        stored.setdefault(kind, []).append((user_external_id, started_at, duration))
+
+    if any((course_id, entry[0], entry[1]) in changed for entries in stored.values() for entry in entries):
+        ranking = _ranking_from_certificates(connection, course_id, top_k)
+    else:
+        pool = {(entry[0], entry[1]): entry for entries in stored.values() for entry in entries}
+        pool.update(((entry[0], entry[1]), entry) for entry in candidates)
+        ranking = {kind: _ranked(pool.values(), kind, top_k) for kind in (FASTEST, SLOWEST)}
+    if ranking != {kind: stored.get(kind, []) for kind in (FASTEST, SLOWEST)}:
+        _write_ranking(connection, course_id, ranking)
+
+
+def record_certificates(connection, rows, previous, top_k=TOP_K):
+    """
+    Update the summary tables for a batch of certificates that was just written
+
+    :param connection: the database connection, inside the batch transaction
+    :param rows: the written certificate rows, at most one per certificate key
+    :param previous: the result of existing_durations() before the batch was written
+    :param top_k: number of fastest and slowest completions kept per course
+    :return: None
+    """
+    course_deltas = {}
+    user_deltas = {}
+    candidates = {}
+    changed = set()
+    for row in rows:
+        key = certificate_key(row)
+        duration = row['duration_ms']
+        old = previous.get(key)
+        if key in previous:
+            if old == duration:
+                continue
+            changed.add(key)
+        for deltas, name in ((course_deltas, row['course_id']), (user_deltas, row['user_external_id'])):
+            delta = deltas.setdefault(name, [0, 0])
+            if old is not None:
+                delta[0] -= 1
+                delta[1] -= old
+            if duration is not None:
+                delta[0] += 1
+                delta[1] += duration
+        course_candidates = candidates.setdefault(row['course_id'], [])
+        if duration is not None:
+            course_candidates.append((row['user_external_id'], row['started_at'], duration))
+
+    _add_totals(connection, CourseStats, 'course_id', course_deltas)
+    _add_totals(connection, UserStats, 'user_external_id', user_deltas)
+    for course_id, course_candidates in candidates.items():
+        _update_ranking(connection, course_id, course_candidates, changed, top_k)
+
+
+def forget_users(connection, user_external_ids, top_k=TOP_K):
+    """
+    Delete the certificates of imported users and take them out of the
+    summary tables, e.g. before the users are purged
+
+    :param connection: the database connection
+    :param user_external_ids: list of external user ids
+    :param top_k: number of fastest and slowest completions kept per course
+    :return: None
+    """
+    table = Certificate.__table__
+    ranking = CourseRanking.__table__
+    course_deltas = {course_id: [-count, -total] for course_id, count, total in connection.execute(
+        select(table.c.course_id, func.count(), func.sum(table.c.duration_ms))
+        .where(table.c.user_external_id.in_(user_external_ids), table.c.duration_ms.isnot(None))
+        .group_by(table.c.course_id))}
+    ranked = [course_id for (course_id,) in connection.execute(
+        select(ranking.c.course_id).where(ranking.c.user_external_id.in_(user_external_ids)).distinct())]
+    connection.execute(table.delete().where(table.c.user_external_id.in_(user_external_ids)))
+    connection.execute(UserStats.__table__.delete().where(
+        UserStats.__table__.c.user_external_id.in_(user_external_ids)))
+    _add_totals(connection, CourseStats, 'course_id', course_deltas)
+    for course_id in ranked:
+        _write_ranking(connection, course_id, _ranking_from_certificates(connection, course_id, top_k))
+
+
+def migrate(connection):
+    """
+    Bring a certificate table created before the durations were stored up to
+    date: add the duration_ms column and its index, store the start of
+    certificates without a start date as NO_START (keeping one of them per
+    course and user) and fill the durations of the completed certificates.
+    The summary tables have to be rebuilt if durations were filled. Running it
+    again does nothing.
+
+    :param connection: the database connection
+    :return: the number of durations filled
+    """
+    table = Certificate.__table__
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        return 0
+    if 'duration_ms' not in {column['name'] for column in inspector.get_columns(table.name)}:
+        column_type = table.c.duration_ms.type.compile(dialect=connection.dialect)
+        connection.execute(text('ALTER TABLE %s ADD COLUMN duration_ms %s' % (table.name, column_type)))
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+    # NULL starts are distinct in the unique key, so a certificate may have been stored several times
+    missing = table.c.started_at.is_(None)
+    other = table.alias('other')
+    connection.execute(table.delete().where(missing, exists().where(
+        other.c.course_id == table.c.course_id, other.c.user_external_id == table.c.user_external_id,
+        (other.c.started_at == NO_START) | (other.c.started_at.is_(None) & (other.c.id > table.c.id)))))
+    connection.execute(table.update().where(missing).values(started_at=NO_START))
+
+    filled = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.started_at, table.c.completed_at)
+            .where(table.c.id > last_id, table.c.duration_ms.is_(None), table.c.completed_at.isnot(None),
+                   table.c.started_at != NO_START)
+            .order_by(table.c.id).limit(_MIGRATE_CHUNK)).all()
+        if not rows:
+            return filled
+        connection.execute(
+            table.update().where(table.c.id == bindparam('certificate_id')).values(duration_ms=bindparam('duration')),
+            [{'certificate_id': row.id, 'duration': duration_ms(row.started_at, row.completed_at)} for row in rows])
+        filled += len(rows)
+        last_id = rows[-1].id
+
+
+def compute_full(connection, top_k=TOP_K):
+    """
+    Compute all analytics from the certificate table
+
+    :param connection: the database connection
+    :param top_k: number of fastest and slowest completions per course
+    :return: dict with the 'courses', 'users' and 'rankings' totals
+    """
+    table = Certificate.__table__
+    completed = table.c.duration_ms.isnot(None)
+    courses = {course_id: (count, total) for course_id, count, total in connection.execute(
+        select(table.c.course_id, func.count(), func.sum(table.c.duration_ms))
+        .where(completed).group_by(table.c.course_id))}
+    users = {user: (count, total) for user, count, total in connection.execute(
+        select(table.c.user_external_id, func.count(), func.sum(table.c.duration_ms))
+        .where(completed).group_by(table.c.user_external_id))}
+    rankings = {course_id: _ranking_from_certificates(connection, course_id, top_k) for course_id in courses}
+    return {'courses': courses, 'users': users, 'rankings': rankings}
+
+
+def load_summaries(connection):
+    """
+    Read the incrementally maintained summary tables
+
+    :param connection: the database connection
+    :return: dict in the same format as compute_full()
+    """
+    courses = {course_id: (count, total) for course_id, count, total in connection.execute(
+        select(CourseStats.course_id, CourseStats.certificate_count, CourseStats.total_duration_ms)) if count}
+    users = {user: (count, total) for user, count, total in connection.execute(
+        select(UserStats.user_external_id, UserStats.certificate_count, UserStats.total_duration_ms)) if count}
+    rankings = {}
+    for course_id, kind, user_external_id, started_at, duration in connection.execute(
+            select(CourseRanking.course_id, CourseRanking.kind, CourseRanking.user_external_id,
+                   CourseRanking.started_at, CourseRanking.duration_ms)
+            .order_by(CourseRanking.course_id, CourseRanking.kind, CourseRanking.position)):
+        ranking = rankings.setdefault(course_id, {FASTEST: [], SLOWEST: []})
+        ranking[kind].append((user_external_id, started_at, duration))
+    return {'courses': courses, 'users': users, 'rankings': rankings}
+
+
+def verify(connection, top_k=TOP_K):
+    """
+    Compare the summary tables with a full recompute
+
+    :param connection: the database connection
+    :param top_k: number of fastest and slowest completions per course
+    :return: list of descriptions of the differences, empty if the tables are correct
+    """
+    expected = compute_full(connection, top_k)
+    actual = load_summaries(connection)
+    problems = []
+    for section in ('courses', 'users', 'rankings'):
+        for key in sorted(set(expected[section]) | set(actual[section])):
+            if expected[section].get(key) != actual[section].get(key):
+                problems.append('%s %s: expected %r, stored %r' % (
+                    section, key, expected[section].get(key), actual[section].get(key)))
+    return problems
+
+
+def rebuild(connection, top_k=TOP_K):
+    """
+    Replace the summary tables with a full recompute, after migrating the
+    certificate table if needed
+
+    :param connection: the database connection
+    :param top_k: number of fastest and slowest completions per course
+    :return: None
+    """
+    migrate(connection)
+    full = compute_full(connection, top_k)
+    for model in (CourseStats, UserStats, CourseRanking):
+        connection.execute(model.__table__.delete())
+    if full['courses']:
+        connection.execute(CourseStats.__table__.insert(), [
+            {'course_id': key, 'certificate_count': count, 'total_duration_ms': total}
+            for key, (count, total) in full['courses'].items()])
+    if full['users']:
+        connection.execute(UserStats.__table__.insert(), [
+            {'user_external_id': key, 'certificate_count': count, 'total_duration_ms': total}
+            for key, (count, total) in full['users'].items()])
+    for course_id, ranking in full['rankings'].items():
+        _write_ranking(connection, course_id, ranking)
+
+
+def _average_seconds(count, total):
+    """
+    Average duration in seconds
+
+    :param count: number of completions
+    :param total: total duration in milliseconds
+    :return: the average in seconds, or None without completions
+    """
+    return total / count / 1000.0 if count else None
+
+
+def _ranking_entries(course_id, kind):
+    """
+    Read the stored ranking of a course for the API
+
+    :param course_id: the course id
+    :param kind: FASTEST or SLOWEST
+    :return: list of dicts in rank order
+    """
+    entries = CourseRanking.query.filter_by(course_id=course_id, kind=kind).order_by(CourseRanking.position)
+    return [{'user': entry.user_external_id, 'started_at': entry.started_at.isoformat(),
+             'duration_seconds': entry.duration_ms / 1000.0} for entry in entries]
+
+
+def course_overview():
+    """
+    Average completion time over all courses and per course
+
+    :return: dict with the overall average and the list of courses
+    """
+    rows = db.session.query(Course.id, Course.title, CourseStats.certificate_count, CourseStats.total_duration_ms) \
+        .outerjoin(CourseStats, CourseStats.course_id == Course.id).order_by(Course.title).all()
+    count = sum(row[2] or 0 for row in rows)
+    total = sum(row[3] or 0 for row in rows)
+    courses = [{'id': course_id, 'title': title, 'certificates': course_count or 0,
+                'average_completion_seconds': _average_seconds(course_count, course_total or 0)}
+               for course_id, title, course_count, course_total in rows]
+    return {'certificates': count, 'average_completion_seconds': _average_seconds(count, total), 'courses': courses}
+
+
+def course_detail(course_id):
+    """
+    Statistics and fastest versus slowest users of a course
+
+    :param course_id: the course id
+    :return: dict with the course statistics, or None if the course does not exist
+    """
+    course = Course.query.filter_by(id=course_id).first()
+    if course is None:
+        return None
+    stats = CourseStats.query.filter_by(course_id=course_id).first()
+    count, total = (stats.certificate_count, stats.total_duration_ms) if stats is not None else (0, 0)
+    return {'id': course.id, 'title': course.title, 'certificates': count,
+            'average_completion_seconds': _average_seconds(count, total),
+            FASTEST: _ranking_entries(course_id, FASTEST), SLOWEST: _ranking_entries(course_id, SLOWEST)}
+
+
+def _user_entry(stats):
+    """
+    Convert a UserStats record for the API
+
+    :param stats: the UserStats record
+    :return: dict with the user statistics
+    """
+    return {'user': stats.user_external_id, 'certificates': stats.certificate_count,
+            'average_completion_seconds': _average_seconds(stats.certificate_count, stats.total_duration_ms)}
+
+
+def user_overview(limit, offset):
+    """
+    Number of certificates and average completion time per user
+
+    :param limit: maximum number of users returned
+    :param offset: number of users skipped
+    :return: list of dicts, users with most certificates first
+    """
+    query = UserStats.query.filter(UserStats.certificate_count > 0) \
+        .order_by(UserStats.certificate_count.desc(), UserStats.user_external_id)
+    return [_user_entry(stats) for stats in query.limit(limit).offset(offset)]
+
+
+def user_detail(user_external_id):
+    """
+    Number of certificates and average completion time of a user
+
+    :param user_external_id: the external id of the user
+    :return: dict with the user statistics, or None if the user has no certificates
+    """
+    stats = UserStats.query.filter_by(user_external_id=user_external_id).first()
+    if stats is None or not stats.certificate_count:
+        return None
+    return _user_entry(stats)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    :param argv: the command line arguments
+    :return: the exit code
+    """
+    parser = argparse.ArgumentParser(description='Verify or rebuild the course analytics summary tables.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--verify', action='store_true', help='compare the summary tables with a full recompute')
+    group.add_argument('--rebuild', action='store_true', help='replace the summary tables with a full recompute')
+    parser.add_argument('--top-k', type=int, default=TOP_K, help='fastest and slowest completions per course')
+    parser.add_argument('--config', default='config.py', help='the Flask config file')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    app = create_app(args.config)
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            if args.rebuild:
+                rebuild(connection, args.top_k)
+                print('Rebuilt the analytics summary tables')
+                return 0
+            problems = verify(connection, args.top_k)
+    for problem in problems:
+        print(problem)
+    print('%d differences found' % len(problems))
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
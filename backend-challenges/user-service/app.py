@@ -1,30 +1,78 @@
 # module imports
 import os
-from flask import Flask, jsonify, request, flash
+from flask import Flask, current_app, jsonify, request
 from flask_restful import Resource, Api
-from models import Email, User, PhoneNumber, db
-from sqlalchemy import func
+from models import BreachFinding, BreachReport, Email, User, PhoneNumber, PurgeJob, UserDeletion, db
+import batch
+import coalescing
+import errors
+import purge
+import reads
+from sqlalchemy import exists
+# analytics, breach, profiling and query_audit are rarely used, they are imported
+# when they are needed to keep the start up of the workers short
 
 # api instance for Flask-restful
 api = Api()
 
 
-def create_app(config_file):
+def create_app(config_file, test_config=None):
     """
     The application factory to create multiple instances of Flask app
 
     :param config_file: the config file used for Flask
+    :param test_config: optional mapping overriding values of the config file
     :return: the application instance
     """
     # initialize the Flask app and get the configuration from file
     app = Flask(__name__)
     app.config.from_pyfile(config_file)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
     # initialize the Api and db
     api.init_app(app)
     db.init_app(app)
+    # the tables are created by an explicit step, see init_db
+    app.cli.command('init-db')(init_db)
+    if app.config.get('QUERY_AUDIT', False):
+        import query_audit
+        query_audit.init_app(app)
+    if app.config.get('PROFILE_SAMPLE_RATE', 0) or app.config.get('PROFILE_TOKEN') is not None:
+        import profiling
+        profiling.init_app(app)
+    coalescing.init_app(app)
+    purge.init_app(app)
     return app
 
 
+def init_db():
+    """
+    Create the tables that do not exist yet, e.g. added after the database
+    was set up, and migrate the certificate table (see analytics.migrate).
+    Run it once per deployment, before the workers start:
+
+        FLASK_APP=wsgi.py flask init-db
+
+    :return: None
+    """
+    db.create_all()
+    analytics = _analytics()
+    with db.engine.begin() as connection:
+        if analytics.migrate(connection):
+            # the summaries do not contain the certificates whose durations were just filled
+            analytics.rebuild(connection)
+
+
+def _analytics():
+    """
+    Import the analytics module on first use, see the note on the imports
+
+    :return: the analytics module
+    """
+    import analytics
+    return analytics
+
+
 class UserGetByID(Resource):
     """
     This Resource returns details of a user by providing user id
@@ -36,23 +84,21 @@ class UserGetByID(Resource):
         :param id: the user id
         :return: json object containing user info
         """
-        # proceed with get request
-        user_object = User.query.filter_by(id=id).first()
-        if user_object is not None:
-            # get the user's email and contact info
-            email_objects = Email.query.filter_by(user_id=user_object.id).all()
-            emails = [obj.mail for obj in email_objects]
-            phone_objects = PhoneNumber.query.filter_by(user_id=user_object.id).all()
-            phone_nums = [obj.phone for obj in phone_objects]
-            data = {
-                'id': user_object.id, 'last_name': user_object.last_name,
-                'first_name': user_object.first_name, 'mail': emails,
-                'phone': phone_nums
-            }
-            return jsonify({"msg": "Success", "data": data})
-        msg = "User does not exist"
-        flash(msg, 'error')
-        return jsonify({"msg": msg})
+        # concurrent requests for the same user share one lookup
+        return coalescing.coalesce(coalescing.user_key(id), lambda: self.fetch(id))
+
+    @staticmethod
+    def fetch(id):
+        """
+        Look up the user, without loading ORM objects
+
+        :param id: the user id
+        :return: json object containing user info
+        """
+        user_record = reads.get_user(id)
+        if user_record is not None:
+            return jsonify({"msg": "Success", "data": user_record.to_dict()})
+        return errors.error_response(errors.USER_NOT_FOUND, "User does not exist")
 
 
 class UserGetByName(Resource):
@@ -66,34 +112,27 @@ class UserGetByName(Resource):
 
         :return: list containing JSON object for each user
         """
-        data = []
         # check if user specified an empty name
         first_name = request.args.get('first_name')
         last_name = request.args.get('last_name')
         if first_name is None or last_name is None:
-            msg = "Please specify first and last names."
-            flash(msg, 'error')
-        else:
-            # proceed with get request - use func.lower() function to remove case sensitivity
-            user_objects = User.query.filter(func.lower(User.first_name) == func.lower(first_name),
-                                             func.lower(User.last_name) == func.lower(last_name)).all()
-            if user_objects is not None:
-                for user_object in user_objects:
-                    # get the user's email and contact info
-                    email_objects = Email.query.filter_by(user_id=user_object.id).all()
-                    emails = [obj.mail for obj in email_objects]
-                    phone_objects = PhoneNumber.query.filter_by(user_id=user_object.id).all()
-                    phone_nums = [obj.phone for obj in phone_objects]
-                    user_info = {
-                                'id': user_object.id, 'last_name': user_object.last_name,
-                                'first_name': user_object.first_name, 'mail': emails,
-                                'phone': phone_nums
-                            }
-                    data.append(user_info)
-                return jsonify({"msg": "Success", "data": data})
-            msg = "User does not exist"
-            flash(msg, 'error')
-        return jsonify({"msg": msg})
+            return errors.error_response(errors.MISSING_FIELDS, "Please specify first and last names.")
+        # proceed with get request - the names are compared in lower case to remove case sensitivity,
+        # concurrent requests for the same name share one lookup
+        return coalescing.coalesce(coalescing.name_key(first_name, last_name),
+                                   lambda: self.fetch(first_name, last_name))
+
+    @staticmethod
+    def fetch(first_name, last_name):
+        """
+        Look up the users with the name
+
+        :param first_name: the first name
+        :param last_name: the last name
+        :return: list containing JSON object for each user
+        """
+        data = [user_record.to_dict() for user_record in reads.find_users(first_name, last_name)]
+        return jsonify({"msg": "Success", "data": data})
 
 
 class UserAddPhone(Resource):
@@ -106,29 +145,26 @@ class UserAddPhone(Resource):
 
         :return: JSON containing status message of the operation
         """
-        user_data = request.get_json()
+        user_data = request.get_json(silent=True)
         # check if user has specified all the fields
         if user_data is None or 'phone' not in user_data or 'id' not in user_data:
-            msg = 'Please specify all the requested fields!'
-            flash(msg, 'error')
-        else:
-            # check if phone number already exists
-            user_object = User.query.filter_by(id=user_data['id']).first()
-            if user_object is not None:
-                phone_obj = PhoneNumber.query.filter_by(phone=user_data['phone'], user_id=user_object.id).first()
-                if phone_obj is None:
-                    # proceed with adding new phone number to the user
-                    # create a new PhoneNumber record in db for the user
-                    phone_number_object = PhoneNumber(user_data['phone'], user_object.id)
-                    db.session.add(phone_number_object)
-                    db.session.commit()
-                    msg = 'Added new phone number for user successfully!'
-                else:
-                    msg = 'The specified phone number already exists for the user!'
-            else:
-                msg = 'The specified user does not exist!'
-
-        return jsonify({"msg": msg})
+            return errors.error_response(errors.MISSING_FIELDS, 'Please specify all the requested fields!')
+        # check if phone number already exists
+        user_object = User.active().filter_by(id=user_data['id']).first()
+        if user_object is None:
+            return errors.error_response(errors.USER_NOT_FOUND, 'The specified user does not exist!')
+        phone_obj = PhoneNumber.query.filter_by(phone=user_data['phone'], user_id=user_object.id).first()
+        if phone_obj is not None:
+            return errors.error_response(errors.PHONE_EXISTS,
+                                         'The specified phone number already exists for the user!')
+        # proceed with adding new phone number to the user
+        # create a new PhoneNumber record in db for the user
+        phone_number_object = PhoneNumber(user_data['phone'], user_object.id)
+        db.session.add(phone_number_object)
+        coalescing_keys = coalescing.user_keys(user_object)
+        batch.commit()
+        coalescing.invalidate(coalescing_keys)
+        return jsonify({"msg": 'Added new phone number for user successfully!'})
 
 
 class UserAddEmail(Resource):
@@ -141,29 +177,25 @@ class UserAddEmail(Resource):
 
         :return: JSON object containing the status message of the operation
         """
-        user_data = request.get_json()
+        user_data = request.get_json(silent=True)
         # check if user data contains email field and user id
         if user_data is None or 'mail' not in user_data or 'id' not in user_data:
-            msg = 'Please specify all the requested fields!'
-            flash(msg, 'error')
-        else:
-            # check if user already has the email
-            user_object = User.query.filter_by(id=user_data['id']).first()
-            if user_object is not None:
-                mail_object = Email.query.filter_by(mail=user_data['mail'], user_id=user_object.id).first()
-                if mail_object is None:
-                    # proceed with adding new email for the user
-                    # create a new email record in the Email table for the user
-                    email_object = Email(user_data['mail'], user_object.id)
-                    db.session.add(email_object)
-                    db.session.commit()
-                    msg = 'Added new email to user successfully!'
-                else:
-                    msg = 'The specified email already exists for the user!'
-            else:
-                msg = 'The specified user does not exist!'
-
-        return jsonify({"msg": msg})
+            return errors.error_response(errors.MISSING_FIELDS, 'Please specify all the requested fields!')
+        # check if user already has the email
+        user_object = User.active().filter_by(id=user_data['id']).first()
+        if user_object is None:
+            return errors.error_response(errors.USER_NOT_FOUND, 'The specified user does not exist!')
+        mail_object = Email.query.filter_by(mail=user_data['mail'], user_id=user_object.id).first()
+        if mail_object is not None:
+            return errors.error_response(errors.EMAIL_EXISTS, 'The specified email already exists for the user!')
+        # proceed with adding new email for the user
+        # create a new email record in the Email table for the user
+        email_object = Email(user_data['mail'], user_object.id)
+        db.session.add(email_object)
+        coalescing_keys = coalescing.user_keys(user_object)
+        batch.commit()
+        coalescing.invalidate(coalescing_keys)
+        return jsonify({"msg": 'Added new email to user successfully!'})
 
 
 class UserUpdateMail(Resource):
@@ -177,30 +209,26 @@ class UserUpdateMail(Resource):
 
         :return: the JSON object containing the status message of the operation
         """
-        user_data = request.get_json()
+        user_data = request.get_json(silent=True)
         # check if user has provided the required info
         if user_data is None or 'old_mail' not in user_data or 'new_mail' not in user_data or 'id' not in user_data:
-            msg = "Please specify all the requested fields."
-            flash(msg, 'error')
-        elif user_data['old_mail'].lower() == user_data['new_mail'].lower():
-            msg = "Old and new emails are the same!"
-            flash(msg, 'error')
-        else:
-            # if all good, proceed with update
-            user_object = User.query.filter_by(id=user_data['id']).first()
-            if user_object is not None:
-                # get the email_object for the user to be updated
-                email_object = Email.query.filter_by(mail=user_data['old_mail'].lower(),
-                                                     user_id=user_object.id).first()
-                if email_object is not None:
-                    email_object.mail = user_data['new_mail'].lower()
-                    db.session.commit()
-                    msg = 'Updated user email successfully!'
-                else:
-                    msg = 'The specified email does not exist!'
-            else:
-                msg = 'The specified user does not exist!'
-        return jsonify({"msg": msg})
+            return errors.error_response(errors.MISSING_FIELDS, "Please specify all the requested fields.")
+        if user_data['old_mail'].lower() == user_data['new_mail'].lower():
+            return errors.error_response(errors.UNCHANGED_VALUE, "Old and new emails are the same!")
+        # if all good, proceed with update
+        user_object = User.active().filter_by(id=user_data['id']).first()
+        if user_object is None:
+            return errors.error_response(errors.USER_NOT_FOUND, 'The specified user does not exist!')
+        # get the email_object for the user to be updated
+        email_object = Email.query.filter_by(mail=user_data['old_mail'].lower(),
+                                             user_id=user_object.id).first()
+        if email_object is None:
+            return errors.error_response(errors.EMAIL_NOT_FOUND, 'The specified email does not exist!')
+        email_object.mail = user_data['new_mail'].lower()
+        coalescing_keys = coalescing.user_keys(user_object)
+        batch.commit()
+        coalescing.invalidate(coalescing_keys)
+        return jsonify({"msg": 'Updated user email successfully!'})
 
 
 class UserUpdatePhone(Resource):
@@ -213,30 +241,25 @@ class UserUpdatePhone(Resource):
 
         :return: the JSON object containing the status message for this operation
         """
-        user_data = request.get_json()
+        user_data = request.get_json(silent=True)
         # check if user has provided the required info
         if user_data is None or 'old_phone' not in user_data or 'new_phone' not in user_data or 'id' not in user_data:
-            msg = "Please specify all the requested fields."
-            flash(msg, 'error')
-        elif user_data['old_phone'] == user_data['new_phone']:
-            msg = "The old and new phone numbers are the same!"
-            flash(msg, 'error')
-        else:
-            # if all good, proceed with update
-            user_object = User.query.filter_by(id=user_data['id']).first()
-            if user_object is not None:
-                # get the email_object for the user to be updated
-                phone_object = PhoneNumber.query.filter_by(phone=user_data['old_phone'], user_id=user_object.id).first()
-                if phone_object is not None:
-                    phone_object.phone = user_data['new_phone']
-                    db.session.commit()
-                    msg = 'Updated user phone number successfully!'
-                else:
-                    msg = 'The specified phone number does not exist!'
-            else:
-                msg = 'The specified user does not exist!'
-
-        return jsonify({"msg": msg})
+            return errors.error_response(errors.MISSING_FIELDS, "Please specify all the requested fields.")
+        if user_data['old_phone'] == user_data['new_phone']:
+            return errors.error_response(errors.UNCHANGED_VALUE, "The old and new phone numbers are the same!")
+        # if all good, proceed with update
+        user_object = User.active().filter_by(id=user_data['id']).first()
+        if user_object is None:
+            return errors.error_response(errors.USER_NOT_FOUND, 'The specified user does not exist!')
+        # get the phone_object for the user to be updated
+        phone_object = PhoneNumber.query.filter_by(phone=user_data['old_phone'], user_id=user_object.id).first()
+        if phone_object is None:
+            return errors.error_response(errors.PHONE_NOT_FOUND, 'The specified phone number does not exist!')
+        phone_object.phone = user_data['new_phone']
+        coalescing_keys = coalescing.user_keys(user_object)
+        batch.commit()
+        coalescing.invalidate(coalescing_keys)
+        return jsonify({"msg": 'Updated user phone number successfully!'})
 
 
 class UserDelete(Resource):
@@ -251,33 +274,75 @@ class UserDelete(Resource):
 
         :return: the JSON object containing the status message of the operation
         """
-        user_data = request.get_json()
+        user_data = request.get_json(silent=True)
         # check if user has specified id of the user to be deleted
         if user_data is None or 'id' not in user_data:
-            msg = 'Please specify the id!'
-            flash(msg, 'error')
-        else:
-            # proceed with delete
-            user_object = User.query.filter_by(id=user_data['id']).first()
-            if user_object is not None:
-                # delete the user object as well as all phone number and email objects
-                # corresponding to the user
-                email_objects = Email.query.filter_by(user_id=user_object.id).all()
-                phone_objects = PhoneNumber.query.filter_by(user_id=user_object.id).all()
-
-                db.session.delete(user_object)
-                db.session.commit()
-                for email_object in email_objects:
-                    db.session.delete(email_object)
-                    db.session.commit()
-                for phone_object in phone_objects:
-                    db.session.delete(phone_object)
-                    db.session.commit()
-
-                msg = "Deleted User"
-            else:
-                msg = "The specified user does not exist!"
-        return jsonify({"msg": msg})
+            return errors.error_response(errors.MISSING_FIELDS, 'Please specify the id!')
+        # proceed with delete
+        user_object = User.active().filter_by(id=user_data['id']).first()
+        if user_object is None:
+            return errors.error_response(errors.USER_NOT_FOUND, "The specified user does not exist!")
+        # delete the user as well as all phone numbers and emails corresponding
+        # to the user, with one statement per table in a single transaction
+        coalescing_keys = coalescing.user_keys(user_object)
+        purge.purge_users(db.session.connection(), [user_object.id])
+        batch.commit()
+        coalescing.invalidate(coalescing_keys)
+        return jsonify({"msg": "Deleted User"})
+
+
+class UserBulkDelete(Resource):
+    """
+    This Resource deletes many users at once, given either a list of user ids
+    or the name of an import batch. The users are marked as deleted right away
+    and purged from the database in the background; the returned job id can
+    be used to follow the progress.
+    """
+    def post(self):
+        """
+        The POST request handler for this resource.
+
+        :return: the JSON object containing the id of the purge job
+        """
+        user_data = request.get_json(silent=True)
+        if user_data is None or ('ids' not in user_data and 'batch' not in user_data):
+            return errors.error_response(errors.MISSING_FIELDS, 'Please specify the ids or the batch!')
+        user_ids = user_data.get('ids')
+        import_batch = user_data.get('batch')
+        if user_ids is not None and (not isinstance(user_ids, list)
+                                     or not all(isinstance(user_id, int) for user_id in user_ids)):
+            return errors.error_response(errors.INVALID_FIELDS, 'The ids must be a list of integers!')
+        if user_ids is None and not isinstance(import_batch, str):
+            return errors.error_response(errors.INVALID_FIELDS, 'The batch must be a string!')
+        job = purge.schedule_deletion(user_ids=user_ids, batch=import_batch if user_ids is None else None)
+        batch.commit()
+        # the names of the deleted users are not loaded, all running lookups are detached
+        coalescing.invalidate()
+        if job.users:
+            app = current_app._get_current_object()
+            batch.after_commit(lambda: purge.wake_worker(app))
+        response = jsonify({"msg": "Deletion scheduled", "data": {"job_id": job.id, "users": job.users}})
+        response.status_code = 202
+        return response
+
+
+class PurgeJobStatus(Resource):
+    """
+    This Resource returns the progress of a bulk delete
+    """
+    def get(self, job_id):
+        """
+        The GET request handler for this resource.
+
+        :param job_id: the id of the purge job
+        :return: the JSON object containing the status of the job
+        """
+        job = PurgeJob.query.filter_by(id=job_id).first()
+        if job is None:
+            return errors.error_response(errors.JOB_NOT_FOUND, 'The specified job does not exist!')
+        return jsonify({"msg": "Success", "data": {
+            "job_id": job.id, "status": job.status, "users": job.users, "purged": job.purged
+        }})
 
 
 class UserAdd(Resource):
@@ -292,34 +357,198 @@ class UserAdd(Resource):
         :return: the JSON object containing the status message of the operation
         """
         # get the json response for the post request
-        user_data = request.get_json()
-        # check if any field is not provided by user, if so flash error message
+        user_data = request.get_json(silent=True)
+        # check if any field is not provided by user, if so return an error
         if user_data is None or 'last_name' not in user_data or 'first_name' not in user_data \
                 or 'mail' not in user_data or 'phone' not in user_data:
-            msg = 'Please enter all the fields!'
-            flash(msg, 'error')
-        else:
-            # all fields are present, check if user with same email already exists
-            email = Email.query.filter_by(mail=user_data['mail']).first()
-            if email is not None:
-                msg = "A user with the same email already exists!"
-                flash(msg, 'error')
-            else:
-                # if all good, proceed with adding a new user to db
-                user_object = User(user_data['last_name'].lower(), user_data['first_name'].lower())
-                db.session.add(user_object)
-                db.session.commit()
-                # create a Email and PhoneNumber object for the user's mail and number
-                email_object = Email(user_data['mail'].lower(), user_object.id)
-                db.session.add(email_object)
-                db.session.commit()
-
-                phone_object = PhoneNumber(user_data['phone'], user_object.id)
-                db.session.add(phone_object)
-                db.session.commit()
-                msg = 'Successfully added user!'
-
-        return jsonify({"msg": msg})
+            return errors.error_response(errors.MISSING_FIELDS, 'Please enter all the fields!')
+        # all fields are present, check if user with same email already exists
+        email = Email.query.filter_by(mail=user_data['mail']) \
+            .filter(~exists().where(UserDeletion.user_id == Email.user_id)).first()
+        if email is not None:
+            return errors.error_response(errors.EMAIL_EXISTS, "A user with the same email already exists!")
+        # if all good, proceed with adding a new user to db
+        user_object = User(user_data['last_name'].lower(), user_data['first_name'].lower())
+        db.session.add(user_object)
+        batch.commit()
+        # create a Email and PhoneNumber object for the user's mail and number
+        coalescing_keys = coalescing.user_keys(user_object)
+        email_object = Email(user_data['mail'].lower(), user_object.id)
+        db.session.add(email_object)
+        batch.commit()
+
+        phone_object = PhoneNumber(user_data['phone'], user_object.id)
+        db.session.add(phone_object)
+        batch.commit()
+        coalescing.invalidate(coalescing_keys)
+        return jsonify({"msg": 'Successfully added user!', "data": {"id": user_object.id}})
+
+
+class Batch(Resource):
+    """
+    This Resource runs many operations of the API in one request and one
+    database transaction. Operations can use the results of earlier ones,
+    see the batch module for the format.
+    """
+    def post(self):
+        """
+        The POST request handler for this resource.
+
+        :return: JSON object containing the result of every operation
+        """
+        batch_data = request.get_json(silent=True)
+        if batch_data is None or 'operations' not in batch_data:
+            return errors.error_response(errors.MISSING_FIELDS, 'Please specify the operations!')
+        if batch.in_batch():
+            return errors.error_response(errors.INVALID_FIELDS, 'Batches can not be nested!')
+        mode = batch_data.get('mode', batch.ATOMIC)
+        message = batch.validate(batch_data['operations'], mode,
+                                 current_app.config.get('BATCH_MAX_OPERATIONS', 100))
+        if message is not None:
+            return errors.error_response(errors.INVALID_FIELDS, message)
+        committed, results = batch.run(batch_data['operations'], mode)
+        response = jsonify({"msg": "Success" if committed else "Batch rolled back",
+                            "data": {"committed": committed, "results": results}})
+        if not committed:
+            # an atomic batch fails with the status of its failed operation
+            response.status_code = next(result["status"] for result in results if result["status"] >= 400)
+        return response
+
+
+class CoalescingStats(Resource):
+    """
+    This Resource returns the counters of the coalesced user lookups of the
+    worker process that serves the request
+    """
+    def get(self):
+        """
+        The GET request handler for this resource.
+
+        :return: JSON object containing the counters
+        """
+        single_flight = current_app.extensions.get('single_flight')
+        data = {"enabled": single_flight is not None, "pid": os.getpid()}
+        if single_flight is not None:
+            data.update(single_flight.stats())
+        return jsonify({"msg": "Success", "data": data})
+
+
+class CourseAnalytics(Resource):
+    """
+    This Resource returns the average completion time over all courses and
+    for each course individually
+    """
+    def get(self):
+        """
+        The GET request handler for this resource.
+
+        :return: JSON object containing the course statistics
+        """
+        return jsonify({"msg": "Success", "data": _analytics().course_overview()})
+
+
+class CourseAnalyticsByID(Resource):
+    """
+    This Resource returns the statistics of a course, including its fastest
+    and slowest users
+    """
+    def get(self, course_id):
+        """
+        The GET request handler for this resource.
+
+        :param course_id: the course id
+        :return: JSON object containing the course statistics
+        """
+        data = _analytics().course_detail(course_id)
+        if data is None:
+            return errors.error_response(errors.COURSE_NOT_FOUND, "The specified course does not exist!")
+        return jsonify({"msg": "Success", "data": data})
+
+
+class UserAnalytics(Resource):
+    """
+    This Resource returns the number of certificates and the average completion
+    time per user, users with most certificates first. The list is paginated
+    with the limit and offset query parameters.
+    """
+    def get(self):
+        """
+        The GET request handler for this resource.
+
+        :return: JSON object containing the list of user statistics
+        """
+        limit = min(max(request.args.get('limit', 100, type=int), 0), 1000)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        return jsonify({"msg": "Success", "data": _analytics().user_overview(limit, offset)})
+
+
+class UserAnalyticsByID(Resource):
+    """
+    This Resource returns the number of certificates and the average completion
+    time of a user, identified by the external id used in the certificates
+    """
+    def get(self, user_id):
+        """
+        The GET request handler for this resource.
+
+        :param user_id: the external id of the user
+        :return: JSON object containing the user statistics
+        """
+        data = _analytics().user_detail(user_id)
+        if data is None:
+            return errors.error_response(errors.USER_NOT_FOUND, "The specified user has no certificates!")
+        return jsonify({"msg": "Success", "data": data})
+
+
+class BreachCheck(Resource):
+    """
+    This Resource checks an email address against the local breach index,
+    without any network call. The address is sent in the body, so it does
+    not show up in access logs.
+    """
+    def post(self):
+        """
+        The POST request handler for this resource.
+
+        :return: JSON object telling whether the address was breached
+        """
+        user_data = request.get_json(silent=True)
+        if user_data is None or not isinstance(user_data.get('mail'), str):
+            return errors.error_response(errors.MISSING_FIELDS, 'Please specify the mail!')
+        import breach
+        index = breach.get_index(current_app._get_current_object())
+        if index is None:
+            return errors.error_response(errors.BREACH_INDEX_UNAVAILABLE, 'The breach index is not available!')
+        return jsonify({"msg": "Success", "data": {
+            "mail": user_data['mail'], "breached": index.is_breached(user_data['mail'])
+        }})
+
+
+class BreachReportByID(Resource):
+    """
+    This Resource returns a scan of all emails against the breach index and
+    the breached emails it found, paginated with the limit and offset query
+    parameters
+    """
+    def get(self, report_id):
+        """
+        The GET request handler for this resource.
+
+        :param report_id: the id of the report
+        :return: JSON object containing the report
+        """
+        report = BreachReport.query.filter_by(id=report_id).first()
+        if report is None:
+            return errors.error_response(errors.REPORT_NOT_FOUND, 'The specified report does not exist!')
+        limit = min(max(request.args.get('limit', 100, type=int), 0), 1000)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        findings = BreachFinding.query.filter_by(report_id=report.id).order_by(BreachFinding.id) \
+            .offset(offset).limit(limit).all()
+        return jsonify({"msg": "Success", "data": {
+            "report_id": report.id, "status": report.status, "scanned": report.scanned,
+            "flagged": report.flagged, "hashes": report.hashes,
+            "findings": [{"user_id": finding.user_id, "mail": finding.mail} for finding in findings]
+        }})
 
 
 class Home(Resource):
@@ -343,15 +572,25 @@ api.add_resource(UserGetByName, '/user')
 api.add_resource(UserAddEmail, '/user/add/mail/')
 api.add_resource(UserAddPhone, '/user/add/phone/')
 api.add_resource(UserDelete, '/user/del/')
+api.add_resource(UserBulkDelete, '/user/bulk-delete/')
+api.add_resource(PurgeJobStatus, '/user/bulk-delete/<int:job_id>/')
 api.add_resource(UserAdd, '/user/add/')
 api.add_resource(UserUpdateMail, '/user/update/mail/')
 api.add_resource(UserUpdatePhone, '/user/update/phone/')
+api.add_resource(Batch, '/batch/')
+api.add_resource(BreachCheck, '/breach/check/')
+api.add_resource(BreachReportByID, '/breach/reports/<int:report_id>/')
+api.add_resource(CoalescingStats, '/admin/coalescing/')
+api.add_resource(CourseAnalytics, '/analytics/courses/')
+api.add_resource(CourseAnalyticsByID, '/analytics/courses/<string:course_id>/')
+api.add_resource(UserAnalytics, '/analytics/users/')
+api.add_resource(UserAnalyticsByID, '/analytics/users/<string:user_id>/')
 
 
 if __name__ == '__main__':
-    # create all the db tables
-    # db.create_all()
-    # create the Flask app and run.
+    # create the Flask app and the tables missing in its database, then run.
     app = create_app('config.py')
+    with app.app_context():
+        init_db()
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,263 @@
+"""
+Batch requests: many API operations in one HTTP call.
+
+The operations of a batch are dispatched, in order, to the same resources
+that serve the single requests, inside one database transaction. While a
+batch runs, commit() only flushes the session, so the batch is committed
+once at the end. In the default "atomic" mode the first failed operation
+rolls back the whole batch; in "savepoint" mode every operation runs in its
+own savepoint, failed operations are rolled back on their own and the
+others are committed.
+
+An operation can use values returned by an earlier operation of the batch,
+either as a body value ``{"$ref": "<op>.<path>"}`` or inside its path as
+``{<op>.<path>}``, where <op> is the index or the id of the earlier
+operation and <path> is a dotted path into its response body, for example
+``{"$ref": "new_user.data.id"}``.
+"""
+# module imports
+import re
+from flask import current_app, g
+from werkzeug.exceptions import default_exceptions
+from models import db
+
+ATOMIC = 'atomic'
+SAVEPOINT = 'savepoint'
+MODES = (ATOMIC, SAVEPOINT)
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+# status of the operations that were not run, as in WebDAV "Failed Dependency"
+SKIPPED_STATUS = 424
+_PATH_REFERENCE = re.compile(r'\{([^{}]+)\}')
+
+
+class InvalidReference(Exception):
+    """
+    Raised when an operation refers to a value that is not available
+    """
+    def __init__(self, message, status=400):
+        super(InvalidReference, self).__init__(message)
+        self.status = status
+
+
+def in_batch():
+    """
+    Whether the current request is an operation of a batch
+
+    :return: True inside a batch
+    """
+    return g.get('batch') is not None
+
+
+def commit():
+    """
+    Commit the database session. Inside a batch the session is only flushed,
+    the batch commits all its operations at once.
+
+    :return: None
+    """
+    if in_batch():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def after_commit(callback):
+    """
+    Call a function once the changes of the request are committed, e.g. to
+    start background work that needs them
+
+    :param callback: function without arguments
+    :return: None
+    """
+    if in_batch():
+        g.batch.append(callback)
+    else:
+        callback()
+
+
+def validate(operations, mode, max_operations):
+    """
+    Check the envelope of a batch request
+
+    :param operations: the list of operations
+    :param mode: the transaction mode
+    :param max_operations: the maximum number of operations
+    :return: error message, or None if the batch is valid
+    """
+    if mode not in MODES:
+        return 'The mode must be one of %s!' % ', '.join(MODES)
+    if not isinstance(operations, list) or not operations:
+        return 'The operations must be a non-empty list!'
+    if len(operations) > max_operations:
+        return 'A batch can contain at most %d operations!' % max_operations
+    labels = set()
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get('path'), str) \
+                or not operation['path'].startswith('/') \
+                or str(operation.get('method', 'GET')).upper() not in METHODS:
+            return 'Every operation needs a method and a path starting with /!'
+        label = operation.get('id')
+        if label is not None:
+            if not isinstance(label, str) or label.isdigit() or label in labels:
+                return 'Operation ids must be unique, non-numeric strings!'
+            labels.add(label)
+    return None
+
+
+def _lookup(reference, results, labels):
+    """
+    Get the value an operation refers to
+
+    :param reference: the reference, "<op>.<path>"
+    :param results: the results of the operations run so far
+    :param labels: dict of operation id to index
+    :return: the value
+    """
+    name, _, path = reference.partition('.')
+    index = int(name) if name.isdigit() else labels.get(name)
+    if index is None or index >= len(results):
+        raise InvalidReference('Unknown operation "%s" in reference!' % name)
+    result = results[index]
+    if result['status'] >= 400:
+        raise InvalidReference('Operation "%s" failed' % name, SKIPPED_STATUS)
+    value = result['body']
+    for key in path.split('.') if path else []:
+        if isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        elif isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            raise InvalidReference('The result of operation "%s" has no value "%s"!' % (name, path))
+    return value
+
+
+def resolve(value, results, labels):
+    """
+    Replace the references in a request body by the values they refer to
+
+    :param value: the body or a part of it
+    :param results: the results of the operations run so far
+    :param labels: dict of operation id to index
+    :return: the resolved value
+    """
+    if isinstance(value, dict):
+        if len(value) == 1 and isinstance(value.get('$ref'), str):
+            return _lookup(value['$ref'], results, labels)
+        return {key: resolve(item, results, labels) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, results, labels) for item in value]
+    return value
+
+
+def resolve_path(path, results, labels):
+    """
+    Replace the references in a path by the values they refer to
+
+    :param path: the path of the operation
+    :param results: the results of the operations run so far
+    :param labels: dict of operation id to index
+    :return: the resolved path
+    """
+    return _PATH_REFERENCE.sub(lambda match: str(_lookup(match.group(1), results, labels)), path)
+
+
+def _dispatch(app, method, path, body):
+    """
+    Run one operation through the URL map of the app, in the current
+    transaction. The operation gets its own request context and runs like a
+    single request, including the before_request and after_request hooks.
+
+    :param app: the Flask app
+    :param method: the HTTP method
+    :param path: the path, optionally with a query string
+    :param body: the JSON body, or None
+    :return: tuple of the status code and the decoded response body
+    """
+    with app.test_request_context(path, method=method, json=body):
+        response = app.full_dispatch_request()
+        data = response.get_json(silent=True)
+        if data is None and response.status_code in default_exceptions:
+            # errors raised outside of the resources, e.g. unknown paths, are rendered as HTML
+            error = default_exceptions[response.status_code]()
+            data = {"error": {"code": error.name.lower().replace(' ', '_'), "message": error.description}}
+        return response.status_code, data
+
+
+def _result(operation, status, body):
+    """
+    The result of an operation as returned to the client
+
+    :param operation: the operation
+    :param status: the HTTP status code of the operation
+    :param body: the decoded response body
+    :return: dict with the status, the body and the id of the operation, if it has one
+    """
+    result = {"status": status, "body": body}
+    if operation.get('id') is not None:
+        result["id"] = operation['id']
+    return result
+
+
+def _run_operation(app, operation, mode, results, labels):
+    """
+    Resolve the references of an operation and run it
+
+    :param app: the Flask app
+    :param operation: the operation
+    :param mode: ATOMIC or SAVEPOINT
+    :param results: the results of the operations run so far
+    :param labels: dict of operation id to index
+    :return: the result of the operation
+    """
+    try:
+        path = resolve_path(operation['path'], results, labels)
+        body = resolve(operation.get('body'), results, labels)
+    except InvalidReference as error:
+        return _result(operation, error.status, {"error": {"code": "invalid_reference", "message": str(error)}})
+    savepoint = db.session.begin_nested() if mode == SAVEPOINT else None
+    try:
+        status, body = _dispatch(app, operation.get('method', 'GET').upper(), path, body)
+    except Exception:
+        app.logger.exception('Operation %d of a batch failed', len(results))
+        status, body = 500, {"error": {"code": "internal_error", "message": "The operation failed!"}}
+    if savepoint is not None:
+        if status >= 400:
+            savepoint.rollback()
+        else:
+            savepoint.commit()
+    return _result(operation, status, body)
+
+
+def run(operations, mode=ATOMIC):
+    """
+    Run the operations of a batch, in order, and commit them
+
+    :param operations: the validated list of operations
+    :param mode: ATOMIC or SAVEPOINT
+    :return: tuple of whether the batch was committed and the list of results
+    """
+    app = current_app._get_current_object()
+    results = []
+    labels = {}
+    callbacks = []
+    g.batch = callbacks
+    try:
+        for index, operation in enumerate(operations):
+            result = _run_operation(app, operation, mode, results, labels)
+            results.append(result)
+            if operation.get('id') is not None:
+                labels[operation['id']] = index
+            if mode == ATOMIC and result["status"] >= 400:
+                # nothing of the batch is kept, the remaining operations are skipped
+                db.session.rollback()
+                results.extend(_result(skipped, SKIPPED_STATUS, None) for skipped in operations[index + 1:])
+                return False, results
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        g.pop('batch', None)
+    for callback in callbacks:
+        callback()
+    return True, results
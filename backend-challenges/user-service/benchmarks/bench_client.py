@@ -0,0 +1,136 @@
+"""
+Benchmark of the client in user_service_client.
+
+Serves a temporary database over HTTP/1.1 with keep-alive and compares
+ - a new connection per lookup, as the consumers did with requests
+   without a session, with the connection pool of HTTPTransport
+ - lookups of concurrent threads sent one by one with lookups batched
+   into requests to /batch/
+
+Run from the user-service directory:
+
+    python benchmarks/bench_client.py [lookups] [threads]
+"""
+# module imports
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from models import Email, User, PhoneNumber, db  # noqa: E402
+from user_service_client import HTTPTransport, UserServiceClient  # noqa: E402
+
+USERS = 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 server passing requests to the app. The development server of
+    werkzeug closes every connection, so it can not show keep-alive.
+    """
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.raw_requestline or not self.parse_request():
+            self.close_connection = True
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        response = self.server.client.open(self.path, method=self.command, data=body,
+                                           content_type=self.headers.get('Content-Type'))
+        self.server.requests += 1
+        self.send_response(response.status_code)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(response.data)))
+        self.end_headers()
+        self.wfile.write(response.data)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_threads(threads, lookups, lookup):
+    """
+    Run lookups in concurrent threads
+
+    :param threads: number of threads
+    :param lookups: number of lookups per thread
+    :param lookup: function called with the user id
+    :return: wall seconds
+    """
+    def work(offset):
+        for number in range(lookups):
+            lookup((offset * lookups + number) % USERS + 1)
+
+    workers = [threading.Thread(target=work, args=(offset,)) for offset in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main(lookups, threads):
+    """
+    Run the benchmark against a temporary database
+
+    :param lookups: number of lookups per case
+    :param threads: number of concurrent threads of the batching case
+    :return: None
+    """
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    server = None
+    try:
+        app = create_app('config.py', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        with app.app_context():
+            db.create_all()
+            for number in range(USERS):
+                user = User('doe', 'john%d' % number)
+                db.session.add(user)
+                db.session.flush()
+                db.session.add(Email('john%d@doe.de' % number, user.id))
+                db.session.add(PhoneNumber('9090%d' % number, user.id))
+            db.session.commit()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.client = app.test_client(use_cookies=False)
+        server.requests = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d' % server.server_port
+
+        def unpooled(user_id):
+            with UserServiceClient(HTTPTransport(url), batch_window=0) as client:
+                client.get_user(user_id)
+
+        with UserServiceClient(HTTPTransport(url), batch_window=0) as client:
+            for name, lookup in (('new connection', unpooled), ('pooled', client.get_user)):
+                start = time.perf_counter()
+                for number in range(lookups):
+                    lookup(number % USERS + 1)
+                print('%-26s %8.1f us/lookup' % (name, (time.perf_counter() - start) / lookups * 1e6))
+
+        per_thread = max(1, lookups // threads)
+        for name, window in (('%d threads, unbatched' % threads, 0), ('%d threads, batched' % threads, 0.002)):
+            with UserServiceClient(HTTPTransport(url, pool_size=threads), batch_window=window) as client:
+                server.requests = 0
+                seconds = run_threads(threads, per_thread, client.get_user)
+                print('%-26s %8.1f us/lookup, %d requests' % (
+                    name, seconds / (threads * per_thread) * 1e6, server.requests))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 16)
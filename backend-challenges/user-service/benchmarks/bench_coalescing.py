@@ -0,0 +1,115 @@
+"""
+Benchmark of the coalescing of concurrent identical reads.
+
+Threads send lookups by id whose keys follow a Zipf distribution (a few
+popular users get most of the requests), against the app with and without
+COALESCE_READS, and report the throughput, the SQL statements per request
+and the share of coalesced requests. Run from the user-service directory:
+
+    python benchmarks/bench_coalescing.py [requests] [threads] [zipf exponent]
+"""
+# module imports
+import bisect
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from models import Email, User, PhoneNumber, db  # noqa: E402
+
+USERS = 1000
+
+
+def zipf_keys(count, exponent, seed=42):
+    """
+    User ids drawn from a Zipf distribution, user 1 being the most popular
+
+    :param count: number of ids
+    :param exponent: the exponent of the distribution, higher is more skewed
+    :param seed: the seed of the random numbers
+    :return: list of user ids
+    """
+    weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, USERS + 1)))
+    generator = random.Random(seed)
+    return [bisect.bisect(weights, generator.random() * weights[-1]) + 1 for _ in range(count)]
+
+
+def run(path, keys, threads, coalesce):
+    """
+    Send the lookups from concurrent threads
+
+    :param path: the path of the database
+    :param keys: the user ids to look up
+    :param threads: number of threads
+    :param coalesce: the value of COALESCE_READS
+    :return: tuple of the wall seconds, the SQL statements and the app
+    """
+    app = create_app('config.py', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'COALESCE_READS': coalesce})
+    statements = [0]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *args: statements.__setitem__(0, statements[0] + 1))
+
+    def work(offset):
+        client = app.test_client(use_cookies=False)
+        for user_id in keys[offset::threads]:
+            client.get('/user/%d/' % user_id)
+
+    workers = [threading.Thread(target=work, args=(offset,)) for offset in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, statements[0], app
+
+
+def main(requests, threads, exponent):
+    """
+    Run the benchmark against a temporary database
+
+    :param requests: number of lookups per case
+    :param threads: number of concurrent threads
+    :param exponent: the exponent of the Zipf distribution
+    :return: None
+    """
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        app = create_app('config.py', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        with app.app_context():
+            db.create_all()
+            for number in range(USERS):
+                user = User('doe', 'john%d' % number)
+                db.session.add(user)
+                db.session.flush()
+                db.session.add(Email('john%d@doe.de' % number, user.id))
+                db.session.add(PhoneNumber('9090%d' % number, user.id))
+            db.session.commit()
+        keys = zipf_keys(requests, exponent)
+        top = sum(1 for key in keys if key <= 10) / len(keys)
+        print('%d lookups, %d threads, Zipf exponent %.2f: %.0f%% of the lookups for the top 10 users'
+              % (requests, threads, exponent, top * 100))
+        for name, coalesce in (('without coalescing', False), ('with coalescing', True)):
+            seconds, statements, app = run(path, keys, threads, coalesce)
+            line = '%-20s %8.0f requests/s %6.2f statements/request' % (
+                name, requests / seconds, statements / requests)
+            if coalesce:
+                stats = app.extensions['single_flight'].stats()
+                line += ', %.0f%% coalesced' % (stats['coalesced'] / requests * 100)
+            print(line)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 16,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 1.2)
@@ -0,0 +1,89 @@
+"""
+Benchmark of the error path of the user service.
+
+Compares the stateless error responses against the old behaviour, which
+flashed every error message into the signed cookie session, and against
+the success path. Run from the user-service directory:
+
+    python benchmarks/bench_error_path.py [requests]
+"""
+# module imports
+import os
+import sys
+import tempfile
+import time
+from flask import flash, jsonify
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from models import Email, User, PhoneNumber, db  # noqa: E402
+
+
+def old_error_path():
+    """
+    The error path of UserGetByID as it was before: the message is flashed
+    to the session and returned with HTTP 200.
+
+    :return: JSON object containing the error message
+    """
+    User.query.filter_by(id=54).first()
+    msg = "User does not exist"
+    flash(msg, 'error')
+    return jsonify({"msg": msg})
+
+
+def run(client, url, requests):
+    """
+    Send the same GET request a number of times
+
+    :param client: the Flask test client
+    :param url: the url to request
+    :param requests: number of requests to send
+    :return: tuple of microseconds per request and whether a cookie was set
+    """
+    response = client.get(url)
+    set_cookie = 'Set-Cookie' in response.headers
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(url)
+    elapsed = time.perf_counter() - start
+    return elapsed / requests * 1e6, set_cookie
+
+
+def main(requests):
+    """
+    Run the benchmark against a temporary database
+
+    :param requests: number of requests per case
+    :return: None
+    """
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        app = create_app('config.py', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        app.add_url_rule('/bench/old-error/', 'old_error', old_error_path)
+        with app.app_context():
+            db.create_all()
+            user = User('doe', 'john')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(Email('john.doe@gmail.com', user.id))
+            db.session.add(PhoneNumber('9090872234', user.id))
+            db.session.commit()
+        # bots do not send cookies back, so every request starts without a session
+        client = app.test_client(use_cookies=False)
+        cases = [
+            ('success path', '/user/1/'),
+            ('error path (stateless)', '/user/54/'),
+            ('error path (old, flash)', '/bench/old-error/'),
+        ]
+        for name, url in cases:
+            per_request, set_cookie = run(client, url, requests)
+            print('%-26s %8.1f us/request   Set-Cookie: %s' % (name, per_request, set_cookie))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
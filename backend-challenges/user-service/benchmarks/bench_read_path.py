@@ -0,0 +1,121 @@
+"""
+Benchmark of the user lookups.
+
+Compares the CPU time per lookup of the read-only data access in reads.py
+with the ORM queries the GET resources used before, both called directly
+and through the GET endpoints. Run from the user-service directory:
+
+    python benchmarks/bench_read_path.py [lookups] [users]
+"""
+# module imports
+import os
+import sys
+import tempfile
+import time
+from flask import jsonify
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from models import Email, User, PhoneNumber, db  # noqa: E402
+import reads  # noqa: E402
+
+
+def orm_get_user(user_id):
+    """
+    The lookup of UserGetByID as it was before, with ORM objects
+
+    :param user_id: the user id
+    :return: dict with the user info, or None
+    """
+    user_object = User.active().filter_by(id=user_id).first()
+    if user_object is None:
+        return None
+    email_objects = Email.query.filter_by(user_id=user_object.id).all()
+    phone_objects = PhoneNumber.query.filter_by(user_id=user_object.id).all()
+    return {
+        'id': user_object.id, 'last_name': user_object.last_name,
+        'first_name': user_object.first_name, 'mail': [obj.mail for obj in email_objects],
+        'phone': [obj.phone for obj in phone_objects]
+    }
+
+
+def core_get_user(user_id):
+    """
+    The lookup of UserGetByID with reads.py
+
+    :param user_id: the user id
+    :return: dict with the user info, or None
+    """
+    user_record = reads.get_user(user_id)
+    return None if user_record is None else user_record.to_dict()
+
+
+def orm_endpoint(id):
+    """
+    UserGetByID as it was before
+
+    :param id: the user id
+    :return: json object containing user info
+    """
+    return jsonify({"msg": "Success", "data": orm_get_user(id)})
+
+
+def measure(function, user_ids):
+    """
+    Call a lookup function for every user id
+
+    :param function: the function
+    :param user_ids: list of user ids
+    :return: CPU microseconds per call
+    """
+    start = time.process_time()
+    for user_id in user_ids:
+        function(user_id)
+    return (time.process_time() - start) / len(user_ids) * 1e6
+
+
+def main(lookups, users):
+    """
+    Run the benchmark against a temporary database
+
+    :param lookups: number of lookups per case
+    :param users: number of users in the database
+    :return: None
+    """
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        app = create_app('config.py', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        app.add_url_rule('/bench/orm-user/<int:id>/', 'orm_user', orm_endpoint)
+        user_ids = [number % users + 1 for number in range(lookups)]
+        with app.app_context():
+            db.create_all()
+            for number in range(users):
+                user = User('doe', 'john%d' % number)
+                db.session.add(user)
+                db.session.flush()
+                db.session.add(Email('john%d@doe.de' % number, user.id))
+                db.session.add(Email('john.doe%d@doe.de' % number, user.id))
+                db.session.add(PhoneNumber('9090%d' % number, user.id))
+            db.session.commit()
+            assert orm_get_user(1) == core_get_user(1)
+            for name, function in (('ORM lookup', orm_get_user), ('Core lookup', core_get_user)):
+                # warm up the statement caches
+                measure(function, user_ids[:100])
+                per_lookup = measure(function, user_ids)
+                db.session.remove()
+                print('%-26s %8.1f us CPU/lookup' % (name, per_lookup))
+
+        client = app.test_client(use_cookies=False)
+        for name, url in (('GET (ORM, before)', '/bench/orm-user/%d/'), ('GET /user/<id>/', '/user/%d/')):
+            get = (lambda user_id, url=url: client.get(url % user_id))
+            measure(get, user_ids[:100])
+            print('%-26s %8.1f us CPU/request' % (name, measure(get, user_ids)))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -0,0 +1,128 @@
+"""
+Check the start up time and the peak memory of the service against the
+resource budget of the devops spec (0.2 CPU and 128 MB by default).
+
+A fresh interpreter creates the app the way wsgi.py does, serves a first
+request and then a mix of requests; it reports the CPU time of the start
+up and its peak RSS. The start up time under the CPU quota is the CPU time
+divided by the quota. The memory of all workers (see runtime.py) plus the
+gunicorn master has to fit into the memory limit. The script exits with 1
+if the budget is exceeded. Run from the user-service directory:
+
+    python benchmarks/check_footprint.py [--cpus 0.2] [--memory-mb 128] [--max-startup 5]
+"""
+# module imports
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from runtime import MASTER_MB, worker_settings  # noqa: E402
+
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# the code run in the fresh interpreter, it prints the measurements as JSON
+WORKER = '''
+import json, resource, sys, time
+started = time.perf_counter(), time.process_time()
+from app import create_app
+app = create_app('config.py', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + sys.argv[1]})
+client = app.test_client()
+def request(method, path, body=None):
+    # the requests have to succeed, a broken schema fails the check instead of measuring error pages
+    response = client.open(path, method=method, json=body)
+    if response.status_code != 200:
+        sys.exit('%s %s failed with %d: %s' % (method, path, response.status_code, response.get_data(as_text=True)))
+request('GET', '/user/1/')
+startup = time.perf_counter() - started[0], time.process_time() - started[1]
+modules = len(sys.modules)
+for number in range(int(sys.argv[2])):
+    request('GET', '/user/%d/' % (number % 50 + 1))
+    request('GET', '/user?first_name=john&last_name=doe')
+request('POST', '/user/add/', {'first_name': 'jane', 'last_name': 'doe', 'mail': 'jane@doe.de', 'phone': '1'})
+print(json.dumps({'startup_wall': startup[0], 'startup_cpu': startup[1], 'modules': modules,
+                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def measure(requests):
+    """
+    Measure a worker in a fresh interpreter, against a copy of the bundled database that is set up
+    like a deployment (see init_db) and 50 more users
+
+    :param requests: number of request pairs sent after the start up
+    :return: dict with the measurements
+    """
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    shutil.copy(os.path.join(SERVICE_DIR, 'user_db.db'), path)
+    # the byte code is written to a temporary directory instead of __pycache__ in the sources; the set up
+    # run fills it with the byte code of the libraries too, so the measured start up is a warm one
+    cache_dir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache_dir)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    try:
+        setup = ("from app import create_app, init_db\n"
+                 "from models import Email, User, db\n"
+                 "app = create_app('config.py', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + %r})\n"
+                 "with app.app_context():\n"
+                 "    init_db()\n"
+                 "    for number in range(50):\n"
+                 "        user = User('doe', 'john')\n"
+                 "        db.session.add(user)\n"
+                 "        db.session.flush()\n"
+                 "        db.session.add(Email('john%%d@doe.de' %% number, user.id))\n"
+                 "    db.session.commit()\n" % path)
+        subprocess.run([sys.executable, '-c', setup], cwd=SERVICE_DIR, env=env, check=True)
+        # compile the sources first, as the image does
+        subprocess.run([sys.executable, '-m', 'compileall', '-q', SERVICE_DIR], env=env, check=True)
+        output = subprocess.run([sys.executable, '-c', WORKER, path, str(requests)], cwd=SERVICE_DIR, env=env,
+                                check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        os.remove(path)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def main():
+    """
+    Measure the service and compare it with the budget
+
+    :return: the exit code, 1 if the budget is exceeded
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cpus', type=float, default=0.2, help='CPU quota of the container')
+    parser.add_argument('--memory-mb', type=int, default=128, help='memory limit of the container in MB')
+    parser.add_argument('--max-startup', type=float, default=5.0,
+                        help='maximum start up time of a worker under the CPU quota, in seconds')
+    parser.add_argument('--master-mb', type=float, default=MASTER_MB, help='memory of the gunicorn master in MB')
+    parser.add_argument('--requests', type=int, default=500, help='number of request pairs after the start up')
+    args = parser.parse_args()
+
+    result = measure(args.requests)
+    settings = worker_settings(cpus=args.cpus, memory_mb=args.memory_mb)
+    startup = result['startup_cpu'] / min(args.cpus, 1)
+    memory = settings['workers'] * result['peak_rss_mb'] + args.master_mb
+    print('start up:  %.2f s wall, %.2f s CPU, %d modules, %.2f s with %.2g CPU (budget %.2f s)'
+          % (result['startup_wall'], result['startup_cpu'], result['modules'], startup, args.cpus, args.max_startup))
+    print('memory:    %.1f MB peak RSS per worker, %d worker(s) x %d threads + %.0f MB master = %.1f MB '
+          '(budget %d MB)' % (result['peak_rss_mb'], settings['workers'], settings['threads'], args.master_mb,
+                              memory, args.memory_mb))
+    failed = []
+    if startup > args.max_startup:
+        failed.append('start up time')
+    if memory > args.memory_mb:
+        failed.append('memory')
+    if failed:
+        print('FAILED: %s over budget' % ' and '.join(failed))
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Offline check of email addresses against a breach dump.
+
+The dump is a text file with the SHA-1 hashes (hex) of breached email
+addresses, one per line, optionally followed by ":<count>" as in the dumps
+of haveibeenpwned. Addresses are hashed after stripping and lower-casing.
+
+The index built from the dump is a blocked Bloom filter: the hashes are
+split into buckets by the first bits of the hash, the same kind of prefix
+buckets the k-anonymity range API of haveibeenpwned uses, and every bucket
+is a small Bloom filter. A lookup only reads one bucket, i.e. one or two
+pages of the memory-mapped index file, and takes a few microseconds. The
+index has no false negatives; a small share of the addresses that are not
+in the dump (the false positive rate chosen when building) are reported
+as breached.
+
+Usage (from the user-service directory):
+
+    python breach.py build hashes.txt breach_index.bin
+    python breach.py check someone@example.com
+    python breach.py scan
+"""
+# module imports
+import argparse
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from sqlalchemy import exists, select
+from models import BreachFinding, BreachReport, Email, UserDeletion, db
+
+MAGIC = b'BRIX'
+VERSION = 1
+# magic, version, hash functions, prefix bits, bytes per bucket, number of hashes
+_HEADER = struct.Struct('<4sHBBIQ')
+# the buckets start at this offset of the index file
+DATA_OFFSET = 64
+# target size of a bucket, a lookup reads a single bucket
+BUCKET_BYTES = 512
+# prefix buckets of haveibeenpwned use 20 bits (5 hex characters)
+MAX_PREFIX_BITS = 20
+FALSE_POSITIVE_RATE = 0.001
+# number of emails checked per transaction of a scan
+SCAN_CHUNK_SIZE = 5000
+
+
+def email_hash(mail):
+    """
+    The SHA-1 digest of a normalized email address
+
+    :param mail: the email address
+    :return: the 20 bytes digest
+    """
+    return hashlib.sha1(mail.strip().lower().encode('utf-8')).digest()
+
+
+def index_parameters(count, fp_rate=FALSE_POSITIVE_RATE):
+    """
+    Size a blocked Bloom filter
+
+    :param count: number of hashes
+    :param fp_rate: the wanted false positive rate
+    :return: tuple of the number of hash functions, prefix bits and bytes per bucket
+    """
+    bits_per_key = -math.log(fp_rate) / math.log(2) ** 2
+    hash_count = max(1, min(16, round(bits_per_key * math.log(2))))
+    total_bytes = max(8, math.ceil(count * bits_per_key / 8))
+    prefix_bits = max(0, min(MAX_PREFIX_BITS, math.floor(math.log2(total_bytes / BUCKET_BYTES)))) \
+        if total_bytes > BUCKET_BYTES else 0
+    # round buckets up to whole 64 bit words
+    bucket_bytes = math.ceil(total_bytes / (1 << prefix_bits) / 8) * 8
+    return hash_count, prefix_bits, bucket_bytes
+
+
+def _positions(digest, hash_count, prefix_bits, bucket_bytes):
+    """
+    The bits of a hash in the index, by double hashing
+
+    :param digest: the SHA-1 digest
+    :param hash_count: number of hash functions
+    :param prefix_bits: number of bits of the bucket prefix
+    :param bucket_bytes: bytes per bucket
+    :return: list of (byte offset in the file, bit mask)
+    """
+    bucket = int.from_bytes(digest[:4], 'big') >> (32 - prefix_bits) if prefix_bits else 0
+    first = int.from_bytes(digest[4:12], 'little')
+    second = int.from_bytes(digest[12:20], 'little') | 1
+    bits = bucket_bytes * 8
+    start = DATA_OFFSET + bucket * bucket_bytes
+    positions = []
+    for number in range(hash_count):
+        bit = (first + number * second) % bits
+        positions.append((start + (bit >> 3), 1 << (bit & 7)))
+    return positions
+
+
+def iter_dump(path):
+    """
+    Read the hashes of a breach dump
+
+    :param path: path of the dump
+    :return: generator of 20 bytes digests
+    """
+    with open(path, encoding='ascii') as stream:
+        for number, line in enumerate(stream, 1):
+            line = line.split(':', 1)[0].strip()
+            if not line:
+                continue
+            if len(line) != 40:
+                raise ValueError('Line %d of %s is not a SHA-1 hash' % (number, path))
+            yield bytes.fromhex(line)
+
+
+def build_index(dump_path, index_path, fp_rate=FALSE_POSITIVE_RATE):
+    """
+    Build the index from a breach dump. The dump is read twice, once to count
+    the hashes and once to add them, and the index is written through a
+    memory map, so neither has to fit into memory. The new index replaces
+    the old one atomically.
+
+    :param dump_path: path of the dump
+    :param index_path: path of the index file
+    :param fp_rate: the wanted false positive rate
+    :return: the number of hashes added
+    """
+    count = sum(1 for _ in iter_dump(dump_path))
+    hash_count, prefix_bits, bucket_bytes = index_parameters(count, fp_rate)
+    size = DATA_OFFSET + (bucket_bytes << prefix_bits)
+    directory = os.path.dirname(os.path.abspath(index_path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w+b') as stream:
+            stream.truncate(size)
+            with mmap.mmap(stream.fileno(), size) as data:
+                data[:_HEADER.size] = _HEADER.pack(MAGIC, VERSION, hash_count, prefix_bits, bucket_bytes, count)
+                for digest in iter_dump(dump_path):
+                    for offset, mask in _positions(digest, hash_count, prefix_bits, bucket_bytes):
+                        data[offset] |= mask
+                data.flush()
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, index_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return count
+
+
+class BreachIndex(object):
+    """
+    A memory-mapped breach index
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the index file
+        """
+        self.path = path
+        with open(path, 'rb') as stream:
+            stat = os.fstat(stream.fileno())
+            if stat.st_size < DATA_OFFSET:
+                raise ValueError('%s is not a breach index, it is shorter than its header' % path)
+            self._data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        magic, version, self.hash_count, self.prefix_bits, self.bucket_bytes, self.count = \
+            _HEADER.unpack_from(self._data)
+        if magic != MAGIC or version != VERSION \
+                or len(self._data) != DATA_OFFSET + (self.bucket_bytes << self.prefix_bits):
+            self._data.close()
+            raise ValueError('%s is not a breach index' % path)
+
+    def contains_hash(self, digest):
+        """
+        Whether a SHA-1 digest is in the index
+
+        :param digest: the 20 bytes digest
+        :return: True if the digest is (probably) in the dump
+        """
+        data = self._data
+        for offset, mask in _positions(digest, self.hash_count, self.prefix_bits, self.bucket_bytes):
+            if not data[offset] & mask:
+                return False
+        return True
+
+    def is_breached(self, mail):
+        """
+        Whether an email address is in the index
+
+        :param mail: the email address
+        :return: True if the address is (probably) in the dump
+        """
+        return self.contains_hash(email_hash(mail))
+
+    def close(self):
+        """
+        Unmap the index file
+
+        :return: None
+        """
+        self._data.close()
+
+
+_index_lock = threading.Lock()
+
+
+def get_index(app):
+    """
+    The breach index of the app, opened on first use and reopened when the
+    file was rebuilt. The path is BREACH_INDEX of the app config, relative
+    to the user-service directory.
+
+    :param app: the Flask app
+    :return: the BreachIndex, or None if there is no index file
+    """
+    if not app.config.get('BREACH_INDEX'):
+        return None
+    path = os.path.join(app.root_path, app.config['BREACH_INDEX'])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    index = app.extensions.get('breach_index')
+    if index is None or index.path != path or index.signature != (stat.st_mtime_ns, stat.st_size):
+        with _index_lock:
+            index = app.extensions.get('breach_index')
+            if index is None or index.path != path or index.signature != (stat.st_mtime_ns, stat.st_size):
+                # the old map stays valid for requests still using it, it is closed when collected
+                index = app.extensions['breach_index'] = BreachIndex(path)
+    return index
+
+
+def scan(engine, index, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Check every row of the email table against the index, except the emails
+    of users scheduled for deletion. The emails are read in chunks ordered by
+    id, and the breached ones of every chunk are written to the report in the
+    same transaction, so a report can be followed while the scan runs.
+
+    :param engine: the database engine
+    :param index: the BreachIndex
+    :param chunk_size: number of emails per transaction
+    :return: the id of the BreachReport
+    """
+    reports = BreachReport.__table__
+    findings = BreachFinding.__table__
+    email = Email.__table__
+    deletion = UserDeletion.__table__
+    with engine.begin() as connection:
+        report_id = connection.execute(reports.insert().values(
+            status='running', scanned=0, flagged=0, hashes=index.count)).inserted_primary_key[0]
+    last_id = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(email.c.id, email.c.user_id, email.c.mail)
+                .where(email.c.id > last_id, ~exists().where(deletion.c.user_id == email.c.user_id))
+                .order_by(email.c.id).limit(chunk_size)).all()
+            flagged = [{'report_id': report_id, 'email_id': email_id, 'user_id': user_id, 'mail': mail}
+                       for email_id, user_id, mail in rows if mail and index.is_breached(mail)]
+            if flagged:
+                connection.execute(findings.insert(), flagged)
+            connection.execute(reports.update().where(reports.c.id == report_id).values(
+                scanned=reports.c.scanned + len(rows), flagged=reports.c.flagged + len(flagged),
+                status='running' if len(rows) == chunk_size else 'done'))
+        if len(rows) < chunk_size:
+            return report_id
+        last_id = rows[-1][0]
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    :param argv: the command line arguments
+    :return: the exit code
+    """
+    parser = argparse.ArgumentParser(description='Check email addresses against a local breach dump.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build the index from a dump of SHA-1 hashes')
+    build.add_argument('dump', help='path of the dump, one SHA-1 hash per line')
+    build.add_argument('index', help='path of the index file')
+    build.add_argument('--fp-rate', type=float, default=FALSE_POSITIVE_RATE, help='false positive rate')
+    check = commands.add_parser('check', help='check an email address')
+    check.add_argument('mail', help='the email address')
+    check.add_argument('--index', help='path of the index file, defaults to BREACH_INDEX of the config')
+    scan_command = commands.add_parser('scan', help='check all emails of the database and write a report')
+    scan_command.add_argument('--index', help='path of the index file, defaults to BREACH_INDEX of the config')
+    scan_command.add_argument('--chunk-size', type=int, default=SCAN_CHUNK_SIZE, help='emails per transaction')
+    scan_command.add_argument('--config', default='config.py', help='the Flask config file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        count = build_index(args.dump, args.index, args.fp_rate)
+        print('Added %d hashes to %s (%d bytes)' % (count, args.index, os.path.getsize(args.index)))
+        return 0
+    if args.command == 'check':
+        if args.index is None:
+            from flask import Config
+            root = os.path.dirname(os.path.abspath(__file__))
+            config = Config(root)
+            config.from_pyfile('config.py')
+            args.index = os.path.join(root, config['BREACH_INDEX'])
+        breached = BreachIndex(args.index).is_breached(args.mail)
+        print('%s: %s' % (args.mail, 'breached' if breached else 'not found'))
+        return 1 if breached else 0
+
+    from app import create_app
+    app = create_app(args.config)
+    with app.app_context():
+        db.create_all()
+        index = BreachIndex(args.index or os.path.join(app.root_path, app.config['BREACH_INDEX']))
+        report_id = scan(db.engine, index, args.chunk_size)
+        report = BreachReport.query.get(report_id)
+        print('Report %d: %d of %d emails breached' % (report.id, report.flagged, report.scanned))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Coalescing of concurrent identical reads (single flight).
+
+When COALESCE_READS is enabled, a lookup of a user by id or by name that
+arrives while the same lookup is already running in another thread of the
+worker does not query the database: it waits for the running lookup and
+answers with a copy of its serialized response. A request that waited
+COALESCE_TIMEOUT seconds, e.g. for a lookup that hangs, runs its own
+lookup. Nothing is cached, a lookup that arrives after the running one
+finished starts a new one.
+
+A write to a user detaches the running lookups of the user and of its name
+once it is committed, so requests arriving after the write start a new
+lookup and see it; the requests that already joined a lookup get its
+response, as they would have without coalescing. Writes of other processes
+(e.g. ingest.py) are seen by lookups started after they were committed.
+Lookups that are operations of a batch see the uncommitted changes of the
+batch, they are never shared.
+
+The counters are kept per app and served by ``GET /admin/coalescing/``.
+"""
+# module imports
+import threading
+from flask import current_app
+import batch
+
+
+class Flight(object):
+    """
+    A running lookup and the requests waiting for it
+    """
+    __slots__ = ('done', 'response')
+
+    def __init__(self):
+        self.done = threading.Event()
+        # tuple of the body, status code and mimetype once the lookup finished
+        self.response = None
+
+
+class SingleFlight(object):
+    """
+    The running lookups of an app, by key
+    """
+    def __init__(self, timeout=None):
+        """
+        :param timeout: seconds a request waits for a running lookup before it runs its own, None to wait forever
+        """
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        # lookups that queried the database
+        self.fetches = 0
+        # requests answered with the response of another lookup
+        self.coalesced = 0
+        # running lookups detached by a write
+        self.detached = 0
+        # requests that waited for a lookup that failed and ran their own
+        self.retried = 0
+        # requests that gave up waiting for a lookup and ran their own
+        self.timed_out = 0
+
+    def run(self, key, fetch):
+        """
+        Run a lookup, or wait for the same lookup if it is already running
+
+        :param key: the key of the lookup, see user_key and name_key
+        :param fetch: function without arguments returning the response of the lookup
+        :return: the response
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.fetches += 1
+        if leader:
+            try:
+                response = fetch()
+                flight.response = (response.get_data(), response.status_code, response.mimetype)
+                return response
+            finally:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                flight.done.set()
+        finished = flight.done.wait(self.timeout)
+        # the response is read once, a lookup finishing right now does not change the decision
+        shared = flight.response if finished else None
+        with self._lock:
+            if not finished:
+                self.timed_out += 1
+            elif shared is None:
+                self.retried += 1
+            else:
+                self.coalesced += 1
+        if shared is None:
+            # the lookup hangs or failed, the error is not shared
+            return fetch()
+        data, status, mimetype = shared
+        return current_app.response_class(data, status=status, mimetype=mimetype)
+
+    def detach(self, keys=None):
+        """
+        Detach running lookups, the next requests for them start a new lookup
+
+        :param keys: the keys of the lookups, None for all
+        :return: None
+        """
+        with self._lock:
+            if keys is None:
+                keys = list(self._flights)
+            for key in keys:
+                if self._flights.pop(key, None) is not None:
+                    self.detached += 1
+
+    def stats(self):
+        """
+        :return: dict with the counters and the number of running lookups
+        """
+        with self._lock:
+            return {'fetches': self.fetches, 'coalesced': self.coalesced, 'detached': self.detached,
+                    'retried': self.retried, 'timed_out': self.timed_out, 'running': len(self._flights)}
+
+
+def user_key(user_id):
+    """
+    :param user_id: the user id
+    :return: the key of the lookup of a user by id
+    """
+    return 'id', user_id
+
+
+def name_key(first_name, last_name):
+    """
+    :param first_name: the first name
+    :param last_name: the last name
+    :return: the key of the lookup of users by name, ignoring case
+    """
+    return 'name', first_name.lower(), last_name.lower()
+
+
+def user_keys(user_object):
+    """
+    The keys of the lookups that return a user. Call it before the changes
+    are committed, the attributes are expired by the commit.
+
+    :param user_object: the User
+    :return: list of keys
+    """
+    return [user_key(user_object.id), name_key(user_object.first_name, user_object.last_name)]
+
+
+def _single_flight():
+    """
+    :return: the SingleFlight of the current app, or None if coalescing is disabled
+    """
+    return current_app.extensions.get('single_flight')
+
+
+def coalesce(key, fetch):
+    """
+    Run a read, shared with the concurrent requests running the same read
+
+    :param key: the key of the read
+    :param fetch: function without arguments returning the response
+    :return: the response
+    """
+    single_flight = _single_flight()
+    if single_flight is None or batch.in_batch():
+        return fetch()
+    return single_flight.run(key, fetch)
+
+
+def invalidate(keys=None):
+    """
+    Detach the running reads of changed users once the changes are committed
+
+    :param keys: the keys of the reads, e.g. from user_keys, None for all
+    :return: None
+    """
+    single_flight = _single_flight()
+    if single_flight is not None:
+        batch.after_commit(lambda: single_flight.detach(keys))
+
+
+def init_app(app):
+    """
+    Enable coalescing if COALESCE_READS is set in the app config. The
+    SingleFlight is stored in app.extensions['single_flight'].
+
+    :param app: the Flask app
+    :return: the SingleFlight, or None if coalescing is disabled
+    """
+    if not app.config.get('COALESCE_READS', True):
+        return None
+    single_flight = app.extensions['single_flight'] = SingleFlight(app.config.get('COALESCE_TIMEOUT', 5.0))
+    return single_flight
@@ -7,3 +7,40 @@ SECRET_KEY = "rFsad!3dfs&df2$2###@@df"
 # the below statement is added to suppress the deprecated warning
 # issued by SQLAlchemy module
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# keep the memory of the workers bounded: at most 100 compiled statements are
+# cached per engine, no queries are recorded and request bodies (e.g. of a
+# batch) are limited to 1 MB
+SQLALCHEMY_ENGINE_OPTIONS = {'query_cache_size': 100}
+SQLALCHEMY_RECORD_QUERIES = False
+MAX_CONTENT_LENGTH = 1024 * 1024
+# set to True to answer failed requests with the old {"msg": ...} body and
+# HTTP 200 instead of a structured error with a proper status code
+LEGACY_ERROR_RESPONSES = False
+# users deleted in bulk are purged by a background thread, in chunks of
+# PURGE_CHUNK_SIZE users with a pause of PURGE_PAUSE seconds in between
+PURGE_IN_BACKGROUND = True
+PURGE_CHUNK_SIZE = 500
+PURGE_PAUSE = 0.05
+# maximum number of operations of a request to /batch/
+BATCH_MAX_OPERATIONS = 100
+# set to True to explain every distinct SQL statement and record table scans,
+# temporary B-trees and automatic indexes per endpoint (see query_audit.py);
+# scans on tables with at least QUERY_AUDIT_MIN_ROWS rows are logged
+QUERY_AUDIT = False
+QUERY_AUDIT_MIN_ROWS = 1000
+# fraction of the requests profiled (0 to disable); requests sending
+# PROFILE_TOKEN in the X-Profile-Token header are always profiled, and only
+# they can download the last PROFILE_BUFFER_SIZE profiles from /admin/profiles/
+PROFILE_SAMPLE_RATE = 0
+PROFILE_TOKEN = None
+PROFILE_BUFFER_SIZE = 20
+# seconds between two stack samples of a profiled request
+PROFILE_INTERVAL = 0.005
+# the breach index built with "python breach.py build", relative to the
+# user-service directory
+BREACH_INDEX = 'breach_index.bin'
+# concurrent requests for the same user or name share one lookup and its
+# response (see coalescing.py); the counters are served by /admin/coalescing/
+COALESCE_READS = True
+# seconds a request waits for the same lookup before it runs its own
+COALESCE_TIMEOUT = 5.0
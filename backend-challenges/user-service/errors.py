@@ -0,0 +1,55 @@
+# module imports
+from flask import current_app, jsonify
+
+# machine-readable error codes returned by the API
+MISSING_FIELDS = 'missing_fields'
+INVALID_FIELDS = 'invalid_fields'
+USER_NOT_FOUND = 'user_not_found'
+COURSE_NOT_FOUND = 'course_not_found'
+JOB_NOT_FOUND = 'job_not_found'
+PROFILE_NOT_FOUND = 'profile_not_found'
+REPORT_NOT_FOUND = 'report_not_found'
+EMAIL_NOT_FOUND = 'email_not_found'
+PHONE_NOT_FOUND = 'phone_not_found'
+EMAIL_EXISTS = 'email_exists'
+PHONE_EXISTS = 'phone_exists'
+UNCHANGED_VALUE = 'unchanged_value'
+FORBIDDEN = 'forbidden'
+BREACH_INDEX_UNAVAILABLE = 'breach_index_unavailable'
+
+# the HTTP status code sent with each error code
+ERROR_STATUS = {
+    MISSING_FIELDS: 400,
+    INVALID_FIELDS: 400,
+    UNCHANGED_VALUE: 400,
+    FORBIDDEN: 403,
+    USER_NOT_FOUND: 404,
+    COURSE_NOT_FOUND: 404,
+    JOB_NOT_FOUND: 404,
+    PROFILE_NOT_FOUND: 404,
+    REPORT_NOT_FOUND: 404,
+    EMAIL_NOT_FOUND: 404,
+    PHONE_NOT_FOUND: 404,
+    EMAIL_EXISTS: 409,
+    PHONE_EXISTS: 409,
+    BREACH_INDEX_UNAVAILABLE: 503,
+}
+
+
+def error_response(code, msg):
+    """
+    Build the JSON response for a failed request. The response is stateless:
+    nothing is written to the session, so no cookie has to be signed.
+
+    If LEGACY_ERROR_RESPONSES is set in the app config, the old body
+    ``{"msg": msg}`` is returned with HTTP 200 instead.
+
+    :param code: one of the error codes defined in this module
+    :param msg: the human readable error message
+    :return: the response object
+    """
+    if current_app.config.get('LEGACY_ERROR_RESPONSES', False):
+        return jsonify({"msg": msg})
+    response = jsonify({"error": {"code": code, "message": msg}})
+    response.status_code = ERROR_STATUS[code]
+    return response
@@ -0,0 +1,46 @@
+"""
+gunicorn settings for the slim runtime. Workers and threads follow the CPU
+and memory limits of the container (see runtime.py); WEB_CONCURRENCY and
+THREADS override them. The tables missing in the database are created once,
+when gunicorn starts.
+"""
+# module imports
+import os
+import subprocess
+import sys
+from runtime import worker_settings
+
+_settings = worker_settings()
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', _settings['workers']))
+threads = int(os.environ.get('THREADS', _settings['threads']))
+worker_class = 'gthread'
+# the app is loaded in the workers, so the master stays small
+preload_app = False
+# restart workers from time to time, so memory growth stays bounded
+max_requests = 1000
+max_requests_jitter = 100
+timeout = 30
+# seconds an idle keep-alive connection is kept open; the gthread workers park idle connections
+# without holding a thread. It is longer than the 30 seconds the async client of
+# user_service_client keeps idle pooled connections, so clients close them first and do not send
+# a request on a connection the server is closing; the sync client checks pooled connections
+# before reusing them and sends a request once more if the server closed its connection anyway
+keepalive = int(os.environ.get('KEEPALIVE', 35))
+# heartbeat files in memory instead of on a possibly slow disk, where it exists
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def on_starting(server):
+    """
+    Create the tables missing in the database before the workers start (see
+    app.init_db). It runs in a separate interpreter, so the master does not
+    load the app; gunicorn does not start if it fails.
+
+    :param server: the gunicorn arbiter
+    :return: None
+    """
+    subprocess.run([sys.executable, '-m', 'flask', 'init-db'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                   env=dict(os.environ, FLASK_APP='wsgi.py'), check=True)
@@ -0,0 +1,362 @@
+"""
+Loads the users, courses and certificates of the data-engineer challenge
+into the service database.
+
+The JSON files are parsed incrementally and written in batches, one
+transaction per batch, so the size of the input files is not bounded by
+memory. Every batch is an upsert, so the ingestion can safely be re-run.
+
+Usage (from the user-service directory):
+
+    python ingest.py --users ../../data-engineer/users.json \\
+        --courses ../../data-engineer/courses.json \\
+        --certificates ../../data-engineer/certificates.json
+"""
+# module imports
+import argparse
+import json
+import re
+from datetime import datetime, timezone
+from itertools import islice
+from sqlalchemy import bindparam, func, select, text
+import analytics
+from models import NO_START, Certificate, Course, Email, ImportedUser, User, db, duration_ms, upsert_insert
+
+# number of characters read from the input file at once
+CHUNK_SIZE = 64 * 1024
+# number of records written per transaction
+BATCH_SIZE = 5000
+# upper bound of the characters of one record in the input files
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+
+_WHITESPACE = ' \t\r\n'
+# what remains of a JSON value cut off inside a literal, number or escape sequence
+_CUT_OFF = re.compile(r'[\w.+-]*\Z')
+
+
+def _cut_off(error):
+    """
+    Whether a decode error may be caused by the end of the buffer, i.e. the
+    value could still be valid once more of the file is read
+
+    :param error: the json.JSONDecodeError
+    :return: True if more input may resolve the error
+    """
+    return error.msg.startswith('Unterminated string') or _CUT_OFF.match(error.doc, error.pos) is not None
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE, max_size=MAX_RECORD_SIZE):
+    """
+    Incrementally parse a file containing a JSON array and yield its elements
+    one by one, without loading the whole file. An invalid element fails as
+    soon as it was read.
+
+    :param stream: text file object positioned at the start of the array
+    :param chunk_size: number of characters read at once
+    :param max_size: maximum number of characters of one element
+    :return: generator of the decoded array elements
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+    expect_value = True
+    after_comma = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Unexpected end of file inside the JSON array')
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise ValueError('The file does not contain a JSON array')
+            started = True
+            pos += 1
+        elif char == ']':
+            # a "," must be followed by another element
+            if after_comma:
+                raise ValueError('Expected a JSON array element after ","')
+            return
+        elif not expect_value:
+            if char != ',':
+                raise ValueError('Expected "," between JSON array elements')
+            expect_value = after_comma = True
+            pos += 1
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as error:
+                # only an element cut off by the end of the buffer is worth reading more for
+                if eof or not _cut_off(error):
+                    raise
+                end = None
+            if end is None or (end == len(buffer) and not eof):
+                if len(buffer) - pos > max_size:
+                    raise ValueError('JSON array element larger than %d characters' % max_size)
+                # the element may continue in the next chunk, read more and retry
+                chunk = stream.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield value
+            pos = end
+            expect_value = after_comma = False
+
+
+def parse_timestamp(value):
+    """
+    Convert an ISO 8601 timestamp such as ``2021-05-30T14:19:55.636Z`` into a
+    naive datetime in UTC
+
+    :param value: the timestamp string
+    :return: the datetime object, or None if no value is given
+    """
+    if not value:
+        return None
+    if value.endswith('Z'):
+        return datetime.fromisoformat(value[:-1])
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def batched(iterable, size):
+    """
+    Split an iterable into lists of at most size elements
+
+    :param iterable: the iterable to split
+    :param size: the maximum number of elements per list
+    :return: generator of lists
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def ingest_courses(engine, path, batch_size=BATCH_SIZE):
+    """
+    Load the courses file, inserting new courses and updating existing ones
+
+    :param engine: the database engine
+    :param path: path of the courses JSON file
+    :param batch_size: number of courses written per transaction
+    :return: the number of courses processed
+    """
+    count = 0
+    with open(path, encoding='utf-8') as stream:
+        for records in batched(iter_json_array(stream), batch_size):
+            rows = [{
+                'id': record['id'], 'title': record.get('title'),
+                'description': record.get('description'),
+                'published_at': parse_timestamp(record.get('publishedAt'))
+            } for record in records]
+            with engine.begin() as connection:
+                statement = upsert_insert(connection, Course.__table__)
+                statement = statement.on_conflict_do_update(
+                    index_elements=['id'],
+                    set_={'title': statement.excluded.title,
+                          'description': statement.excluded.description,
+                          'published_at': statement.excluded.published_at})
+                connection.execute(statement, rows)
+            count += len(rows)
+    return count
+
+
+def _insert_users(connection, rows):
+    """
+    Insert new users with one statement
+
+    :param connection: the database connection
+    :param rows: list of dicts with last_name and first_name
+    :return: list of the ids of the users, in the order of the rows
+    """
+    user_table = User.__table__
+    if connection.dialect.name == 'postgresql':
+        # the ids are reserved first, other writers may take ids of the sequence at the same time
+        user_ids = connection.execute(
+            text('SELECT nextval(pg_get_serial_sequence(\'"user"\', \'id\')) FROM generate_series(1, :count)'),
+            {'count': len(rows)}).scalars().all()
+        connection.execute(user_table.insert(), [dict(row, id=user_id) for row, user_id in zip(rows, user_ids)])
+        return user_ids
+    # SQLite holds the write lock from the first write of the transaction, so the rows get the
+    # rowids following the largest one, in order
+    connection.execute(user_table.insert(), rows)
+    last_id = connection.execute(select(func.max(user_table.c.id))).scalar()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def _upsert_users(connection, records, batch):
+    """
+    Write one batch of external users. New users get a User and an Email
+    record; users that were already imported get their names updated and
+    their email added if it is missing.
+
+    :param connection: the database connection
+    :param records: dict of external id to user record
+    :param batch: the name of the import batch
+    :return: None
+    """
+    user_table = User.__table__
+    email_table = Email.__table__
+    imported = dict(connection.execute(
+        select(ImportedUser.external_id, ImportedUser.user_id)
+        .where(ImportedUser.external_id.in_(list(records)))).all())
+
+    new_users = []
+    new_emails = []
+    updates = []
+    for external_id, record in records.items():
+        last_name = (record.get('lastName') or '').lower()
+        first_name = (record.get('firstName') or '').lower()
+        mail = (record.get('email') or '').lower()
+        user_id = imported.get(external_id)
+        if user_id is None:
+            new_users.append((external_id, {'last_name': last_name, 'first_name': first_name}, mail))
+        else:
+            updates.append({'uid': user_id, 'last_name': last_name, 'first_name': first_name, 'mail': mail})
+
+    links = []
+    if new_users:
+        user_ids = _insert_users(connection, [row for _, row, _ in new_users])
+        for (external_id, _, mail), user_id in zip(new_users, user_ids):
+            links.append({'external_id': external_id, 'user_id': user_id, 'batch': batch})
+            if mail:
+                new_emails.append({'mail': mail, 'user_id': user_id})
+
+    if updates:
+        connection.execute(
+            user_table.update().where(user_table.c.id == bindparam('uid'))
+            .values(last_name=bindparam('last_name'), first_name=bindparam('first_name')),
+            [{'uid': row['uid'], 'last_name': row['last_name'], 'first_name': row['first_name']}
+             for row in updates])
+        known_mails = set(connection.execute(
+            select(email_table.c.user_id, email_table.c.mail)
+            .where(email_table.c.user_id.in_([row['uid'] for row in updates]))).all())
+        new_emails.extend({'mail': row['mail'], 'user_id': row['uid']} for row in updates
+                          if row['mail'] and (row['uid'], row['mail']) not in known_mails)
+    if links:
+        connection.execute(ImportedUser.__table__.insert(), links)
+    if new_emails:
+        connection.execute(email_table.insert(), new_emails)
+
+
+def ingest_users(engine, path, batch='default', batch_size=BATCH_SIZE):
+    """
+    Load the users file into the User and Email tables
+
+    :param engine: the database engine
+    :param path: path of the users JSON file
+    :param batch: name of the import batch the new users are recorded with
+    :param batch_size: number of users written per transaction
+    :return: the number of users processed
+    """
+    count = 0
+    with open(path, encoding='utf-8') as stream:
+        for records in batched(iter_json_array(stream), batch_size):
+            with engine.begin() as connection:
+                _upsert_users(connection, {record['id']: record for record in records}, batch)
+            count += len(records)
+    return count
+
+
+def ingest_certificates(engine, path, batch_size=BATCH_SIZE, top_k=analytics.TOP_K):
+    """
+    Load the certificates file. A certificate is identified by course, user
+    and start date; re-loading it updates its completion date. The analytics
+    summary tables are updated in the same transaction as every batch.
+
+    :param engine: the database engine
+    :param path: path of the certificates JSON file
+    :param batch_size: number of certificates written per transaction
+    :param top_k: number of fastest and slowest completions kept per course
+    :return: the number of certificates processed
+    """
+    count = 0
+    with open(path, encoding='utf-8') as stream:
+        for records in batched(iter_json_array(stream), batch_size):
+            rows = {}
+            for record in records:
+                started_at = parse_timestamp(record.get('startDate'))
+                completed_at = parse_timestamp(record.get('completedDate'))
+                row = {
+                    'course_id': record['course'], 'user_external_id': record['user'],
+                    'started_at': started_at if started_at is not None else NO_START,
+                    'completed_at': completed_at, 'duration_ms': duration_ms(started_at, completed_at)
+                }
+                # a certificate repeated within the batch is written once, the last one wins
+                rows[analytics.certificate_key(row)] = row
+            rows = list(rows.values())
+            with engine.begin() as connection:
+                previous = analytics.existing_durations(connection, rows)
+                statement = upsert_insert(connection, Certificate.__table__)
+                statement = statement.on_conflict_do_update(
+                    index_elements=['course_id', 'user_external_id', 'started_at'],
+                    set_={'completed_at': statement.excluded.completed_at,
+                          'duration_ms': statement.excluded.duration_ms})
+                connection.execute(statement, rows)
+                analytics.record_certificates(connection, rows, previous, top_k)
+            count += len(records)
+    return count
+
+
+def ingest(engine, users=None, courses=None, certificates=None, batch='default', batch_size=BATCH_SIZE):
+    """
+    Load the given files, courses and users before the certificates that
+    reference them
+
+    :param engine: the database engine
+    :param users: path of the users JSON file
+    :param courses: path of the courses JSON file
+    :param certificates: path of the certificates JSON file
+    :param batch: name of the import batch for new users
+    :param batch_size: number of records written per transaction
+    :return: dict with the number of records processed per file
+    """
+    counts = {}
+    if courses:
+        counts['courses'] = ingest_courses(engine, courses, batch_size)
+    if users:
+        counts['users'] = ingest_users(engine, users, batch, batch_size)
+    if certificates:
+        counts['certificates'] = ingest_certificates(engine, certificates, batch_size)
+    return counts
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    :param argv: the command line arguments
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description='Load users, courses and certificates into the database.')
+    parser.add_argument('--users', help='path of the users JSON file')
+    parser.add_argument('--courses', help='path of the courses JSON file')
+    parser.add_argument('--certificates', help='path of the certificates JSON file')
+    parser.add_argument('--batch', default='default', help='name of the import batch for new users')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='records written per transaction')
+    parser.add_argument('--config', default='config.py', help='the Flask config file')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    app = create_app(args.config)
+    with app.app_context():
+        db.create_all()
+        counts = ingest(db.engine, args.users, args.courses, args.certificates, args.batch, args.batch_size)
+    for name, count in counts.items():
+        print('%s: %d records' % (name, count))
+
+
+if __name__ == '__main__':
+    main()
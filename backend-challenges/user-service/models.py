@@ -1,10 +1,46 @@
 # module imports
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exists
 
 # create an instance of database to be used in the models
 db = SQLAlchemy()
 
 
+def upsert_insert(connection, table):
+    """
+    Create an INSERT statement for the dialect of the connection that
+    supports ON CONFLICT clauses
+
+    :param connection: the database connection
+    :param table: the table to insert into
+    :return: the insert statement
+    """
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+# the start of certificates without a start date: the start is part of the unique key of a
+# certificate, and as NULLs are distinct there, such certificates would be inserted on every import
+NO_START = datetime(1970, 1, 1)
+
+
+def duration_ms(started_at, completed_at):
+    """
+    The time between two datetimes in whole milliseconds
+
+    :param started_at: the start datetime
+    :param completed_at: the end datetime
+    :return: the number of milliseconds, or None if one of the datetimes is missing
+    """
+    if started_at is None or completed_at is None:
+        return None
+    return (completed_at - started_at) // timedelta(milliseconds=1)
+
+
 class User(db.Model):
     """
     The User model (table)
@@ -18,6 +54,15 @@ class User(db.Model):
         self.last_name = last_name
         self.first_name = first_name
 
+    @classmethod
+    def active(cls):
+        """
+        Query of the users that are not marked as deleted
+
+        :return: the query object
+        """
+        return cls.query.filter(~exists().where(UserDeletion.user_id == cls.id))
+
 
 class Email(db.Model):
     """
@@ -44,4 +89,169 @@ class PhoneNumber(db.Model):
 
     def __init__(self, number, user_id):
         self.phone = number
-        self.user_id = user_id
\ No newline at end of file
+        self.user_id = user_id
+
+
+class ImportedUser(db.Model):
+    """
+    Links a user loaded from an external data source (keyed by UUID) to the
+    User record created for it, together with the import batch it came from
+    """
+    __tablename__ = 'imported_user'
+    external_id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    batch = db.Column(db.String(100), index=True)
+
+    def __init__(self, external_id, user_id, batch):
+        self.external_id = external_id
+        self.user_id = user_id
+        self.batch = batch
+
+
+class Course(db.Model):
+    """
+    The Course model (table)
+    """
+    __tablename__ = 'course'
+    id = db.Column(db.String(36), primary_key=True)
+    title = db.Column(db.String(200))
+    description = db.Column(db.Text)
+    published_at = db.Column(db.DateTime)
+
+    def __init__(self, id, title, description, published_at):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.published_at = published_at
+
+
+class Certificate(db.Model):
+    """
+    The Certificate model (table). A certificate records that a user started
+    and completed a course; users are referenced by their external UUID.
+    """
+    __tablename__ = 'certificate'
+    __table_args__ = (db.UniqueConstraint('course_id', 'user_external_id', 'started_at'),
+                      db.Index('ix_certificate_course_duration', 'course_id', 'duration_ms'))
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.String(36), db.ForeignKey('course.id'), index=True)
+    user_external_id = db.Column(db.String(36), db.ForeignKey('imported_user.external_id'), index=True)
+    # NO_START if the start date is unknown
+    started_at = db.Column(db.DateTime, nullable=False)
+    completed_at = db.Column(db.DateTime)
+    # time needed to complete the course, None while it is not completed
+    duration_ms = db.Column(db.BigInteger)
+
+    def __init__(self, course_id, user_external_id, started_at, completed_at):
+        self.course_id = course_id
+        self.user_external_id = user_external_id
+        self.started_at = started_at if started_at is not None else NO_START
+        self.completed_at = completed_at
+        self.duration_ms = duration_ms(started_at, completed_at)
+
+
+class CourseStats(db.Model):
+    """
+    Running totals of the completed certificates of a course, maintained
+    while certificates are ingested
+    """
+    __tablename__ = 'course_stats'
+    course_id = db.Column(db.String(36), db.ForeignKey('course.id'), primary_key=True)
+    certificate_count = db.Column(db.Integer, nullable=False, default=0)
+    total_duration_ms = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __init__(self, course_id, certificate_count, total_duration_ms):
+        self.course_id = course_id
+        self.certificate_count = certificate_count
+        self.total_duration_ms = total_duration_ms
+
+
+class UserStats(db.Model):
+    """
+    Running totals of the completed certificates of an imported user,
+    maintained while certificates are ingested
+    """
+    __tablename__ = 'user_stats'
+    user_external_id = db.Column(db.String(36), db.ForeignKey('imported_user.external_id'), primary_key=True)
+    certificate_count = db.Column(db.Integer, nullable=False, default=0)
+    total_duration_ms = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __init__(self, user_external_id, certificate_count, total_duration_ms):
+        self.user_external_id = user_external_id
+        self.certificate_count = certificate_count
+        self.total_duration_ms = total_duration_ms
+
+
+class CourseRanking(db.Model):
+    """
+    The fastest and slowest completions of a course. For every course this
+    holds at most k rows of each kind ('fastest' or 'slowest').
+    """
+    __tablename__ = 'course_ranking'
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.String(36), db.ForeignKey('course.id'), index=True)
+    kind = db.Column(db.String(10))
+    position = db.Column(db.Integer)
+    user_external_id = db.Column(db.String(36))
+    started_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.BigInteger)
+
+    def __init__(self, course_id, kind, position, user_external_id, started_at, duration_ms):
+        self.course_id = course_id
+        self.kind = kind
+        self.position = position
+        self.user_external_id = user_external_id
+        self.started_at = started_at
+        self.duration_ms = duration_ms
+
+
+class PurgeJob(db.Model):
+    """
+    A bulk delete request. Its users are marked as deleted right away and
+    purged from the database in the background.
+    """
+    __tablename__ = 'purge_job'
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='pending')
+    users = db.Column(db.Integer, default=0)
+    purged = db.Column(db.Integer, default=0)
+
+
+class UserDeletion(db.Model):
+    """
+    Marks a user as deleted until it is purged by its PurgeJob
+    """
+    __tablename__ = 'user_deletion'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('purge_job.id'), index=True)
+
+    def __init__(self, user_id, job_id):
+        self.user_id = user_id
+        self.job_id = job_id
+
+
+class BreachReport(db.Model):
+    """
+    A scan of all emails against the breach index
+    """
+    __tablename__ = 'breach_report'
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='running')
+    # number of hashes in the index used for the scan
+    hashes = db.Column(db.BigInteger, default=0)
+    scanned = db.Column(db.Integer, default=0)
+    flagged = db.Column(db.Integer, default=0)
+
+
+class BreachFinding(db.Model):
+    """
+    An email found in the breach index by a BreachReport
+    """
+    __tablename__ = 'breach_finding'
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.Integer, db.ForeignKey('breach_report.id'), index=True)
+    email_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer)
+    mail = db.Column(db.String(100))
@@ -0,0 +1,354 @@
+"""
+Sampled request profiling.
+
+When PROFILE_SAMPLE_RATE is above 0 or PROFILE_TOKEN is set, a fraction of
+the requests (and every request sending the token in the X-Profile-Token
+header) is profiled by a statistical sampler: a background thread records
+the Python stack of the profiled request threads every PROFILE_INTERVAL
+seconds. The SQL statements of the request are timed with SQLAlchemy
+events and show up as the leaf frame of the stacks sampled while they run.
+
+The last PROFILE_BUFFER_SIZE profiles are kept in memory and served to
+clients sending the token:
+
+- ``GET /admin/profiles/``: summaries of the kept profiles, newest first
+- ``GET /admin/profiles/<id>/``: a profile with its SQL timings
+- ``GET /admin/profiles/<id>/collapsed``: the samples in the collapsed stack
+  format of flamegraph.pl and speedscope
+
+When profiling is disabled nothing is registered on the app or the engine,
+so requests run exactly as without this module.
+"""
+# module imports
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_restful import Api, Resource
+from sqlalchemy import event
+from models import db
+import errors
+
+TOKEN_HEADER = 'X-Profile-Token'
+_ENVIRON_KEY = 'user_service.profile'
+# characters of a statement used in the SQL frames of the stacks
+_SQL_FRAME_LENGTH = 60
+
+
+class Profile(object):
+    """
+    The samples and SQL timings of one request
+    """
+    def __init__(self, profile_id, method, path):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.endpoint = None
+        self.status = None
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.samples = Counter()
+        # statement -> [executions, total milliseconds]
+        self.sql = {}
+        self.current_sql = None
+        self._start = time.perf_counter()
+
+    def finish(self, endpoint, status):
+        """
+        Stop the clock of the profile
+
+        :param endpoint: the endpoint that served the request
+        :param status: the HTTP status code of the response
+        :return: None
+        """
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        self.endpoint = endpoint
+        self.status = status
+
+    def summary(self):
+        """
+        The profile without its samples
+
+        :return: dict
+        """
+        return {
+            'id': self.id, 'method': self.method, 'path': self.path, 'endpoint': self.endpoint,
+            'status': self.status, 'started_at': self.started_at, 'duration_ms': round(self.duration_ms, 3),
+            'samples': sum(self.samples.values()),
+            'sql_ms': round(sum(total for _, total in self.sql.values()), 3),
+            'sql_statements': sum(count for count, _ in self.sql.values()),
+        }
+
+    def collapsed(self):
+        """
+        The samples in the collapsed stack format, one "frame;frame;frame count" line per stack
+
+        :return: the text
+        """
+        return ''.join('%s %d\n' % (stack, count) for stack, count in sorted(self.samples.items()))
+
+
+def _frame_name(frame):
+    """
+    The name of a frame in the collapsed stacks
+
+    :param frame: the frame
+    :return: "module.py:function"
+    """
+    return '%s:%s' % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+
+class Profiler(object):
+    """
+    Samples the threads of the profiled requests and keeps the last profiles
+    """
+    def __init__(self, sample_rate, token, buffer_size, interval):
+        """
+        :param sample_rate: fraction of the requests profiled
+        :param token: requests sending this token are always profiled, and only
+                      they can read the profiles; None to disable
+        :param buffer_size: number of profiles kept
+        :param interval: seconds between two samples
+        """
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.profiles = deque(maxlen=buffer_size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # thread id -> Profile of the request the thread is serving
+        self._active = {}
+        self._wake = threading.Event()
+        self._sampler = None
+
+    def authorized(self):
+        """
+        Whether the current request carries the profiling token
+
+        :return: True if it does
+        """
+        sent = request.headers.get(TOKEN_HEADER)
+        return self.token is not None and sent is not None and hmac.compare_digest(sent, self.token)
+
+    def start(self):
+        """
+        before_request hook, decides whether the request is profiled
+
+        :return: None
+        """
+        if request.blueprint == 'profiling':
+            # reading the profiles is not profiled
+            return
+        if threading.get_ident() in self._active:
+            # an operation of a batch request, it is part of the profile of the batch
+            return
+        if not (self.authorized() or (self.sample_rate and random.random() < self.sample_rate)):
+            return
+        profile = Profile(next(self._ids), request.method, request.path)
+        request.environ[_ENVIRON_KEY] = profile
+        self._active[threading.get_ident()] = profile
+        if self._sampler is None:
+            with self._lock:
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+                    self._sampler.start()
+        self._wake.set()
+
+    def record_status(self, response):
+        """
+        after_request hook, keeps the status of the response
+
+        :param response: the response
+        :return: the response
+        """
+        profile = request.environ.get(_ENVIRON_KEY)
+        if profile is not None:
+            profile.status = response.status_code
+        return response
+
+    def stop(self, exception=None):
+        """
+        teardown_request hook, stores the profile of the request
+
+        :param exception: the exception raised by the request, if any
+        :return: None
+        """
+        profile = request.environ.pop(_ENVIRON_KEY, None)
+        if profile is None:
+            return
+        self._active.pop(threading.get_ident(), None)
+        profile.finish(request.endpoint, 500 if exception is not None else profile.status)
+        with self._lock:
+            self.profiles.append(profile)
+
+    def get(self, profile_id):
+        """
+        Find a kept profile
+
+        :param profile_id: the id of the profile
+        :return: the Profile, or None
+        """
+        with self._lock:
+            return next((profile for profile in self.profiles if profile.id == profile_id), None)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """
+        SQLAlchemy event handler, starts the clock of a statement of a profiled request
+
+        :return: None
+        """
+        profile = self._active.get(threading.get_ident())
+        if profile is not None:
+            profile.current_sql = statement
+            conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """
+        SQLAlchemy event handler, adds the time of a statement to the profile
+
+        :return: None
+        """
+        profile = self._active.get(threading.get_ident())
+        if profile is not None and conn.info.get('profile_start'):
+            elapsed = (time.perf_counter() - conn.info['profile_start'].pop()) * 1000
+            timing = profile.sql.setdefault(statement, [0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            profile.current_sql = None
+
+    def _sample(self):
+        """
+        The loop of the sampler thread, it sleeps while no request is profiled
+
+        :return: None
+        """
+        while True:
+            if not self._active:
+                self._wake.clear()
+                if not self._active:
+                    self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, profile in list(self._active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                statement = profile.current_sql
+                if statement is not None:
+                    stack.append('SQL ' + ' '.join(statement.split())[:_SQL_FRAME_LENGTH].replace(';', ','))
+                if stack:
+                    profile.samples[';'.join(stack)] += 1
+
+
+def _profiler():
+    """
+    The profiler of the current app, if the request may read the profiles
+
+    :return: tuple of the Profiler and None, or None and an error response
+    """
+    profiler = current_app.extensions['profiler']
+    if not profiler.authorized():
+        return None, errors.error_response(errors.FORBIDDEN, 'Please send a valid profiling token!')
+    return profiler, None
+
+
+class ProfileList(Resource):
+    """
+    This Resource lists the kept profiles, newest first
+    """
+    def get(self):
+        """
+        The GET request handler for this resource.
+
+        :return: JSON object containing the profile summaries
+        """
+        profiler, error = _profiler()
+        if error is not None:
+            return error
+        with profiler._lock:
+            profiles = list(profiler.profiles)
+        return jsonify({"msg": "Success", "data": [profile.summary() for profile in reversed(profiles)]})
+
+
+class ProfileDetail(Resource):
+    """
+    This Resource returns a profile with the timings of its SQL statements
+    """
+    def get(self, profile_id):
+        """
+        The GET request handler for this resource.
+
+        :param profile_id: the id of the profile
+        :return: JSON object containing the profile
+        """
+        profiler, error = _profiler()
+        if error is not None:
+            return error
+        profile = profiler.get(profile_id)
+        if profile is None:
+            return errors.error_response(errors.PROFILE_NOT_FOUND, 'The specified profile does not exist!')
+        data = profile.summary()
+        data['sql'] = [{'statement': statement, 'count': count, 'total_ms': round(total, 3)}
+                       for statement, (count, total) in sorted(profile.sql.items(), key=lambda item: -item[1][1])]
+        return jsonify({"msg": "Success", "data": data})
+
+
+class ProfileCollapsed(Resource):
+    """
+    This Resource returns the samples of a profile as collapsed stacks, the
+    input format of flamegraph.pl and speedscope
+    """
+    def get(self, profile_id):
+        """
+        The GET request handler for this resource.
+
+        :param profile_id: the id of the profile
+        :return: the collapsed stacks as a text file
+        """
+        profiler, error = _profiler()
+        if error is not None:
+            return error
+        profile = profiler.get(profile_id)
+        if profile is None:
+            return errors.error_response(errors.PROFILE_NOT_FOUND, 'The specified profile does not exist!')
+        return Response(profile.collapsed(), mimetype='text/plain', headers={
+            'Content-Disposition': 'attachment; filename=profile-%d.folded' % profile.id})
+
+
+def init_app(app):
+    """
+    Set up profiling if it is enabled in the app config. The profiler is
+    stored in app.extensions['profiler'].
+
+    :param app: the Flask app
+    :return: the Profiler, or None if profiling is disabled
+    """
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    token = app.config.get('PROFILE_TOKEN')
+    if not sample_rate and token is None:
+        return None
+    profiler = app.extensions['profiler'] = Profiler(sample_rate, token, app.config.get('PROFILE_BUFFER_SIZE', 20),
+                                                     app.config.get('PROFILE_INTERVAL', 0.005))
+    app.before_request(profiler.start)
+    app.after_request(profiler.record_status)
+    app.teardown_request(profiler.stop)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', profiler.before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', profiler.after_cursor_execute)
+
+    blueprint = Blueprint('profiling', __name__)
+    admin_api = Api(blueprint)
+    admin_api.add_resource(ProfileList, '/admin/profiles/')
+    admin_api.add_resource(ProfileDetail, '/admin/profiles/<int:profile_id>/')
+    admin_api.add_resource(ProfileCollapsed, '/admin/profiles/<int:profile_id>/collapsed')
+    app.register_blueprint(blueprint)
+    return profiler
@@ -0,0 +1,214 @@
+"""
+Bulk deletion of users.
+
+A bulk delete marks the users as deleted in a single statement, so they
+disappear from all reads at once. Their rows (user, emails, phone numbers and
+import links) are then purged by a background worker in small chunks, one
+short transaction per chunk, so the database write lock is never held long
+and foreground requests are not slowed down.
+"""
+# module imports
+import threading
+import time
+from sqlalchemy import inspect, literal, select
+from models import Email, ImportedUser, PhoneNumber, PurgeJob, User, UserDeletion, db, upsert_insert
+
+# number of ids marked as deleted per statement
+MARK_CHUNK_SIZE = 500
+PURGE_CHUNK_SIZE = 500
+# seconds the worker waits between two chunks, to let other writers in
+PURGE_PAUSE = 0.05
+
+_worker_lock = threading.Lock()
+
+
+def schedule_deletion(user_ids=None, batch=None):
+    """
+    Create a PurgeJob and mark its users as deleted. Users that do not exist
+    or are already marked, also by a concurrent bulk delete, are ignored. The
+    caller commits the session.
+
+    :param user_ids: list of user ids to delete
+    :param batch: delete all users of this import batch instead
+    :return: the PurgeJob
+    """
+    job = PurgeJob()
+    db.session.add(job)
+    db.session.flush()
+    deletion = UserDeletion.__table__
+    marked = select(UserDeletion.user_id)
+    if batch is not None:
+        sources = [select(User.id, literal(job.id))
+                   .join(ImportedUser, ImportedUser.user_id == User.id)
+                   .where(ImportedUser.batch == batch, User.id.notin_(marked))]
+    else:
+        ids = sorted(set(user_ids))
+        sources = [select(User.id, literal(job.id))
+                   .where(User.id.in_(ids[start:start + MARK_CHUNK_SIZE]), User.id.notin_(marked))
+                   for start in range(0, len(ids), MARK_CHUNK_SIZE)]
+    count = 0
+    connection = db.session.connection()
+    for source in sources:
+        # users marked by a concurrent job after the select are skipped instead of failing the request
+        statement = upsert_insert(connection, deletion).from_select(['user_id', 'job_id'], source)
+        count += db.session.execute(statement.on_conflict_do_nothing()).rowcount
+    job.users = count
+    job.purged = 0
+    job.status = 'pending' if count else 'done'
+    db.session.flush()
+    return job
+
+
+def purge_users(connection, user_ids):
+    """
+    Delete users together with their emails, phone numbers and import links.
+    The certificates of imported users are deleted as well and taken out of
+    the analytics summary tables.
+
+    :param connection: the database connection
+    :param user_ids: list of user ids
+    :return: None
+    """
+    imported = ImportedUser.__table__
+    external_ids = [external_id for (external_id,) in connection.execute(
+        select(imported.c.external_id).where(imported.c.user_id.in_(user_ids)))]
+    if external_ids:
+        # analytics is only needed for imported users
+        import analytics
+        analytics.forget_users(connection, external_ids)
+    for model in (Email, PhoneNumber, ImportedUser):
+        connection.execute(model.__table__.delete().where(model.__table__.c.user_id.in_(user_ids)))
+    connection.execute(User.__table__.delete().where(User.__table__.c.id.in_(user_ids)))
+
+
+def purge_chunk(engine, chunk_size=PURGE_CHUNK_SIZE):
+    """
+    Purge the next chunk of users marked as deleted, in one transaction. The
+    chunk is claimed by deleting its marks first: if a concurrent purge, e.g.
+    the worker of another gunicorn process, claimed some of its users before,
+    the transaction is rolled back and the next chunk is read again, so every
+    user is purged and counted once.
+
+    :param engine: the database engine
+    :param chunk_size: maximum number of users purged
+    :return: the number of users purged, 0 if nothing was left
+    """
+    deletion = UserDeletion.__table__
+    jobs = PurgeJob.__table__
+    while True:
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                rows = connection.execute(
+                    select(deletion.c.user_id, deletion.c.job_id)
+                    .order_by(deletion.c.job_id, deletion.c.user_id).limit(chunk_size)).all()
+                if not rows:
+                    return 0
+                user_ids = [user_id for user_id, _ in rows]
+                # the delete waits for the write lock of a concurrent purge and misses the users it purged
+                claimed = connection.execute(deletion.delete().where(deletion.c.user_id.in_(user_ids))).rowcount
+                if claimed != len(rows):
+                    transaction.rollback()
+                    continue
+                purge_users(connection, user_ids)
+                purged = {}
+                for _, job_id in rows:
+                    purged[job_id] = purged.get(job_id, 0) + 1
+                for job_id, count in purged.items():
+                    remaining = connection.execute(
+                        select(deletion.c.user_id).where(deletion.c.job_id == job_id).limit(1)).first()
+                    connection.execute(jobs.update().where(jobs.c.id == job_id).values(
+                        purged=jobs.c.purged + count, status='pending' if remaining else 'done'))
+        return len(rows)
+
+
+def purge_pending(engine, chunk_size=PURGE_CHUNK_SIZE, pause=0):
+    """
+    Purge all users marked as deleted, chunk by chunk
+
+    :param engine: the database engine
+    :param chunk_size: maximum number of users purged per transaction
+    :param pause: seconds to wait between two chunks
+    :return: the number of users purged
+    """
+    total = 0
+    while True:
+        count = purge_chunk(engine, chunk_size)
+        if not count:
+            return total
+        total += count
+        if pause:
+            time.sleep(pause)
+
+
+class PurgeWorker(threading.Thread):
+    """
+    Background thread purging the users marked as deleted. It sleeps until it
+    is woken up by a new bulk delete.
+    """
+    def __init__(self, app):
+        """
+        :param app: the Flask app
+        """
+        super(PurgeWorker, self).__init__(name='purge-worker', daemon=True)
+        self.app = app
+        self._wake = threading.Event()
+
+    def wake(self):
+        """
+        Let the worker look for users to purge
+
+        :return: None
+        """
+        self._wake.set()
+
+    def run(self):
+        """
+        The loop of the worker thread
+
+        :return: None
+        """
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    purge_pending(db.engine, self.app.config.get('PURGE_CHUNK_SIZE', PURGE_CHUNK_SIZE),
+                                  self.app.config.get('PURGE_PAUSE', PURGE_PAUSE))
+            except Exception:
+                self.app.logger.exception('Purging deleted users failed')
+
+
+def wake_worker(app):
+    """
+    Start the purge worker of the app if needed and wake it up. Does nothing
+    if PURGE_IN_BACKGROUND is disabled in the app config.
+
+    :param app: the Flask app
+    :return: None
+    """
+    if not app.config.get('PURGE_IN_BACKGROUND', True):
+        return
+    with _worker_lock:
+        worker = app.extensions.get('purge_worker')
+        if worker is None:
+            worker = app.extensions['purge_worker'] = PurgeWorker(app)
+            worker.start()
+    worker.wake()
+
+
+def init_app(app):
+    """
+    Resume purging users that were marked as deleted before the app was started
+
+    :param app: the Flask app
+    :return: None
+    """
+    if not app.config.get('PURGE_IN_BACKGROUND', True):
+        return
+    with app.app_context():
+        # the tables are created with "flask init-db", until then there is nothing to resume
+        if not inspect(db.engine).has_table(UserDeletion.__tablename__):
+            return
+        pending = db.session.query(UserDeletion.user_id).first() is not None
+    if pending:
+        wake_worker(app)
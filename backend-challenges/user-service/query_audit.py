@@ -0,0 +1,152 @@
+"""
+Query plan auditing.
+
+When QUERY_AUDIT is enabled in the app config, every distinct SQL statement
+the app executes is explained with ``EXPLAIN QUERY PLAN`` the first time it
+runs, and the problems of its plan are recorded for the endpoint that
+issued it:
+
+- ``scan``: a full scan of a table (the size of the table is recorded too)
+- ``temp_btree``: a temporary B-tree built for ORDER BY, GROUP BY or DISTINCT
+- ``automatic_index``: an index SQLite builds on the fly because none exists
+
+Scans on tables with at least QUERY_AUDIT_MIN_ROWS rows are logged as
+warnings. The audit only understands SQLite plans; with other databases it
+does nothing. It is a development tool and adds no overhead when disabled.
+"""
+# module imports
+import re
+from collections import namedtuple
+from flask import has_request_context, request
+from sqlalchemy import event
+from models import db
+
+SCAN = 'scan'
+TEMP_BTREE = 'temp_btree'
+AUTOMATIC_INDEX = 'automatic_index'
+# the endpoint name used for statements executed outside of a request
+NO_REQUEST = '<no request>'
+_EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+_SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)')
+_AUTOMATIC_INDEX = re.compile(r'^SEARCH (?:TABLE )?(\S+) .*USING AUTOMATIC')
+_ALIAS_SUFFIX = re.compile(r'_\d+$')
+
+Finding = namedtuple('Finding', ['kind', 'table', 'rows', 'detail', 'statement'])
+
+
+class QueryAudit(object):
+    """
+    Collects the problems found in the query plans of an app
+    """
+    def __init__(self, min_rows=0, logger=None):
+        """
+        :param min_rows: scans on tables with fewer rows are not logged
+        :param logger: logger for the scans found, or None
+        """
+        self.min_rows = min_rows
+        self.logger = logger
+        # statement -> list of findings of its plan
+        self.plans = {}
+        # endpoint -> set of findings
+        self.findings = {}
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """
+        SQLAlchemy event handler, records the plan findings of the statement
+
+        :return: None
+        """
+        endpoint = (request.endpoint or request.path) if has_request_context() else NO_REQUEST
+        plan = self.plans.get(statement)
+        if plan is None:
+            if executemany:
+                parameters = parameters[0] if parameters else ()
+            plan = self.plans[statement] = explain(cursor.connection, statement, parameters)
+        found = self.findings.setdefault(endpoint, set())
+        for finding in plan:
+            if finding not in found:
+                found.add(finding)
+                if self.logger is not None and finding.kind == SCAN and finding.rows >= self.min_rows:
+                    self.logger.warning('Query plan of %s scans table %s (%d rows): %s',
+                                        endpoint, finding.table, finding.rows, statement)
+
+    def scans(self, min_rows=None):
+        """
+        The table scans found per endpoint
+
+        :param min_rows: ignore tables with fewer rows, defaults to the min_rows of the audit
+        :return: set of (endpoint, table) tuples
+        """
+        min_rows = self.min_rows if min_rows is None else min_rows
+        return {(endpoint, finding.table) for endpoint, found in self.findings.items()
+                for finding in found if finding.kind == SCAN and finding.rows >= min_rows}
+
+    def report(self):
+        """
+        All findings per endpoint
+
+        :return: dict of endpoint to list of findings as dicts, sorted
+        """
+        return {endpoint: sorted((finding._asdict() for finding in found),
+                                 key=lambda finding: (finding['kind'], finding['table'] or '', finding['statement']))
+                for endpoint, found in sorted(self.findings.items()) if found}
+
+
+def _table_rows(connection, name):
+    """
+    Find the table a plan refers to and count its rows
+
+    :param connection: the DBAPI connection
+    :param name: the table name or alias used in the plan
+    :return: tuple of the table name and its number of rows, or None if it is not a table
+    """
+    for table in (name, _ALIAS_SUFFIX.sub('', name)):
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table,)).fetchone():
+            return table, connection.execute('SELECT count(*) FROM "%s"' % table).fetchone()[0]
+    return None
+
+
+def explain(connection, statement, parameters):
+    """
+    Run EXPLAIN QUERY PLAN for a statement and extract the problems of the plan
+
+    :param connection: the DBAPI connection of SQLite
+    :param statement: the SQL statement
+    :param parameters: the parameters of the statement
+    :return: list of findings
+    """
+    if not statement.lstrip().upper().startswith(_EXPLAINED):
+        return []
+    findings = []
+    for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters or ()).fetchall():
+        detail = row[-1]
+        match = _SCAN.match(detail) or _AUTOMATIC_INDEX.match(detail)
+        if match:
+            table = _table_rows(connection, match.group(1))
+            if table is not None:
+                kind = SCAN if match.re is _SCAN else AUTOMATIC_INDEX
+                findings.append(Finding(kind, table[0], table[1], detail, statement))
+        elif detail.startswith('USE TEMP B-TREE'):
+            findings.append(Finding(TEMP_BTREE, None, 0, detail, statement))
+    return findings
+
+
+def init_app(app):
+    """
+    Start auditing the query plans of the app if QUERY_AUDIT is enabled. The
+    audit is stored in app.extensions['query_audit'].
+
+    :param app: the Flask app
+    :return: the QueryAudit, or None if auditing is disabled
+    """
+    if not app.config.get('QUERY_AUDIT', False):
+        return None
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        app.logger.warning('Query plan auditing only supports SQLite')
+        return None
+    audit = app.extensions['query_audit'] = QueryAudit(app.config.get('QUERY_AUDIT_MIN_ROWS', 0), app.logger)
+    event.listen(engine, 'before_cursor_execute', audit.before_cursor_execute)
+    return audit
@@ -0,0 +1,128 @@
+"""
+Read-only data access for user lookups.
+
+The GET resources only copy a few columns into the response, so they do not
+need ORM objects: the lookups here run Core statements that are compiled
+once per dialect and executed directly on the connection of the session.
+Rows are plain tuples, nothing is added to the identity map and the session
+is not flushed. Reads still see the changes flushed earlier in the same
+transaction, e.g. by an earlier operation of a batch.
+"""
+# module imports
+from sqlalchemy import bindparam, exists, func, select
+from models import Email, PhoneNumber, User, UserDeletion, db
+
+_user = User.__table__
+_email = Email.__table__
+_phone = PhoneNumber.__table__
+_active = ~exists().where(UserDeletion.__table__.c.user_id == _user.c.id)
+_by_id = _user.c.id == bindparam('id')
+_by_name = (func.lower(_user.c.first_name) == func.lower(bindparam('first_name'))) \
+    & (func.lower(_user.c.last_name) == func.lower(bindparam('last_name')))
+
+USER_BY_ID = select(_user.c.id, _user.c.last_name, _user.c.first_name).where(_by_id, _active)
+EMAILS_BY_ID = select(_email.c.user_id, _email.c.mail) \
+    .where(_email.c.user_id == bindparam('id')).order_by(_email.c.id)
+PHONES_BY_ID = select(_phone.c.user_id, _phone.c.phone) \
+    .where(_phone.c.user_id == bindparam('id')).order_by(_phone.c.id)
+USERS_BY_NAME = select(_user.c.id, _user.c.last_name, _user.c.first_name) \
+    .where(_by_name, _active).order_by(_user.c.id)
+EMAILS_BY_NAME = select(_email.c.user_id, _email.c.mail) \
+    .where(_email.c.user_id.in_(select(_user.c.id).where(_by_name, _active))).order_by(_email.c.id)
+PHONES_BY_NAME = select(_phone.c.user_id, _phone.c.phone) \
+    .where(_phone.c.user_id.in_(select(_user.c.id).where(_by_name, _active))).order_by(_phone.c.id)
+
+# (statement, dialect name) -> (SQL string, parameter names in order or None)
+_compiled = {}
+
+
+class UserRecord(object):
+    """
+    A user with its emails and phone numbers, as returned by the lookups
+    """
+    __slots__ = ('id', 'last_name', 'first_name', 'mail', 'phone')
+
+    def __init__(self, id, last_name, first_name):
+        self.id = id
+        self.last_name = last_name
+        self.first_name = first_name
+        self.mail = []
+        self.phone = []
+
+    def to_dict(self):
+        """
+        The user in the shape of the API responses
+
+        :return: dict with the user info
+        """
+        return {
+            'id': self.id, 'last_name': self.last_name,
+            'first_name': self.first_name, 'mail': self.mail,
+            'phone': self.phone
+        }
+
+
+def execute(connection, statement, params):
+    """
+    Run a statement with the SQL compiled once per dialect, skipping the
+    statement cache lookup of SQLAlchemy
+
+    :param connection: the database connection
+    :param statement: one of the statements of this module
+    :param params: dict of the bound parameter values
+    :return: the result, with tuple rows
+    """
+    key = (statement, connection.dialect.name)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        sql = statement.compile(dialect=connection.dialect)
+        compiled = _compiled[key] = (str(sql), sql.positiontup if sql.positional else None)
+    sql, names = compiled
+    if names is None:
+        return connection.exec_driver_sql(sql, params)
+    return connection.exec_driver_sql(sql, tuple(params[name] for name in names))
+
+
+def _load(connection, users_statement, emails_statement, phones_statement, params):
+    """
+    Run the lookup of users and attach their emails and phone numbers
+
+    :param connection: the database connection
+    :param users_statement: statement selecting id, last_name and first_name
+    :param emails_statement: statement selecting user_id and mail of the same users
+    :param phones_statement: statement selecting user_id and phone of the same users
+    :param params: dict of the bound parameter values
+    :return: list of UserRecord
+    """
+    users = {}
+    for row in execute(connection, users_statement, params):
+        users[row[0]] = UserRecord(row[0], row[1], row[2])
+    if users:
+        for user_id, mail in execute(connection, emails_statement, params):
+            users[user_id].mail.append(mail)
+        for user_id, phone in execute(connection, phones_statement, params):
+            users[user_id].phone.append(phone)
+    return list(users.values())
+
+
+def get_user(user_id):
+    """
+    Look up a user that is not marked as deleted by id
+
+    :param user_id: the user id
+    :return: the UserRecord, or None if the user does not exist
+    """
+    users = _load(db.session.connection(), USER_BY_ID, EMAILS_BY_ID, PHONES_BY_ID, {'id': user_id})
+    return users[0] if users else None
+
+
+def find_users(first_name, last_name):
+    """
+    Look up the users with a name, ignoring case
+
+    :param first_name: the first name
+    :param last_name: the last name
+    :return: list of UserRecord, ordered by id
+    """
+    return _load(db.session.connection(), USERS_BY_NAME, EMAILS_BY_NAME, PHONES_BY_NAME,
+                 {'first_name': first_name, 'last_name': last_name})
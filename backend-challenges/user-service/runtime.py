@@ -0,0 +1,93 @@
+"""
+Resource limits of the runtime.
+
+The service runs in containers with a small CPU quota and memory limit (the
+devops spec gives it 0.2 CPU and 128 MB). The number of gunicorn workers
+and threads is derived from the limits of the cgroup of the container, so
+the same image fits both a small and a large container. See
+gunicorn.conf.py.
+"""
+# module imports
+import math
+import os
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# estimated peak memory of a worker and of the gunicorn master, in MB
+# (measured with benchmarks/check_footprint.py)
+WORKER_MB = 60
+MASTER_MB = 25
+# cgroup v1 reports "no limit" as a huge number
+_UNLIMITED = 2 ** 60
+
+
+def _read(path):
+    """
+    Read the first line of a cgroup file
+
+    :param path: the path of the file
+    :return: the stripped line, or None if the file does not exist
+    """
+    try:
+        with open(path) as stream:
+            return stream.readline().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit(root=CGROUP_ROOT):
+    """
+    The CPU quota of the cgroup
+
+    :param root: the mount point of the cgroup file system
+    :return: the number of CPUs as a float, or None if there is no quota
+    """
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    line = _read(os.path.join(root, 'cpu.max'))
+    if line is not None:
+        quota, _, period = line.partition(' ')
+        return None if quota == 'max' else int(quota) / int(period or 100000)
+    # cgroup v1: the quota is -1 without a limit
+    for directory in ('cpu', 'cpu,cpuacct'):
+        quota = _read(os.path.join(root, directory, 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(root, directory, 'cpu.cfs_period_us'))
+        if quota is not None and period is not None:
+            return None if int(quota) <= 0 else int(quota) / int(period)
+    return None
+
+
+def memory_limit(root=CGROUP_ROOT):
+    """
+    The memory limit of the cgroup
+
+    :param root: the mount point of the cgroup file system
+    :return: the limit in MB, or None if there is no limit
+    """
+    line = _read(os.path.join(root, 'memory.max'))
+    if line is None:
+        line = _read(os.path.join(root, 'memory', 'memory.limit_in_bytes'))
+    if line is None or line == 'max' or int(line) >= _UNLIMITED:
+        return None
+    return int(line) // (1024 * 1024)
+
+
+def worker_settings(cpus=None, memory_mb=None, worker_mb=WORKER_MB, master_mb=MASTER_MB):
+    """
+    The number of gunicorn workers and threads per worker for the limits.
+    Below one CPU a single worker is used, above it the usual 2 * CPUs + 1,
+    in both cases no more than fit into the memory limit. Threads let a
+    worker serve other requests while one waits for the database.
+
+    :param cpus: the number of CPUs, defaults to the cgroup quota or the CPU count
+    :param memory_mb: the memory limit in MB, defaults to the cgroup limit
+    :param worker_mb: the memory needed per worker in MB
+    :param master_mb: the memory needed by the gunicorn master in MB
+    :return: dict with the workers and threads
+    """
+    if cpus is None:
+        cpus = cpu_limit() or os.cpu_count() or 1
+    if memory_mb is None:
+        memory_mb = memory_limit()
+    workers = 1 if cpus < 1 else 2 * math.floor(cpus) + 1
+    if memory_mb is not None:
+        workers = min(workers, (memory_mb - master_mb) // worker_mb)
+    return {'workers': max(1, workers), 'threads': 2 if cpus < 1 else 4}
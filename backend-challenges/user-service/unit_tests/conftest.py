@@ -0,0 +1,30 @@
+import pytest
+from app import create_app
+from models import db
+
+
+@pytest.fixture()
+def make_app(tmp_path):
+    """
+    Factory of apps using a fresh database in the temporary directory of the test
+    :param tmp_path: temporary directory of the test
+    :return: function taking the values overriding the config file and returning the Flask app
+    """
+    def make_app(**config):
+        settings = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db')}
+        settings.update(config)
+        app = create_app('config.py', settings)
+        with app.app_context():
+            db.create_all()
+        return app
+    return make_app
+
+
+@pytest.fixture()
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
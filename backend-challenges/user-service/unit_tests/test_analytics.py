@@ -0,0 +1,188 @@
+import os
+import pytest
+from flask import json
+from analytics import FASTEST, SLOWEST, compute_full, load_summaries, rebuild, verify
+from ingest import ingest, ingest_certificates
+from models import NO_START, Certificate, CourseRanking, CourseStats, ImportedUser, UserStats, db
+from purge import purge_pending, schedule_deletion
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data-engineer')
+FILES = {name: os.path.join(DATA_DIR, name + '.json') for name in ('users', 'courses', 'certificates')}
+
+
+@pytest.fixture()
+def app(app):
+    # load the sample data for every test
+    with app.app_context():
+        db.create_all()
+        ingest(db.engine, batch_size=50, **FILES)
+        yield app
+
+
+def test_summaries_match_full_recompute(app):
+    """
+    The incrementally maintained tables equal a full recompute
+    :param app: the Flask app
+    :return: None
+    """
+    with db.engine.begin() as connection:
+        assert verify(connection) == []
+        full = compute_full(connection)
+    assert sum(count for count, _ in full['courses'].values()) == 500
+    assert sum(count for count, _ in full['users'].values()) == 500
+    assert all(len(ranking[FASTEST]) == 5 and len(ranking[SLOWEST]) == 5 for ranking in full['rankings'].values())
+
+
+def test_summaries_after_update(app, tmp_path):
+    """
+    Re-ingesting changed certificates, including ranked ones, keeps the tables correct
+    :param app: the Flask app
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    with db.engine.begin() as connection:
+        fastest = load_summaries(connection)['rankings']
+    with open(FILES['certificates'], encoding='utf-8') as stream:
+        certificates = json.load(stream)
+    for certificate in certificates:
+        ranking = fastest[certificate['course']][FASTEST]
+        if certificate['user'] == ranking[0][0]:
+            # the fastest user of the course becomes very slow
+            certificate['completedDate'] = '2030-01-01T00:00:00.000Z'
+    certificates[1]['completedDate'] = None
+    certificates.append(dict(certificates[2], startDate='2021-01-01T00:00:00.000Z'))
+    changed = tmp_path / 'certificates.json'
+    changed.write_text(json.dumps(certificates), encoding='utf-8')
+
+    ingest_certificates(db.engine, str(changed), batch_size=37)
+    with db.engine.begin() as connection:
+        assert verify(connection) == []
+        assert sum(count for count, _ in load_summaries(connection)['courses'].values()) == 500
+
+
+def test_rebuild(app):
+    """
+    Rebuilding repairs the summary tables
+    :param app: the Flask app
+    :return: None
+    """
+    CourseStats.query.delete()
+    db.session.commit()
+    with db.engine.begin() as connection:
+        assert verify(connection) != []
+        rebuild(connection)
+    with db.engine.begin() as connection:
+        assert verify(connection) == []
+
+
+def test_migrate_certificates(app):
+    """
+    init-db adds the durations to a certificate table created without them,
+    removes the duplicates of certificates without a start and rebuilds the
+    summary tables
+    :param app: the Flask app
+    :return: None
+    """
+    with db.engine.begin() as connection:
+        expected = load_summaries(connection)
+        course_id, user_external_id = connection.execute(
+            db.select(Certificate.course_id, Certificate.user_external_id)).first()
+        # the table as it was created before the durations were stored
+        connection.exec_driver_sql('CREATE TABLE certificate_old (id INTEGER PRIMARY KEY, course_id VARCHAR(36), '
+                                   'user_external_id VARCHAR(36), started_at DATETIME, completed_at DATETIME, '
+                                   'UNIQUE (course_id, user_external_id, started_at))')
+        connection.exec_driver_sql('INSERT INTO certificate_old SELECT id, course_id, user_external_id, started_at, '
+                                   'completed_at FROM certificate')
+        connection.exec_driver_sql('DROP TABLE certificate')
+        connection.exec_driver_sql('ALTER TABLE certificate_old RENAME TO certificate')
+        for _ in range(3):
+            connection.exec_driver_sql('INSERT INTO certificate (course_id, user_external_id) VALUES (?, ?)',
+                                       (course_id, user_external_id))
+        for model in (CourseStats, UserStats, CourseRanking):
+            connection.execute(model.__table__.delete())
+
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    with db.engine.begin() as connection:
+        assert verify(connection) == []
+        assert load_summaries(connection) == expected
+    assert Certificate.query.count() == 501
+    assert Certificate.query.filter_by(started_at=NO_START).one().duration_ms is None
+    # running it again changes nothing
+    assert app.test_cli_runner().invoke(args=['init-db']).exit_code == 0
+    assert Certificate.query.count() == 501
+
+
+def test_purge_removes_certificates(app):
+    """
+    Purging imported users deletes their certificates and keeps the summary tables correct
+    :param app: the Flask app
+    :return: None
+    """
+    with db.engine.begin() as connection:
+        ranked = load_summaries(connection)['rankings']
+    # the fastest users of all courses and ten others
+    external_ids = {ranking[FASTEST][0][0] for ranking in ranked.values()}
+    external_ids.update(external_id for (external_id,) in db.session.query(ImportedUser.external_id).limit(10))
+    user_ids = [user_id for (user_id,) in db.session.query(ImportedUser.user_id)
+                .filter(ImportedUser.external_id.in_(external_ids))]
+    schedule_deletion(user_ids=user_ids)
+    db.session.commit()
+    assert purge_pending(db.engine) == len(user_ids)
+    for model in (Certificate, UserStats, CourseRanking):
+        assert model.query.filter(model.user_external_id.in_(external_ids)).count() == 0
+    with db.engine.begin() as connection:
+        assert verify(connection) == []
+
+
+def test_course_analytics(client):
+    """
+    Get the overall and per course average completion time
+    :param client: client object of Flask
+    :return: None
+    """
+    response = client.get('/analytics/courses/')
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 200
+    assert data["data"]["certificates"] == 500
+    assert len(data["data"]["courses"]) == 6
+    assert data["data"]["average_completion_seconds"] > 0
+
+
+def test_course_analytics_by_id(client):
+    """
+    Get the fastest and slowest users of a course, and of a course that does not exist
+    :param client: client object of Flask
+    :return: None
+    """
+    response = client.get('/analytics/courses/917beaaf-5be2-48a6-a83d-ab0fc2ab036d/')
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 200
+    fastest = [entry["duration_seconds"] for entry in data["data"]["fastest"]]
+    slowest = [entry["duration_seconds"] for entry in data["data"]["slowest"]]
+    assert fastest == sorted(fastest)
+    assert slowest == sorted(slowest, reverse=True)
+    assert fastest[0] <= data["data"]["average_completion_seconds"] <= slowest[0]
+
+    response = client.get('/analytics/courses/unknown/')
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 404
+    assert data["error"]["code"] == "course_not_found"
+
+
+def test_user_analytics(client):
+    """
+    Get the number of certificates per user
+    :param client: client object of Flask
+    :return: None
+    """
+    response = client.get('/analytics/users/?limit=100')
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 200
+    assert sum(entry["certificates"] for entry in data["data"]) == 500
+    counts = [entry["certificates"] for entry in data["data"]]
+    assert counts == sorted(counts, reverse=True)
+
+    response = client.get('/analytics/users/%s/' % data["data"][0]["user"])
+    assert json.loads(response.get_data(as_text=True))["data"] == data["data"][0]
+    assert client.get('/analytics/users/unknown/').status_code == 404
@@ -1,18 +1,63 @@
+import os
+import shutil
+import sqlite3
 import pytest
+from contextlib import closing
 from app import create_app
 from flask import json
+from models import db
+
+# table scans that are known and accepted, as [endpoint, table] pairs
+QUERY_AUDIT_BASELINE = os.path.join(os.path.dirname(__file__), 'query_audit_baseline.json')
+# the database of config.py, the schema of the tests' database is copied from it
+SERVICE_DATABASE = os.path.join(os.path.dirname(__file__), '..', 'user_db.db')
+# table scans found by the tests of this module
+_scans = set()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def query_plans():
+    """
+    Fail the tests of this module if a query plan scans a table in a way that
+    is not listed in the baseline
+    """
+    yield
+    with open(QUERY_AUDIT_BASELINE, encoding='utf-8') as stream:
+        known = {tuple(scan) for scan in json.load(stream)}
+    new = sorted(_scans - known)
+    assert not new, 'New table scans (endpoint, table): %s' % new
+
+
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+    """
+    The tests of this module build on each other, they share a fresh database
+    with the tables of the service database (its phone numbers are text) but
+    none of its rows
+    :param tmp_path_factory: the pytest tmp_path_factory fixture
+    :return: the database URI
+    """
+    path = str(tmp_path_factory.mktemp('api') / 'api.db')
+    with closing(sqlite3.connect(SERVICE_DATABASE)) as source, closing(sqlite3.connect(path)) as target:
+        for (statement,) in source.execute("SELECT sql FROM sqlite_master WHERE type = 'table'"):
+            target.execute(statement)
+    return 'sqlite:///' + path
 
 
 @pytest.fixture()
-def app():
+def app(database):
     # this can be replaced with a different configuration file
-    app = create_app('config.py')
+    app = create_app('config.py', {'QUERY_AUDIT': True, 'QUERY_AUDIT_MIN_ROWS': 0,
+                                   'SQLALCHEMY_DATABASE_URI': database})
+    with app.app_context():
+        db.create_all()
     app.config.update({
         'TESTING': True,
         'DEBUG': True,
         'FLASK_ENV': "development"
     })
     yield app
+    _scans.update(app.extensions['query_audit'].scans())
 
 
 @pytest.fixture()
@@ -30,8 +75,9 @@ def test_user_get_1(client):
         '/user/54/'
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "User does not exist"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "user_not_found"
+    assert data["error"]["message"] == "User does not exist"
 
 
 def test_user_add_1(client):
@@ -49,8 +95,9 @@ def test_user_add_1(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "Please enter all the fields!"
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    assert data["error"]["message"] == "Please enter all the fields!"
 
 
 def test_user_add_2(client):
@@ -175,8 +222,9 @@ def test_user_add_mail_2(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified email already exists for the user!"
+    assert response.status_code == 409
+    assert data["error"]["code"] == "email_exists"
+    assert data["error"]["message"] == "The specified email already exists for the user!"
 
 
 def test_user_add_mail_3(client):
@@ -194,8 +242,9 @@ def test_user_add_mail_3(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified user does not exist!"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "user_not_found"
+    assert data["error"]["message"] == "The specified user does not exist!"
 
 
 def test_user_add_mail_4(client):
@@ -212,8 +261,9 @@ def test_user_add_mail_4(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "Please specify all the requested fields!"
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    assert data["error"]["message"] == "Please specify all the requested fields!"
 
 
 def test_user_add_phone_1(client):
@@ -250,8 +300,9 @@ def test_user_add_phone_2(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified user does not exist!"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "user_not_found"
+    assert data["error"]["message"] == "The specified user does not exist!"
 
 
 def test_user_add_phone_3(client):
@@ -269,8 +320,9 @@ def test_user_add_phone_3(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified phone number already exists for the user!"
+    assert response.status_code == 409
+    assert data["error"]["code"] == "phone_exists"
+    assert data["error"]["message"] == "The specified phone number already exists for the user!"
 
 
 def test_user_add_phone_4(client):
@@ -287,8 +339,9 @@ def test_user_add_phone_4(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "Please specify all the requested fields!"
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    assert data["error"]["message"] == "Please specify all the requested fields!"
 
 
 def test_user_update_mail_1(client):
@@ -327,8 +380,9 @@ def test_user_update_mail_2(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified email does not exist!"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "email_not_found"
+    assert data["error"]["message"] == "The specified email does not exist!"
 
 
 def test_user_update_mail_3(client):
@@ -347,8 +401,9 @@ def test_user_update_mail_3(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "Old and new emails are the same!"
+    assert response.status_code == 400
+    assert data["error"]["code"] == "unchanged_value"
+    assert data["error"]["message"] == "Old and new emails are the same!"
 
 
 def test_user_update_mail_4(client):
@@ -366,8 +421,9 @@ def test_user_update_mail_4(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "Please specify all the requested fields."
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    assert data["error"]["message"] == "Please specify all the requested fields."
 
 
 def test_user_update_mail_5(client):
@@ -386,8 +442,9 @@ def test_user_update_mail_5(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified user does not exist!"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "user_not_found"
+    assert data["error"]["message"] == "The specified user does not exist!"
 
 
 def test_user_update_phone_1(client):
@@ -426,8 +483,9 @@ def test_user_update_phone_2(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified phone number does not exist!"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "phone_not_found"
+    assert data["error"]["message"] == "The specified phone number does not exist!"
 
 
 def test_user_update_phone_3(client):
@@ -446,8 +504,9 @@ def test_user_update_phone_3(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The old and new phone numbers are the same!"
+    assert response.status_code == 400
+    assert data["error"]["code"] == "unchanged_value"
+    assert data["error"]["message"] == "The old and new phone numbers are the same!"
 
 
 def test_user_update_phone_4(client):
@@ -466,8 +525,9 @@ def test_user_update_phone_4(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified user does not exist!"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "user_not_found"
+    assert data["error"]["message"] == "The specified user does not exist!"
 
 
 def test_user_update_phone_5(client):
@@ -485,8 +545,9 @@ def test_user_update_phone_5(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "Please specify all the requested fields."
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    assert data["error"]["message"] == "Please specify all the requested fields."
 
 
 def test_user_get_3(client):
@@ -548,8 +609,9 @@ def test_user_del_2(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
-    assert response.status_code == 200
-    assert data["msg"] == "The specified user does not exist!"
+    assert response.status_code == 404
+    assert data["error"]["code"] == "user_not_found"
+    assert data["error"]["message"] == "The specified user does not exist!"
 
 
 def test_user_del_3(client):
@@ -566,5 +628,64 @@ def test_user_del_3(client):
         content_type='application/json',
     )
     data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    assert data["error"]["message"] == "Please specify the id!"
+
+
+def test_error_response_stateless(client):
+    """
+    Failed requests do not touch the session, so no cookie is set
+    :param client: client object of Flask
+    :return: None
+    """
+    response = client.get(
+        '/user/54/'
+    )
+    assert response.status_code == 404
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_error_response_legacy(database):
+    """
+    With LEGACY_ERROR_RESPONSES set, errors use the old msg body and HTTP 200
+    :param database: the database URI
+    :return: None
+    """
+    legacy_app = create_app('config.py', {'TESTING': True, 'LEGACY_ERROR_RESPONSES': True,
+                                          'SQLALCHEMY_DATABASE_URI': database})
+    response = legacy_app.test_client().delete(
+        '/user/del/',
+        data=json.dumps({
+
+        }),
+        content_type='application/json',
+    )
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 200
+    assert data == {"msg": "Please specify the id!"}
+
+
+def test_init_db_service_database(tmp_path):
+    """
+    The service database has only the user, email and phone_number tables;
+    init-db adds the missing tables and keeps its users
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    path = str(tmp_path / 'user_db.db')
+    shutil.copy(SERVICE_DATABASE, path)
+    old_app = create_app('config.py', {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+    result = old_app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    client = old_app.test_client()
+    response = client.get('/user/1/')
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True))["data"]["first_name"] == "john"
+    response = client.post('/user/add/', data=json.dumps({"first_name": "Jane", "last_name": "Doe",
+                                                           "mail": "jane@doe.de", "phone": "123"}),
+                           content_type='application/json')
     assert response.status_code == 200
-    assert data["msg"] == "Please specify the id!"
+    # running it again changes nothing
+    assert old_app.test_cli_runner().invoke(args=['init-db']).exit_code == 0
+    assert client.get('/user/3/').status_code == 200
@@ -0,0 +1,194 @@
+import pytest
+from flask import current_app, json, request
+import batch
+import errors
+from models import Email, PhoneNumber, User, db
+
+
+@pytest.fixture()
+def app(app):
+    app.add_url_rule('/test/add/fail/', 'add_and_fail', add_and_fail, methods=['POST'])
+    app.add_url_rule('/test/add/raise/', 'add_and_raise', add_and_raise, methods=['POST'])
+    app.after_request(record_path)
+    app.config['RECORDED_PATHS'] = []
+    with app.app_context():
+        yield app
+
+
+def add_and_fail():
+    """
+    An endpoint that writes a user and then fails
+    :return: the error response
+    """
+    db.session.add(User('doe', 'failing'))
+    batch.commit()
+    return errors.error_response(errors.INVALID_FIELDS, 'Failed after the write!')
+
+
+def add_and_raise():
+    """
+    An endpoint that writes a user and then raises
+    :return: None
+    """
+    db.session.add(User('doe', 'raising'))
+    batch.commit()
+    raise RuntimeError('Failed after the write!')
+
+
+def record_path(response):
+    """
+    after_request hook recording the paths of the requests
+    :param response: the response
+    :return: the response
+    """
+    current_app.config['RECORDED_PATHS'].append(request.path)
+    return response
+
+
+def _batch(client, payload):
+    """
+    Send a batch request
+    :param client: client object of Flask
+    :param payload: the JSON payload
+    :return: tuple of the response and its decoded data
+    """
+    response = client.post('/batch/', data=json.dumps(payload), content_type='application/json')
+    return response, json.loads(response.get_data(as_text=True))
+
+
+def _new_user(mail):
+    """
+    The operations creating a user with two more emails and a second phone number
+    :param mail: the first email of the user
+    :return: list of operations
+    """
+    return [
+        {"id": "user", "method": "POST", "path": "/user/add/",
+         "body": {"first_name": "John", "last_name": "Doe", "mail": mail, "phone": "111"}},
+        {"method": "POST", "path": "/user/add/mail/",
+         "body": {"id": {"$ref": "user.data.id"}, "mail": "second." + mail}},
+        {"method": "POST", "path": "/user/add/mail/",
+         "body": {"id": {"$ref": "0.data.id"}, "mail": "third." + mail}},
+        {"method": "POST", "path": "/user/add/phone/", "body": {"id": {"$ref": "user.data.id"}, "phone": "222"}},
+        {"method": "GET", "path": "/user/{user.data.id}/"},
+    ]
+
+
+def test_batch_atomic(client):
+    """
+    Create a user with several emails and phone numbers in one request
+    :param client: client object of Flask
+    :return: None
+    """
+    response, data = _batch(client, {"operations": _new_user("john@doe.de")})
+    assert response.status_code == 200
+    assert data["data"]["committed"] is True
+    results = data["data"]["results"]
+    assert [result["status"] for result in results] == [200] * 5
+    assert results[0]["id"] == "user"
+    assert results[4]["body"]["data"]["mail"] == ["john@doe.de", "second.john@doe.de", "third.john@doe.de"]
+    assert results[4]["body"]["data"]["phone"] == [111, 222]
+    assert User.query.count() == 1
+    assert Email.query.count() == 3
+
+
+def test_batch_atomic_rollback(client):
+    """
+    A failed operation rolls back the whole batch and skips the remaining operations
+    :param client: client object of Flask
+    :return: None
+    """
+    operations = _new_user("john@doe.de")
+    operations.insert(2, {"method": "POST", "path": "/user/add/mail/",
+                          "body": {"id": {"$ref": "user.data.id"}, "mail": "second.john@doe.de"}})
+    response, data = _batch(client, {"operations": operations})
+    assert response.status_code == 409
+    assert data["data"]["committed"] is False
+    assert [result["status"] for result in data["data"]["results"]] == [200, 200, 409, 424, 424, 424]
+    assert data["data"]["results"][2]["body"]["error"]["code"] == "email_exists"
+    assert User.query.count() == 0
+    assert Email.query.count() == 0
+
+
+def test_batch_savepoint(client):
+    """
+    In savepoint mode only the failed operations are rolled back
+    :param client: client object of Flask
+    :return: None
+    """
+    operations = [
+        {"id": "a", "method": "POST", "path": "/user/add/",
+         "body": {"first_name": "A", "last_name": "Doe", "mail": "a@doe.de", "phone": "1"}},
+        {"id": "b", "method": "POST", "path": "/user/add/",
+         "body": {"first_name": "B", "last_name": "Doe", "mail": "a@doe.de", "phone": "2"}},
+        {"method": "POST", "path": "/user/add/phone/", "body": {"id": {"$ref": "b.data.id"}, "phone": "3"}},
+        {"method": "POST", "path": "/user/add/phone/", "body": {"id": {"$ref": "a.data.id"}, "phone": "4"}},
+        {"method": "GET", "path": "/unknown/"},
+    ]
+    response, data = _batch(client, {"mode": "savepoint", "operations": operations})
+    assert response.status_code == 200
+    assert data["data"]["committed"] is True
+    assert [result["status"] for result in data["data"]["results"]] == [200, 409, 424, 200, 404]
+    assert User.query.count() == 1
+    assert sorted(phone.phone for phone in PhoneNumber.query.all()) == [1, 4]
+
+
+def test_batch_savepoint_rolls_back_writes(client):
+    """
+    In savepoint mode the writes of an operation that fails after writing
+    are rolled back, the other operations are kept
+    :param client: client object of Flask
+    :return: None
+    """
+    operations = [
+        {"method": "POST", "path": "/user/add/",
+         "body": {"first_name": "A", "last_name": "Doe", "mail": "a@doe.de", "phone": "1"}},
+        {"method": "POST", "path": "/test/add/fail/"},
+        {"method": "POST", "path": "/test/add/raise/"},
+        {"method": "POST", "path": "/user/add/",
+         "body": {"first_name": "B", "last_name": "Doe", "mail": "b@doe.de", "phone": "2"}},
+    ]
+    response, data = _batch(client, {"mode": "savepoint", "operations": operations})
+    assert data["data"]["committed"] is True
+    assert [result["status"] for result in data["data"]["results"]] == [200, 400, 500, 200]
+    assert sorted(user.first_name for user in User.query.all()) == ["a", "b"]
+
+
+def test_batch_request_hooks(client, app):
+    """
+    Every operation runs the request hooks of the app, like a single request
+    :param client: client object of Flask
+    :param app: the Flask app
+    :return: None
+    """
+    operations = _new_user("john@doe.de") + [{"method": "GET", "path": "/unknown/"}]
+    response, data = _batch(client, {"mode": "savepoint", "operations": operations})
+    assert data["data"]["results"][5]["body"]["error"]["code"] == "not_found"
+    assert app.config['RECORDED_PATHS'] == ['/user/add/', '/user/add/mail/', '/user/add/mail/', '/user/add/phone/',
+                                            '/user/1/', '/unknown/', '/batch/']
+
+
+def test_batch_invalid(client):
+    """
+    Provide missing or invalid batches
+    :param client: client object of Flask
+    :return: None
+    """
+    response, data = _batch(client, {})
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    for payload in ({"operations": []},
+                    {"operations": [{"method": "PATCH", "path": "/user/add/"}]},
+                    {"operations": [{"path": "/"}], "mode": "eventually"},
+                    {"operations": [{"id": "x", "path": "/"}, {"id": "x", "path": "/"}]},
+                    {"operations": [{"path": "/"}] * 101}):
+        response, data = _batch(client, payload)
+        assert response.status_code == 400
+        assert data["error"]["code"] == "invalid_fields"
+
+    response, data = _batch(client, {"operations": [{"method": "POST", "path": "/batch/",
+                                                     "body": {"operations": [{"path": "/"}]}}]})
+    assert data["data"]["results"][0]["status"] == 400
+    response, data = _batch(client, {"operations": [{"method": "GET", "path": "/user/{later.data.id}/"},
+                                                    {"id": "later", "method": "GET", "path": "/"}]})
+    assert data["data"]["results"][0]["body"]["error"]["code"] == "invalid_reference"
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import pytest
+from flask import json
+from breach import BreachIndex, build_index, email_hash, index_parameters, scan
+from models import BreachFinding, Email, User, db
+from purge import schedule_deletion
+
+BREACHED = ['user%d@breached.de' % number for number in range(2000)]
+
+
+@pytest.fixture()
+def index_path(tmp_path):
+    # a dump in the format of haveibeenpwned, upper case hashes with counts
+    dump = tmp_path / 'dump.txt'
+    dump.write_text(''.join('%s:%d\n' % (hashlib.sha1(mail.encode()).hexdigest().upper(), number)
+                            for number, mail in enumerate(BREACHED)))
+    path = str(tmp_path / 'breach_index.bin')
+    assert build_index(str(dump), path) == len(BREACHED)
+    return path
+
+
+@pytest.fixture()
+def app(make_app, index_path):
+    # 30 users, every third one with a breached email
+    app = make_app(BREACH_INDEX=index_path)
+    with app.app_context():
+        for number in range(30):
+            user = User('doe', 'john')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Email(BREACHED[number] if number % 3 == 0 else 'user%d@safe.de' % number, user.id))
+        db.session.commit()
+        yield app
+
+
+def test_breach_index(index_path):
+    """
+    All addresses of the dump are found, and few others
+    :param index_path: path of the index built from the dump
+    :return: None
+    """
+    index = BreachIndex(index_path)
+    assert index.count == len(BREACHED)
+    assert all(index.is_breached(mail) for mail in BREACHED)
+    assert index.is_breached('  USER7@Breached.DE ')
+    false_positives = sum(index.is_breached('user%d@safe.de' % number) for number in range(20000))
+    assert false_positives < 20000 * 0.005
+    assert index.contains_hash(email_hash(BREACHED[0]))
+    index.close()
+    assert os.path.getsize(index_path) < len(BREACHED) * 4
+
+
+def test_breach_index_parameters(tmp_path):
+    """
+    Large indexes are split into prefix buckets, invalid files are rejected
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    hash_count, prefix_bits, bucket_bytes = index_parameters(10 ** 6)
+    assert hash_count == 10
+    assert prefix_bits == 11 and bucket_bytes % 8 == 0 and bucket_bytes <= 1024
+    assert index_parameters(10 ** 9)[1] == 20
+    invalid = tmp_path / 'invalid.bin'
+    invalid.write_bytes(b'x' * 100)
+    with pytest.raises(ValueError):
+        BreachIndex(str(invalid))
+    dump = tmp_path / 'invalid.txt'
+    dump.write_text('not a hash\n')
+    with pytest.raises(ValueError):
+        build_index(str(dump), str(tmp_path / 'index.bin'))
+
+
+def test_breach_scan(app):
+    """
+    Scan all emails in chunks and read the report
+    :param app: the Flask app
+    :return: None
+    """
+    report_id = scan(db.engine, BreachIndex(app.config['BREACH_INDEX']), chunk_size=7)
+    assert sorted(finding.mail for finding in BreachFinding.query.filter_by(report_id=report_id)) == \
+        sorted(BREACHED[number] for number in range(0, 30, 3))
+
+    client = app.test_client()
+    data = json.loads(client.get('/breach/reports/%d/?limit=4' % report_id).get_data(as_text=True))["data"]
+    assert (data["status"], data["scanned"], data["flagged"]) == ("done", 30, 10)
+    assert [finding["user_id"] for finding in data["findings"]] == [1, 4, 7, 10]
+    assert client.get('/breach/reports/999/').status_code == 404
+
+
+def test_breach_index_truncated(index_path, tmp_path):
+    """
+    A truncated index file is rejected with a ValueError
+    :param index_path: path of the index
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    with open(index_path, 'rb') as stream:
+        data = stream.read()
+    truncated = tmp_path / 'truncated.bin'
+    for size in (0, 10, 63, 64, len(data) - 1):
+        truncated.write_bytes(data[:size])
+        with pytest.raises(ValueError):
+            BreachIndex(str(truncated))
+
+
+def test_breach_scan_skips_deleted_users(app):
+    """
+    The emails of users scheduled for deletion are not scanned
+    :param app: the Flask app
+    :return: None
+    """
+    schedule_deletion(user_ids=[1, 2, 4])
+    db.session.commit()
+    report_id = scan(db.engine, BreachIndex(app.config['BREACH_INDEX']), chunk_size=7)
+    findings = BreachFinding.query.filter_by(report_id=report_id).all()
+    assert sorted(finding.user_id for finding in findings) == [7, 10, 13, 16, 19, 22, 25, 28]
+    data = json.loads(app.test_client().get('/breach/reports/%d/' % report_id).get_data(as_text=True))["data"]
+    assert (data["status"], data["scanned"], data["flagged"]) == ("done", 27, 8)
+
+
+def test_breach_check(app):
+    """
+    Check single addresses, and without an index
+    :param app: the Flask app
+    :return: None
+    """
+    client = app.test_client()
+    response = client.post('/breach/check/', data=json.dumps({"mail": BREACHED[5]}), content_type='application/json')
+    assert json.loads(response.get_data(as_text=True))["data"] == {"mail": BREACHED[5], "breached": True}
+    response = client.post('/breach/check/', data=json.dumps({"mail": "john@safe.de"}),
+                           content_type='application/json')
+    assert json.loads(response.get_data(as_text=True))["data"]["breached"] is False
+    assert client.post('/breach/check/', data=json.dumps({}), content_type='application/json').status_code == 400
+
+    app.config['BREACH_INDEX'] = 'missing.bin'
+    response = client.post('/breach/check/', data=json.dumps({"mail": "john@safe.de"}),
+                           content_type='application/json')
+    assert response.status_code == 503
@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from models import Email, PhoneNumber, User, db
+import user_service_client.transport
+from user_service_client import ApiError, AsyncInProcessTransport, AsyncUserServiceClient, HTTPTransport, \
+    InProcessTransport, Retry, TransportError, UserNotFound, UserServiceClient
+
+
+class CountingTransport(InProcessTransport):
+    """
+    In-process transport recording the requests it sends
+    """
+    def __init__(self, app):
+        super(CountingTransport, self).__init__(app)
+        self.requests = []
+
+    def request(self, method, path, body=None):
+        self.requests.append((method, path))
+        return super(CountingTransport, self).request(method, path, body)
+
+
+class FlakyTransport(object):
+    """
+    Transport failing a number of times before it answers
+    """
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def request(self, method, path, body=None):
+        self.calls += 1
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure is None:
+                raise TransportError('connection reset')
+            return failure, {"error": {"code": "unavailable", "message": "Try again"}}
+        return 200, {"msg": "Success", "data": {"id": 1}}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture()
+def app(make_app):
+    # two users
+    app = make_app(PURGE_IN_BACKGROUND=False)
+    with app.app_context():
+        for number in range(2):
+            user = User('doe', 'john')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Email('john%d@doe.de' % number, user.id))
+            db.session.add(PhoneNumber('900%d' % number, user.id))
+        db.session.commit()
+        db.session.remove()
+    return app
+
+
+def test_add_and_get_user(app):
+    """
+    Add a user and read it back through the in-process transport
+    :param app: the Flask app
+    :return: None
+    """
+    with UserServiceClient(InProcessTransport(app), batch_window=0) as client:
+        user_id = client.add_user('jane', 'doe', 'jane@doe.de', '123')
+        client.add_mail(user_id, 'jane@example.com')
+        assert client.get_user(user_id) == {'id': user_id, 'last_name': 'doe', 'first_name': 'jane',
+                                            'mail': ['jane@doe.de', 'jane@example.com'], 'phone': [123]}
+        assert [user['id'] for user in client.find_users('john', 'doe')] == [1, 2]
+        assert client.get_users([1, 54, 1]) == {1: client.get_user(1), 54: None}
+        with pytest.raises(UserNotFound) as error:
+            client.get_user(54)
+        assert error.value.status == 404 and error.value.code == 'user_not_found'
+        with pytest.raises(ApiError) as error:
+            client.add_mail(user_id, 'jane@doe.de')
+        assert error.value.status == 409
+
+
+def test_concurrent_lookups_are_batched(app):
+    """
+    Lookups of concurrent threads are sent in one batch request, with every id fetched once
+    :param app: the Flask app
+    :return: None
+    """
+    transport = CountingTransport(app)
+    client = UserServiceClient(transport, batch_window=0.2)
+    user_ids = [1, 2, 1, 54]
+    results = {}
+    barrier = threading.Barrier(len(user_ids))
+
+    def lookup(index, user_id):
+        barrier.wait()
+        try:
+            results[index] = client.get_user(user_id)
+        except UserNotFound as error:
+            results[index] = error
+
+    threads = [threading.Thread(target=lookup, args=item) for item in enumerate(user_ids)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert transport.requests == [('POST', '/batch/')]
+    assert results[0] == results[2] and results[0]['mail'] == ['john0@doe.de']
+    assert results[1]['id'] == 2
+    assert isinstance(results[3], UserNotFound)
+    # a single lookup is sent as a plain GET
+    assert client.get_user(2)['id'] == 2
+    assert transport.requests[-1] == ('GET', '/user/2/')
+
+
+def test_retry():
+    """
+    Idempotent calls are retried on transport errors and 503, writes are sent once
+    :return: None
+    """
+    retry = Retry(attempts=3, backoff=0.001)
+    transport = FlakyTransport([503, None])
+    assert UserServiceClient(transport, retry, batch_window=0).get_user(1) == {"id": 1}
+    assert transport.calls == 3
+    transport = FlakyTransport([503, 503, 503])
+    with pytest.raises(ApiError) as error:
+        UserServiceClient(transport, retry, batch_window=0).get_user(1)
+    assert error.value.status == 503 and transport.calls == 3
+    transport = FlakyTransport([None])
+    with pytest.raises(TransportError):
+        UserServiceClient(transport, retry).add_user('jane', 'doe', 'jane@doe.de', '123')
+    assert transport.calls == 1
+
+
+def test_async_client(app):
+    """
+    Concurrent lookups of the async client are sent in one batch request
+    :param app: the Flask app
+    :return: None
+    """
+    async def run():
+        async with AsyncUserServiceClient(AsyncInProcessTransport(app), batch_window=0.05) as client:
+            user_id = await client.add_user('jane', 'doe', 'jane@doe.de', '123')
+            users = await asyncio.gather(client.get_user(1), client.get_user(user_id), client.get_user(1),
+                                         client.get_user(54), return_exceptions=True)
+            return user_id, users
+
+    user_id, users = asyncio.run(run())
+    assert users[0] == users[2] and users[0]['id'] == 1
+    assert users[1]['mail'] == ['jane@doe.de']
+    assert isinstance(users[3], UserNotFound)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 server passing requests to the app. The development server of
+    werkzeug closes every connection, so it can not test keep-alive.
+    """
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except TimeoutError:
+            # idle for longer than the timeout of the handler
+            self.close_connection = True
+            return
+        if not self.raw_requestline or not self.parse_request():
+            self.close_connection = True
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        response = self.server.client.open(self.path, method=self.command, data=body,
+                                           content_type=self.headers.get('Content-Type'))
+        self.send_response(response.status_code)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(response.data)))
+        self.end_headers()
+        self.wfile.write(response.data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_transport_reuses_connections(app):
+    """
+    The HTTP transport sends many requests over one keep-alive connection
+    :param app: the Flask app
+    :return: None
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.client = app.test_client(use_cookies=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        transport = HTTPTransport('http://127.0.0.1:%d' % server.server_port)
+        with UserServiceClient(transport, batch_window=0) as client:
+            for _ in range(5):
+                assert client.get_user(1)['id'] == 1
+            with pytest.raises(UserNotFound):
+                client.get_user(54)
+        assert transport.connections_opened == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class IdleClosingHandler(KeepAliveHandler):
+    """
+    Keep-alive server closing connections idle for 0.2 seconds, like the
+    keepalive setting of gunicorn
+    """
+    timeout = 0.2
+
+
+@pytest.mark.parametrize('check_pool', [True, False])
+def test_http_transport_server_closes_idle_connections(app, monkeypatch, check_pool):
+    """
+    A request after the server closed the pooled connection is sent on a new
+    connection; either the closed connection is found in the pool, or the
+    request failing on it before any response is sent again
+    :param app: the Flask app
+    :param monkeypatch: the monkeypatch fixture
+    :param check_pool: False to skip the check of the pooled connections
+    :return: None
+    """
+    if not check_pool:
+        monkeypatch.setattr(user_service_client.transport, '_closed_by_server', lambda connection: False)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), IdleClosingHandler)
+    server.client = app.test_client(use_cookies=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        transport = HTTPTransport('http://127.0.0.1:%d' % server.server_port)
+        with UserServiceClient(transport, batch_window=0, retry=Retry(attempts=1)) as client:
+            first = client.add_user('ada', 'lovelace', 'ada@example.com', '1815')
+            time.sleep(0.5)
+            second = client.add_user('grace', 'hopper', 'grace@example.com', '1906')
+            assert client.get_user(second)['first_name'] == 'grace'
+        assert first != second
+        assert transport.connections_opened == 2
+        with app.app_context():
+            assert User.query.filter_by(last_name='lovelace').count() == 1
+            assert User.query.filter_by(last_name='hopper').count() == 1
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,282 @@
+import threading
+import pytest
+from flask import jsonify
+from models import Email, PhoneNumber, User, db
+import coalescing
+import reads
+
+
+class WatchedEvent(threading.Event):
+    """
+    Event counting the threads waiting for it
+    """
+    def __init__(self):
+        super(WatchedEvent, self).__init__()
+        self.waiters = 0
+        self._waiters_lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        with self._waiters_lock:
+            self.waiters += 1
+        return super(WatchedEvent, self).wait(timeout)
+
+
+class WatchedFlight(coalescing.Flight):
+    __slots__ = ()
+
+    def __init__(self):
+        super(WatchedFlight, self).__init__()
+        self.done = WatchedEvent()
+
+
+@pytest.fixture()
+def app(make_app):
+    # two users of the same name
+    app = make_app(PURGE_IN_BACKGROUND=False)
+    with app.app_context():
+        for number in range(2):
+            user = User('doe', 'john')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Email('john%d@doe.de' % number, user.id))
+            db.session.add(PhoneNumber('900%d' % number, user.id))
+        db.session.commit()
+        db.session.remove()
+    return app
+
+
+@pytest.fixture()
+def flights(monkeypatch):
+    # the flights record the requests waiting for them
+    flights = []
+
+    def create_flight():
+        flights.append(WatchedFlight())
+        return flights[-1]
+
+    monkeypatch.setattr(coalescing, 'Flight', create_flight)
+    return flights
+
+
+def waiting(flights):
+    """
+    :param flights: the flights created by the test
+    :return: the number of requests waiting for a flight
+    """
+    return sum(flight.done.waiters for flight in flights)
+
+
+@pytest.fixture()
+def gate(monkeypatch):
+    # the lookups by id count the database fetches and return once the gate is opened
+    gate = threading.Event()
+    gate.fetches = 0
+    get_user = reads.get_user
+
+    def gated_get_user(user_id):
+        user_record = get_user(user_id)
+        gate.fetches += 1
+        gate.wait(5)
+        return user_record
+
+    monkeypatch.setattr(reads, 'get_user', gated_get_user)
+    return gate
+
+
+def get_in_threads(app, paths):
+    """
+    Send GET requests from concurrent threads
+    :param app: the Flask app
+    :param paths: the paths of the requests
+    :return: list of the threads and list of the responses
+    """
+    responses = [None] * len(paths)
+
+    def get(index, path):
+        responses[index] = app.test_client().get(path)
+
+    threads = [threading.Thread(target=get, args=item) for item in enumerate(paths)]
+    for thread in threads:
+        thread.start()
+    return threads, responses
+
+
+def wait_for(condition):
+    """
+    Wait until a condition holds, for at most 5 seconds
+    :param condition: function without arguments
+    :return: None
+    """
+    event = threading.Event()
+    for _ in range(500):
+        if condition():
+            return
+        event.wait(0.01)
+    raise AssertionError('Timed out')
+
+
+def test_identical_reads_share_one_fetch(app, gate, flights):
+    """
+    Concurrent lookups of the same user run one query and get the same response
+    :param app: the Flask app
+    :param gate: the gate of the lookups
+    :param flights: the flights created by the test
+    :return: None
+    """
+    single_flight = app.extensions['single_flight']
+    threads, responses = get_in_threads(app, ['/user/1/'] * 4 + ['/user/2/'])
+    wait_for(lambda: gate.fetches == 2 and waiting(flights) == 3)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert gate.fetches == 2
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.data for response in responses[:4]}) == 1
+    assert responses[0].get_json()['data']['mail'] == ['john0@doe.de']
+    assert responses[4].get_json()['data']['id'] == 2
+    assert single_flight.stats() == {'fetches': 2, 'coalesced': 3, 'detached': 0,
+                                     'retried': 0, 'timed_out': 0, 'running': 0}
+    # a lookup after the others finished runs on its own
+    assert app.test_client().get('/user/1/').data == responses[0].data
+    assert gate.fetches == 3
+    stats = app.test_client().get('/admin/coalescing/').get_json()['data']
+    assert stats['enabled'] and stats['coalesced'] == 3
+
+
+def test_write_detaches_running_read(app, gate, flights):
+    """
+    Requests arriving after a write to the user do not join a lookup started before it
+    :param app: the Flask app
+    :param gate: the gate of the lookups
+    :param flights: the flights created by the test
+    :return: None
+    """
+    single_flight = app.extensions['single_flight']
+    before, before_responses = get_in_threads(app, ['/user/1/', '/user/1/'])
+    wait_for(lambda: gate.fetches == 1 and waiting(flights) == 1)
+    response = app.test_client().post('/user/add/mail/', json={'id': 1, 'mail': 'john@example.com'})
+    assert response.status_code == 200
+    assert single_flight.stats()['detached'] == 1
+    after, after_responses = get_in_threads(app, ['/user/1/'])
+    wait_for(lambda: gate.fetches == 2)
+    gate.set()
+    for thread in before + after:
+        thread.join()
+    # the requests sent before the write get the old user, the request sent after it the new one
+    assert [response.get_json()['data']['mail'] for response in before_responses] == [['john0@doe.de']] * 2
+    assert after_responses[0].get_json()['data']['mail'] == ['john0@doe.de', 'john@example.com']
+    assert single_flight.stats()['coalesced'] == 1
+
+
+def test_name_lookups_are_coalesced(app, monkeypatch, flights):
+    """
+    Lookups by name share one fetch regardless of the case of the names
+    :param app: the Flask app
+    :param monkeypatch: the pytest monkeypatch fixture
+    :param flights: the flights created by the test
+    :return: None
+    """
+    gate = threading.Event()
+    find_users = reads.find_users
+    calls = []
+
+    def gated_find_users(first_name, last_name):
+        calls.append((first_name, last_name))
+        gate.wait(5)
+        return find_users(first_name, last_name)
+
+    monkeypatch.setattr(reads, 'find_users', gated_find_users)
+    threads, responses = get_in_threads(app, ['/user?first_name=john&last_name=doe',
+                                              '/user?first_name=John&last_name=DOE'])
+    wait_for(lambda: len(calls) == 1 and waiting(flights) == 1)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert responses[0].data == responses[1].data
+    assert [user['id'] for user in responses[1].get_json()['data']] == [1, 2]
+
+
+def test_failed_fetch_is_not_shared(flights):
+    """
+    Requests waiting for a lookup that failed run their own lookup
+    :param flights: the flights created by the test
+    :return: None
+    """
+    single_flight = coalescing.SingleFlight()
+    key = coalescing.user_key(1)
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def failing_fetch():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('database is locked')
+
+    def leader():
+        try:
+            single_flight.run(key, failing_fetch)
+        except RuntimeError as error:
+            results.append(error)
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    started.wait(5)
+    follower_thread = threading.Thread(target=lambda: results.append(single_flight.run(key, lambda: 'own')))
+    follower_thread.start()
+    wait_for(lambda: waiting(flights) == 1)
+    release.set()
+    leader_thread.join()
+    follower_thread.join()
+    assert 'own' in results and any(isinstance(result, RuntimeError) for result in results)
+    assert single_flight.stats() == {'fetches': 1, 'coalesced': 0, 'detached': 0,
+                                     'retried': 1, 'timed_out': 0, 'running': 0}
+
+
+def test_hung_fetch_times_out(app, flights):
+    """
+    Requests waiting longer than the timeout for a lookup run their own lookup,
+    the hung lookup still finishes
+    :param app: the Flask app
+    :param flights: the flights created by the test
+    :return: None
+    """
+    single_flight = coalescing.SingleFlight(timeout=0.05)
+    key = coalescing.user_key(1)
+    started = threading.Event()
+    release = threading.Event()
+    leader_results = []
+
+    def hung_fetch():
+        started.set()
+        release.wait(5)
+        return jsonify({"msg": "late"})
+
+    def lead():
+        with app.app_context():
+            leader_results.append(single_flight.run(key, hung_fetch).get_json())
+
+    leader_thread = threading.Thread(target=lead)
+    leader_thread.start()
+    started.wait(5)
+    assert single_flight.run(key, lambda: 'own') == 'own'
+    release.set()
+    leader_thread.join(5)
+    assert not leader_thread.is_alive()
+    assert leader_results == [{"msg": "late"}]
+    assert single_flight.stats() == {'fetches': 1, 'coalesced': 0, 'detached': 0,
+                                     'retried': 0, 'timed_out': 1, 'running': 0}
+
+
+def test_coalescing_disabled(make_app):
+    """
+    Without COALESCE_READS the lookups run as before
+    :param make_app: factory of apps with a fresh database
+    :return: None
+    """
+    app = make_app(PURGE_IN_BACKGROUND=False, COALESCE_READS=False)
+    client = app.test_client()
+    assert 'single_flight' not in app.extensions
+    assert client.get('/user/1/').status_code == 404
+    assert client.get('/admin/coalescing/').get_json()['data']['enabled'] is False
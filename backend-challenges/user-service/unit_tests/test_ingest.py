@@ -0,0 +1,173 @@
+import io
+import os
+import pytest
+from datetime import datetime
+from flask import json
+from ingest import ingest, iter_json_array, parse_timestamp
+from models import NO_START, Certificate, Course, Email, ImportedUser, User, db
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data-engineer')
+FILES = {name: os.path.join(DATA_DIR, name + '.json') for name in ('users', 'courses', 'certificates')}
+
+
+@pytest.fixture()
+def app(app):
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+def test_iter_json_array():
+    """
+    The streaming parser yields the same elements as json.load, even when
+    elements span several chunks
+    :return: None
+    """
+    with open(FILES['certificates'], encoding='utf-8') as stream:
+        expected = json.load(stream)
+    with open(FILES['certificates'], encoding='utf-8') as stream:
+        assert list(iter_json_array(stream, chunk_size=7)) == expected
+    assert list(iter_json_array(io.StringIO(' [ ] '))) == []
+
+
+def test_iter_json_array_invalid():
+    """
+    Truncated or malformed input raises an error
+    :return: None
+    """
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[{"a": 1}, {"b": 2}')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[{"a": 1} {"b": 2}]')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"a": 1}')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[1,]')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[{"a": 1}, ]')))
+
+
+class CountingStream(io.StringIO):
+    """
+    Stream counting the characters read
+    """
+    def __init__(self, text):
+        super(CountingStream, self).__init__(text)
+        self.characters = 0
+
+    def read(self, size=-1):
+        chunk = super(CountingStream, self).read(size)
+        self.characters += len(chunk)
+        return chunk
+
+
+@pytest.mark.parametrize('invalid', ['{"a": x}', '{"a": 1 "b": 2}', '{"a": [1, }', '{"a": 1},]'])
+def test_iter_json_array_fails_fast(invalid):
+    """
+    An invalid element fails once it was read, the rest of the file is not
+    buffered
+    :param invalid: the invalid element
+    :return: None
+    """
+    stream = CountingStream('[' + invalid + ', ' + ', '.join(['{"a": "%s"}' % ('x' * 100)] * 1000) + ']')
+    with pytest.raises(ValueError):
+        list(iter_json_array(stream, chunk_size=64))
+    assert stream.characters <= 128
+    stream = CountingStream('[{"a": "' + 'x' * 100000)
+    with pytest.raises(ValueError, match='larger than'):
+        list(iter_json_array(stream, chunk_size=64, max_size=1000))
+    assert stream.characters < 2000
+
+
+def test_parse_timestamp():
+    """
+    ISO timestamps are converted to naive datetimes in UTC
+    :return: None
+    """
+    assert parse_timestamp('2021-05-30T14:19:55.636Z') == datetime(2021, 5, 30, 14, 19, 55, 636000)
+    assert parse_timestamp('2021-05-30T16:19:55+02:00') == datetime(2021, 5, 30, 14, 19, 55)
+    assert parse_timestamp(None) is None
+
+
+def test_ingest(app):
+    """
+    Load the sample files and check the users are served by the API
+    :param app: the Flask app
+    :return: None
+    """
+    counts = ingest(db.engine, batch_size=64, **FILES)
+    assert counts == {'courses': 6, 'users': 50, 'certificates': 500}
+    assert Course.query.count() == 6
+    assert Certificate.query.count() == 500
+    assert User.query.count() == 50
+    assert Email.query.count() == 50
+
+    link = ImportedUser.query.filter_by(external_id='6237b65b-6a0b-4add-acec-a37fff834804').first()
+    assert link.batch == 'default'
+    response = app.test_client().get('/user/%d/' % link.user_id)
+    data = json.loads(response.get_data(as_text=True))
+    assert data["data"]["first_name"] == "vincent"
+    assert data["data"]["mail"] == ["thad92@gmail.com"]
+
+
+def test_ingest_idempotent(app, tmp_path):
+    """
+    Re-running the ingestion does not duplicate records and updates changed values
+    :param app: the Flask app
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    ingest(db.engine, **FILES)
+    with open(FILES['certificates'], encoding='utf-8') as stream:
+        certificates = json.load(stream)
+    certificates[0]['completedDate'] = '2022-01-01T00:00:00.000Z'
+    changed = tmp_path / 'certificates.json'
+    changed.write_text(json.dumps(certificates), encoding='utf-8')
+
+    ingest(db.engine, users=FILES['users'], courses=FILES['courses'], certificates=str(changed))
+    assert User.query.count() == 50
+    assert Email.query.count() == 50
+    assert Course.query.count() == 6
+    assert Certificate.query.count() == 500
+    certificate = Certificate.query.filter_by(course_id=certificates[0]['course'],
+                                              user_external_id=certificates[0]['user'],
+                                              started_at=parse_timestamp(certificates[0]['startDate'])).first()
+    assert certificate.completed_at == datetime(2022, 1, 1)
+
+
+def test_ingest_user_ids(app):
+    """
+    New users are inserted per batch, every imported user is linked to the
+    User created for it
+    :param app: the Flask app
+    :return: None
+    """
+    db.session.add(User('existing', 'user'))
+    db.session.commit()
+    ingest(db.engine, users=FILES['users'], batch_size=7)
+    with open(FILES['users'], encoding='utf-8') as stream:
+        users = json.load(stream)
+    for record in users:
+        user = db.session.get(User, db.session.get(ImportedUser, record['id']).user_id)
+        assert (user.first_name, user.last_name) == (record['firstName'].lower(), record['lastName'].lower())
+        assert [email.mail for email in Email.query.filter_by(user_id=user.id)] == [record['email'].lower()]
+    assert User.query.count() == 51
+
+
+def test_ingest_certificate_without_start(app, tmp_path):
+    """
+    Re-loading a certificate without a start date does not duplicate it
+    :param app: the Flask app
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    with open(FILES['certificates'], encoding='utf-8') as stream:
+        certificates = json.load(stream)[:3]
+    del certificates[0]['startDate']
+    changed = tmp_path / 'certificates.json'
+    changed.write_text(json.dumps(certificates), encoding='utf-8')
+    ingest(db.engine, **dict(FILES, certificates=str(changed)))
+    ingest(db.engine, certificates=str(changed))
+    assert Certificate.query.count() == 3
+    certificate = Certificate.query.filter_by(started_at=NO_START).one()
+    assert certificate.duration_ms is None
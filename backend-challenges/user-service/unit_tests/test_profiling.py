@@ -0,0 +1,104 @@
+import time
+import pytest
+from flask import json, jsonify
+from models import db
+from profiling import TOKEN_HEADER, Profiler
+
+TOKEN = 'secret-token'
+
+
+@pytest.fixture()
+def make_app(make_app):
+    """
+    Factory of apps with a fresh database and a slow endpoint
+    :param make_app: factory of apps with a fresh database
+    :return: function taking the values overriding the config file and returning the Flask app
+    """
+    def make_slow_app(**config):
+        app = make_app(**config)
+        app.add_url_rule('/slow/', 'slow', slow)
+        return app
+    return make_slow_app
+
+
+def slow():
+    """
+    An endpoint slow enough to be sampled
+    :return: the response
+    """
+    time.sleep(0.05)
+    return jsonify({"msg": "Success"})
+
+
+@pytest.fixture()
+def client(make_app):
+    return make_app(PROFILE_TOKEN=TOKEN, PROFILE_BUFFER_SIZE=3, PROFILE_INTERVAL=0.001).test_client()
+
+
+def test_profiling_disabled(make_app):
+    """
+    Nothing is registered when profiling is disabled
+    :param make_app: factory of apps with a fresh database
+    :return: None
+    """
+    app = make_app()
+    assert 'profiler' not in app.extensions
+    assert app.before_request_funcs == {}
+    with app.app_context():
+        listeners = list(db.engine.dispatch.before_cursor_execute) + list(db.engine.dispatch.after_cursor_execute)
+    assert not any(isinstance(getattr(listener, '__self__', None), Profiler) for listener in listeners)
+    assert app.test_client().get('/admin/profiles/', headers={TOKEN_HEADER: TOKEN}).status_code == 404
+
+
+def test_profile_with_token(client):
+    """
+    Requests sending the token are profiled with their SQL statements
+    :param client: client object of Flask
+    :return: None
+    """
+    assert client.get('/user/1/').status_code == 404
+    assert client.get('/admin/profiles/').status_code == 403
+    client.get('/user/1/', headers={TOKEN_HEADER: TOKEN})
+    client.get('/slow/', headers={TOKEN_HEADER: TOKEN})
+
+    response = client.get('/admin/profiles/', headers={TOKEN_HEADER: TOKEN})
+    profiles = json.loads(response.get_data(as_text=True))["data"]
+    assert [(profile["endpoint"], profile["status"]) for profile in profiles] == \
+        [("slow", 200), ("usergetbyid", 404)]
+    assert profiles[0]["duration_ms"] >= 50 and profiles[0]["samples"] > 0
+
+    response = client.get('/admin/profiles/%d/' % profiles[1]["id"], headers={TOKEN_HEADER: TOKEN})
+    profile = json.loads(response.get_data(as_text=True))["data"]
+    assert profile["sql_statements"] == len(profile["sql"]) == 1
+    assert profile["sql"][0]["statement"].startswith("SELECT user.id")
+
+    response = client.get('/admin/profiles/%d/collapsed' % profiles[0]["id"], headers={TOKEN_HEADER: TOKEN})
+    assert response.mimetype == 'text/plain'
+    lines = response.get_data(as_text=True).splitlines()
+    assert any('test_profiling.py:slow' in line for line in lines)
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == profiles[0]["samples"]
+    assert client.get('/admin/profiles/999/', headers={TOKEN_HEADER: TOKEN}).status_code == 404
+
+
+def test_profile_buffer(client):
+    """
+    Only the last profiles are kept
+    :param client: client object of Flask
+    :return: None
+    """
+    for user_id in range(5):
+        client.get('/user/%d/' % user_id, headers={TOKEN_HEADER: TOKEN})
+    response = client.get('/admin/profiles/', headers={TOKEN_HEADER: TOKEN})
+    profiles = json.loads(response.get_data(as_text=True))["data"]
+    assert [profile["path"] for profile in profiles] == ['/user/4/', '/user/3/', '/user/2/']
+
+
+def test_profile_sample_rate(make_app):
+    """
+    With a sample rate of 1 every request is profiled
+    :param make_app: factory of apps with a fresh database
+    :return: None
+    """
+    app = make_app(PROFILE_SAMPLE_RATE=1)
+    app.test_client().get('/')
+    assert [profile.endpoint for profile in app.extensions['profiler'].profiles] == ['home']
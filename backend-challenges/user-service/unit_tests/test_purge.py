@@ -0,0 +1,164 @@
+import threading
+import time
+import pytest
+from flask import json
+from models import Email, ImportedUser, PhoneNumber, PurgeJob, User, UserDeletion, db
+from purge import purge_chunk, purge_pending, schedule_deletion
+
+
+def _make_app(make_app, background):
+    """
+    Create an app with a fresh database containing 30 users, 20 of them from import batch 'b1'
+    :param make_app: factory of apps with a fresh database
+    :param background: whether the purge worker is enabled
+    :return: the Flask app
+    """
+    app = make_app(PURGE_IN_BACKGROUND=background, PURGE_PAUSE=0)
+    with app.app_context():
+        for number in range(1, 31):
+            user = User('doe', 'user%d' % number)
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Email('user%d@test.de' % number, user.id))
+            db.session.add(Email('user%d@other.de' % number, user.id))
+            db.session.add(PhoneNumber('900%d' % number, user.id))
+            if number <= 20:
+                db.session.add(ImportedUser('uuid-%d' % number, user.id, 'b1'))
+        db.session.commit()
+    return app
+
+
+@pytest.fixture()
+def app(make_app):
+    app = _make_app(make_app, background=False)
+    with app.app_context():
+        yield app
+
+
+def _bulk_delete(client, payload):
+    """
+    Send a bulk delete request
+    :param client: client object of Flask
+    :param payload: the JSON payload
+    :return: tuple of the response and its decoded data
+    """
+    response = client.post('/user/bulk-delete/', data=json.dumps(payload), content_type='application/json')
+    return response, json.loads(response.get_data(as_text=True))
+
+
+def test_bulk_delete_ids(client):
+    """
+    Users are hidden right away and purged later
+    :param client: client object of Flask
+    :return: None
+    """
+    response, data = _bulk_delete(client, {"ids": [1, 2, 3, 3, 999]})
+    assert response.status_code == 202
+    assert data["data"]["users"] == 3
+    job_id = data["data"]["job_id"]
+
+    # marked users are no longer visible, but not purged yet
+    assert client.get('/user/2/').status_code == 404
+    assert client.get('/user/4/').status_code == 200
+    assert User.query.count() == 30
+    status = json.loads(client.get('/user/bulk-delete/%d/' % job_id).get_data(as_text=True))["data"]
+    assert status == {"job_id": job_id, "status": "pending", "users": 3, "purged": 0}
+
+    assert purge_pending(db.engine, chunk_size=2) == 3
+    assert User.query.count() == 27
+    assert Email.query.filter(Email.user_id.in_([1, 2, 3])).count() == 0
+    assert PhoneNumber.query.filter(PhoneNumber.user_id.in_([1, 2, 3])).count() == 0
+    status = json.loads(client.get('/user/bulk-delete/%d/' % job_id).get_data(as_text=True))["data"]
+    assert status == {"job_id": job_id, "status": "done", "users": 3, "purged": 3}
+
+
+def test_bulk_delete_batch(client):
+    """
+    Delete all users of an import batch, in chunks
+    :param client: client object of Flask
+    :return: None
+    """
+    response, data = _bulk_delete(client, {"batch": "b1"})
+    assert response.status_code == 202
+    assert data["data"]["users"] == 20
+    # users of the batch can not be changed any more, and their emails can be reused
+    response = client.post('/user/add/mail/', data=json.dumps({"id": 5, "mail": "x@test.de"}),
+                           content_type='application/json')
+    assert response.status_code == 404
+    response = client.post('/user/add/', data=json.dumps({
+        "first_name": "New", "last_name": "User", "mail": "user5@test.de", "phone": "1"
+    }), content_type='application/json')
+    assert response.status_code == 200
+
+    assert purge_chunk(db.engine, chunk_size=8) == 8
+    assert UserDeletion.query.count() == 12
+    assert PurgeJob.query.get(data["data"]["job_id"]).status == "pending"
+    purge_pending(db.engine, chunk_size=8)
+    assert User.query.count() == 11
+    assert ImportedUser.query.count() == 0
+    assert PurgeJob.query.get(data["data"]["job_id"]).status == "done"
+
+
+def test_bulk_delete_invalid(client):
+    """
+    Provide missing or invalid information
+    :param client: client object of Flask
+    :return: None
+    """
+    response, data = _bulk_delete(client, {})
+    assert response.status_code == 400
+    assert data["error"]["code"] == "missing_fields"
+    response, data = _bulk_delete(client, {"ids": "1,2"})
+    assert response.status_code == 400
+    assert data["error"]["code"] == "invalid_fields"
+    response, data = _bulk_delete(client, {"ids": []})
+    assert response.status_code == 202
+    assert data["data"]["users"] == 0
+    assert client.get('/user/bulk-delete/999/').status_code == 404
+
+
+def test_bulk_delete_background(make_app):
+    """
+    The background worker purges the users
+    :param make_app: factory of apps with a fresh database
+    :return: None
+    """
+    app = _make_app(make_app, background=True)
+    client = app.test_client()
+    response, data = _bulk_delete(client, {"batch": "b1"})
+    job_url = '/user/bulk-delete/%d/' % data["data"]["job_id"]
+    for _ in range(100):
+        status = json.loads(client.get(job_url).get_data(as_text=True))["data"]
+        if status["status"] == "done":
+            break
+        time.sleep(0.05)
+    assert status["purged"] == 20
+    with app.app_context():
+        assert User.query.count() == 10
+
+
+def test_purge_concurrent(app):
+    """
+    Purges running at the same time, like the workers of several gunicorn
+    processes, purge and count every user once
+    :param app: the Flask app
+    :return: None
+    """
+    job = schedule_deletion(batch='b1')
+    db.session.commit()
+    totals = []
+
+    def purge():
+        with app.app_context():
+            totals.append(purge_pending(db.engine, chunk_size=3))
+
+    threads = [threading.Thread(target=purge) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert sum(totals) == 20
+    db.session.expire_all()
+    job = db.session.get(PurgeJob, job.id)
+    assert (job.status, job.users, job.purged) == ('done', 20, 20)
+    assert User.query.count() == 10
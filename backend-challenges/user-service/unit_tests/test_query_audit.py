@@ -0,0 +1,36 @@
+import sqlite3
+from query_audit import AUTOMATIC_INDEX, SCAN, TEMP_BTREE, QueryAudit, explain
+
+
+def test_explain():
+    """
+    Scans, temporary B-trees and automatic indexes are found in query plans
+    :return: None
+    """
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE user (id INTEGER PRIMARY KEY, first_name TEXT)')
+    connection.execute('CREATE TABLE email (id INTEGER PRIMARY KEY, mail TEXT, user_id INTEGER)')
+    connection.executemany('INSERT INTO user (first_name) VALUES (?)', [('john',), ('jane',)])
+
+    assert explain(connection, 'SELECT * FROM user WHERE id = ?', (1,)) == []
+    assert explain(connection, 'CREATE INDEX ix ON user (first_name)', ()) == []
+    findings = explain(connection, 'SELECT * FROM user AS user_1 ORDER BY lower(first_name)', ())
+    assert [(finding.kind, finding.table, finding.rows) for finding in findings] == \
+        [(SCAN, 'user', 2), (TEMP_BTREE, None, 0)]
+    findings = explain(connection, 'SELECT * FROM user JOIN email ON email.mail = user.first_name', ())
+    assert [(finding.kind, finding.table) for finding in findings] == [(SCAN, 'user'), (AUTOMATIC_INDEX, 'email')]
+
+
+def test_query_audit_report():
+    """
+    Findings are recorded per endpoint and filtered by table size
+    :return: None
+    """
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE user (id INTEGER PRIMARY KEY, first_name TEXT)')
+    audit = QueryAudit(min_rows=1)
+    cursor = connection.cursor()
+    audit.before_cursor_execute(None, cursor, 'SELECT * FROM user WHERE first_name = ?', ('john',), None, False)
+    assert audit.scans() == set()
+    assert audit.scans(min_rows=0) == {('<no request>', 'user')}
+    assert audit.report()['<no request>'][0]['kind'] == SCAN
@@ -0,0 +1,61 @@
+import pytest
+from models import Email, PhoneNumber, User, UserDeletion, db
+from reads import UserRecord, find_users, get_user
+
+
+@pytest.fixture()
+def app(make_app):
+    # three users, the last one marked as deleted
+    app = make_app(PURGE_IN_BACKGROUND=False)
+    with app.app_context():
+        for number in range(3):
+            user = User('doe', 'john')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Email('john%d@doe.de' % number, user.id))
+            db.session.add(Email('doe%d@doe.de' % number, user.id))
+            db.session.add(PhoneNumber('900%d' % number, user.id))
+        db.session.add(UserDeletion(user_id=3, job_id=1))
+        db.session.commit()
+        db.session.remove()
+        yield app
+
+
+def test_get_user(app):
+    """
+    Look up users by id without loading ORM objects
+    :param app: the Flask app
+    :return: None
+    """
+    user_record = get_user(1)
+    assert isinstance(user_record, UserRecord)
+    assert user_record.to_dict() == {'id': 1, 'last_name': 'doe', 'first_name': 'john',
+                                     'mail': ['john0@doe.de', 'doe0@doe.de'], 'phone': [9000]}
+    assert get_user(3) is None
+    assert get_user(54) is None
+    assert len(db.session.identity_map) == 0
+
+
+def test_find_users(app):
+    """
+    Look up users by name, ignoring case and users marked as deleted
+    :param app: the Flask app
+    :return: None
+    """
+    user_records = find_users('JOHN', 'Doe')
+    assert [user_record.id for user_record in user_records] == [1, 2]
+    assert user_records[1].mail == ['john1@doe.de', 'doe1@doe.de']
+    assert find_users('jane', 'doe') == []
+
+
+def test_reads_see_flushed_changes(app):
+    """
+    Lookups in the same transaction see the changes that were flushed
+    :param app: the Flask app
+    :return: None
+    """
+    db.session.add(Email('new@doe.de', 2))
+    db.session.flush()
+    assert get_user(2).mail == ['john1@doe.de', 'doe1@doe.de', 'new@doe.de']
+    db.session.rollback()
+    assert get_user(2).mail == ['john1@doe.de', 'doe1@doe.de']
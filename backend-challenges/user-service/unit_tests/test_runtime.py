@@ -0,0 +1,49 @@
+from runtime import cpu_limit, memory_limit, worker_settings
+
+
+def test_cgroup_v2(tmp_path):
+    """
+    Read the limits of a cgroup v2 container
+    :param tmp_path: temporary directory standing in for /sys/fs/cgroup
+    :return: None
+    """
+    (tmp_path / 'cpu.max').write_text('20000 100000\n')
+    (tmp_path / 'memory.max').write_text('134217728\n')
+    assert cpu_limit(str(tmp_path)) == 0.2
+    assert memory_limit(str(tmp_path)) == 128
+    (tmp_path / 'cpu.max').write_text('max 100000\n')
+    (tmp_path / 'memory.max').write_text('max\n')
+    assert cpu_limit(str(tmp_path)) is None
+    assert memory_limit(str(tmp_path)) is None
+
+
+def test_cgroup_v1(tmp_path):
+    """
+    Read the limits of a cgroup v1 container, and of a system without cgroups
+    :param tmp_path: temporary directory standing in for /sys/fs/cgroup
+    :return: None
+    """
+    assert cpu_limit(str(tmp_path)) is None
+    assert memory_limit(str(tmp_path)) is None
+    (tmp_path / 'cpu').mkdir()
+    (tmp_path / 'memory').mkdir()
+    (tmp_path / 'cpu' / 'cpu.cfs_quota_us').write_text('-1\n')
+    (tmp_path / 'cpu' / 'cpu.cfs_period_us').write_text('100000\n')
+    (tmp_path / 'memory' / 'memory.limit_in_bytes').write_text('9223372036854771712\n')
+    assert cpu_limit(str(tmp_path)) is None
+    assert memory_limit(str(tmp_path)) is None
+    (tmp_path / 'cpu' / 'cpu.cfs_quota_us').write_text('250000\n')
+    (tmp_path / 'memory' / 'memory.limit_in_bytes').write_text('536870912\n')
+    assert cpu_limit(str(tmp_path)) == 2.5
+    assert memory_limit(str(tmp_path)) == 512
+
+
+def test_worker_settings():
+    """
+    Workers and threads follow the CPU and memory limits
+    :return: None
+    """
+    assert worker_settings(cpus=0.2, memory_mb=128) == {'workers': 1, 'threads': 2}
+    assert worker_settings(cpus=4, memory_mb=None) == {'workers': 9, 'threads': 4}
+    assert worker_settings(cpus=4, memory_mb=256) == {'workers': 3, 'threads': 4}
+    assert worker_settings(cpus=4, memory_mb=64) == {'workers': 1, 'threads': 4}
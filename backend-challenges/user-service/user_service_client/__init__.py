@@ -0,0 +1,20 @@
+"""
+Client of the user service.
+
+    from user_service_client import HTTPTransport, UserServiceClient
+
+    with UserServiceClient(HTTPTransport('http://localhost:5000')) as client:
+        user_id = client.add_user('jane', 'doe', 'jane@doe.de', '123')
+        user = client.get_user(user_id)
+
+The sync client only needs the standard library, the async client needs
+aiohttp.
+"""
+# module imports
+from .client import ApiError, AsyncUserServiceClient, Retry, UserNotFound, UserServiceClient
+from .transport import AsyncHTTPTransport, AsyncInProcessTransport, HTTPTransport, InProcessTransport, \
+    TransportError
+
+__all__ = ['ApiError', 'AsyncHTTPTransport', 'AsyncInProcessTransport', 'AsyncUserServiceClient',
+           'HTTPTransport', 'InProcessTransport', 'Retry', 'TransportError', 'UserNotFound',
+           'UserServiceClient']
@@ -0,0 +1,503 @@
+"""
+Sync and async clients of the user service.
+
+Both clients build the same calls; they only differ in how they wait. Calls
+that fail on the transport or with 429, 502, 503 or 504 are retried with
+exponential backoff and full jitter, as long as they are idempotent (all
+reads; writes, including deletes, are only sent once). Concurrent get_user() calls are
+collected for a short window and sent as one request to /batch/, with
+identical ids fetched once.
+"""
+# module imports
+import asyncio
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from urllib.parse import urlencode
+from .transport import TransportError
+
+RETRY_STATUS = (429, 502, 503, 504)
+# seconds concurrent lookups are collected before they are sent together
+BATCH_WINDOW = 0.002
+# the service accepts at most 100 operations per batch
+MAX_BATCH = 100
+
+# a call of the API: the request, whether it may be retried and how the response is turned into a result
+Call = namedtuple('Call', ['method', 'path', 'body', 'idempotent', 'parse'])
+
+
+class ApiError(Exception):
+    """
+    Raised when the service answers with an error
+    """
+    def __init__(self, status, code, message):
+        super(ApiError, self).__init__('%s (%s, HTTP %d)' % (message, code, status))
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class UserNotFound(ApiError):
+    """
+    Raised when a user does not exist
+    """
+
+
+def _check(status, body):
+    """
+    Raise the error of a failed response
+
+    :param status: the HTTP status code
+    :param body: the decoded body
+    :return: the decoded body
+    """
+    if status < 400:
+        return body
+    error = (body or {}).get('error') or {}
+    code = error.get('code', 'http_%d' % status)
+    error_class = UserNotFound if code == 'user_not_found' else ApiError
+    raise error_class(status, code, error.get('message', 'The request failed'))
+
+
+def _data(status, body):
+    """
+    The data of a successful response
+
+    :param status: the HTTP status code
+    :param body: the decoded body
+    :return: the data
+    """
+    return _check(status, body).get('data')
+
+
+def _parse_batch(user_ids):
+    """
+    Parser of a batch of user lookups
+
+    :param user_ids: the user ids, in the order of the operations
+    :return: function turning the response into a dict of user id to the user or the ApiError
+    """
+    def parse(status, body):
+        results = _data(status, body)['results']
+        users = {}
+        for user_id, result in zip(user_ids, results):
+            try:
+                users[user_id] = _data(result['status'], result['body'])
+            except ApiError as error:
+                users[user_id] = error
+        return users
+    return parse
+
+
+def get_user_call(user_id):
+    """
+    :param user_id: the user id
+    :return: the Call looking up a user
+    """
+    return Call('GET', '/user/%d/' % user_id, None, True, _data)
+
+
+def get_users_call(user_ids):
+    """
+    :param user_ids: list of at most MAX_BATCH user ids
+    :return: the Call looking up several users in one batch request
+    """
+    operations = [{"method": "GET", "path": "/user/%d/" % user_id} for user_id in user_ids]
+    # savepoint mode: a user that does not exist does not fail the others
+    return Call('POST', '/batch/', {"mode": "savepoint", "operations": operations}, True, _parse_batch(user_ids))
+
+
+def find_users_call(first_name, last_name):
+    """
+    :param first_name: the first name
+    :param last_name: the last name
+    :return: the Call looking up users by name
+    """
+    query = urlencode({'first_name': first_name, 'last_name': last_name})
+    return Call('GET', '/user?' + query, None, True, _data)
+
+
+def add_user_call(first_name, last_name, mail, phone):
+    """
+    :return: the Call adding a user, its result is the id of the new user
+    """
+    body = {"first_name": first_name, "last_name": last_name, "mail": mail, "phone": phone}
+    return Call('POST', '/user/add/', body, False, lambda status, body: _data(status, body)['id'])
+
+
+def add_mail_call(user_id, mail):
+    """
+    :return: the Call adding an email to a user
+    """
+    return Call('POST', '/user/add/mail/', {"id": user_id, "mail": mail}, False, _check)
+
+
+def add_phone_call(user_id, phone):
+    """
+    :return: the Call adding a phone number to a user
+    """
+    return Call('POST', '/user/add/phone/', {"id": user_id, "phone": phone}, False, _check)
+
+
+def delete_user_call(user_id):
+    """
+    :return: the Call deleting a user
+    """
+    # not retried: if the response of the first attempt was lost, a retry fails with UserNotFound
+    return Call('DELETE', '/user/del/', {"id": user_id}, False, _check)
+
+
+class Retry(object):
+    """
+    How often and how long to wait before a failed call is retried
+    """
+    def __init__(self, attempts=3, backoff=0.05, max_backoff=2.0):
+        """
+        :param attempts: maximum number of attempts of a call
+        :param backoff: the delay before the first retry is up to this many seconds
+        :param max_backoff: upper bound of the delay in seconds
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        """
+        The delay before the next attempt, with full jitter
+
+        :param attempt: the number of the failed attempt, starting at 1
+        :return: seconds to wait
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def should_retry(self, call, attempt, status=None):
+        """
+        Whether a failed call is sent again
+
+        :param call: the Call
+        :param attempt: the number of the failed attempt, starting at 1
+        :param status: the status code of the response, None if the transport failed
+        :return: True to retry
+        """
+        return call.idempotent and attempt < self.attempts and (status is None or status in RETRY_STATUS)
+
+
+class UserServiceClient(object):
+    """
+    Client of the user service for threaded code. It can be shared by
+    threads; concurrent get_user() calls are sent together.
+    """
+    def __init__(self, transport, retry=None, batch_window=BATCH_WINDOW):
+        """
+        :param transport: HTTPTransport or InProcessTransport
+        :param retry: the Retry policy
+        :param batch_window: seconds concurrent lookups are collected, 0 to send every lookup on its own
+        """
+        self.transport = transport
+        self.retry = retry or Retry()
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        # user id -> Future of the lookups waiting for the next batch
+        self._pending = {}
+
+    def call(self, call):
+        """
+        Send a call, with retries
+
+        :param call: the Call
+        :return: the result of the call
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                status, body = self.transport.request(call.method, call.path, call.body)
+            except TransportError:
+                if not self.retry.should_retry(call, attempt):
+                    raise
+            else:
+                if not self.retry.should_retry(call, attempt, status):
+                    return call.parse(status, body)
+            time.sleep(self.retry.delay(attempt))
+
+    def get_user(self, user_id):
+        """
+        Look up a user. Lookups of concurrent threads are sent in one request.
+
+        :param user_id: the user id
+        :return: dict with the user info
+        """
+        if not self.batch_window:
+            return self.call(get_user_call(user_id))
+        with self._lock:
+            leader = not self._pending
+            future = self._pending.get(user_id)
+            if future is None:
+                future = self._pending[user_id] = Future()
+        if leader:
+            # the first lookup waits for others and sends them all
+            time.sleep(self.batch_window)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            self._send(pending)
+        return future.result()
+
+    def _send(self, pending):
+        """
+        Send collected lookups and resolve their futures
+
+        :param pending: dict of user id to Future
+        :return: None
+        """
+        user_ids = list(pending)
+        for start in range(0, len(user_ids), MAX_BATCH):
+            chunk = user_ids[start:start + MAX_BATCH]
+            try:
+                if len(chunk) == 1:
+                    results = {chunk[0]: self.call(get_user_call(chunk[0]))}
+                else:
+                    results = self.call(get_users_call(chunk))
+            except Exception as error:
+                results = {user_id: error for user_id in chunk}
+            for user_id in chunk:
+                _resolve(pending[user_id], results[user_id])
+
+    def get_users(self, user_ids):
+        """
+        Look up several users with one request per MAX_BATCH users
+
+        :param user_ids: list of user ids
+        :return: dict of user id to the user info, None for users that do not exist
+        """
+        users = {}
+        user_ids = list(dict.fromkeys(user_ids))
+        for start in range(0, len(user_ids), MAX_BATCH):
+            for user_id, user in self.call(get_users_call(user_ids[start:start + MAX_BATCH])).items():
+                users[user_id] = _user_or_none(user)
+        return users
+
+    def find_users(self, first_name, last_name):
+        """
+        :return: list of the users with the name
+        """
+        return self.call(find_users_call(first_name, last_name))
+
+    def add_user(self, first_name, last_name, mail, phone):
+        """
+        :return: the id of the new user
+        """
+        return self.call(add_user_call(first_name, last_name, mail, phone))
+
+    def add_mail(self, user_id, mail):
+        """
+        :return: None
+        """
+        self.call(add_mail_call(user_id, mail))
+
+    def add_phone(self, user_id, phone):
+        """
+        :return: None
+        """
+        self.call(add_phone_call(user_id, phone))
+
+    def delete_user(self, user_id):
+        """
+        :return: None
+        """
+        self.call(delete_user_call(user_id))
+
+    def close(self):
+        """
+        Close the connections of the transport
+
+        :return: None
+        """
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncUserServiceClient(object):
+    """
+    Client of the user service for asyncio. Concurrent get_user() calls of
+    the event loop are sent together.
+    """
+    def __init__(self, transport, retry=None, batch_window=BATCH_WINDOW):
+        """
+        :param transport: AsyncHTTPTransport or AsyncInProcessTransport
+        :param retry: the Retry policy
+        :param batch_window: seconds concurrent lookups are collected, 0 to send every lookup on its own
+        """
+        self.transport = transport
+        self.retry = retry or Retry()
+        self.batch_window = batch_window
+        # user id -> asyncio.Future of the lookups waiting for the next batch
+        self._pending = {}
+        # the event loop only keeps weak references to tasks
+        self._tasks = set()
+
+    async def call(self, call):
+        """
+        Send a call, with retries
+
+        :param call: the Call
+        :return: the result of the call
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                status, body = await self.transport.request(call.method, call.path, call.body)
+            except TransportError:
+                if not self.retry.should_retry(call, attempt):
+                    raise
+            else:
+                if not self.retry.should_retry(call, attempt, status):
+                    return call.parse(status, body)
+            await asyncio.sleep(self.retry.delay(attempt))
+
+    async def get_user(self, user_id):
+        """
+        Look up a user. Concurrent lookups are sent in one request.
+
+        :param user_id: the user id
+        :return: dict with the user info
+        """
+        if not self.batch_window:
+            return await self.call(get_user_call(user_id))
+        future = self._pending.get(user_id)
+        if future is None:
+            if not self._pending:
+                asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+            future = self._pending[user_id] = asyncio.get_running_loop().create_future()
+        # shield: a cancelled caller must not cancel the lookup of the others
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        """
+        Send the collected lookups
+
+        :return: None
+        """
+        pending, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._send(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, pending):
+        """
+        Send collected lookups and resolve their futures
+
+        :param pending: dict of user id to asyncio.Future
+        :return: None
+        """
+        user_ids = list(pending)
+        chunks = [user_ids[start:start + MAX_BATCH] for start in range(0, len(user_ids), MAX_BATCH)]
+        for chunk, results in zip(chunks, await asyncio.gather(
+                *(self._send_chunk(chunk) for chunk in chunks), return_exceptions=True)):
+            for user_id in chunk:
+                _resolve(pending[user_id], results[user_id] if isinstance(results, dict) else results)
+
+    async def _send_chunk(self, chunk):
+        """
+        :param chunk: list of at most MAX_BATCH user ids
+        :return: dict of user id to the user or the ApiError
+        """
+        if len(chunk) == 1:
+            try:
+                return {chunk[0]: await self.call(get_user_call(chunk[0]))}
+            except ApiError as error:
+                return {chunk[0]: error}
+        return await self.call(get_users_call(chunk))
+
+    async def get_users(self, user_ids):
+        """
+        Look up several users with one request per MAX_BATCH users
+
+        :param user_ids: list of user ids
+        :return: dict of user id to the user info, None for users that do not exist
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        users = {}
+        for results in await asyncio.gather(*(self.call(get_users_call(user_ids[start:start + MAX_BATCH]))
+                                              for start in range(0, len(user_ids), MAX_BATCH))):
+            users.update((user_id, _user_or_none(user)) for user_id, user in results.items())
+        return users
+
+    async def find_users(self, first_name, last_name):
+        """
+        :return: list of the users with the name
+        """
+        return await self.call(find_users_call(first_name, last_name))
+
+    async def add_user(self, first_name, last_name, mail, phone):
+        """
+        :return: the id of the new user
+        """
+        return await self.call(add_user_call(first_name, last_name, mail, phone))
+
+    async def add_mail(self, user_id, mail):
+        """
+        :return: None
+        """
+        await self.call(add_mail_call(user_id, mail))
+
+    async def add_phone(self, user_id, phone):
+        """
+        :return: None
+        """
+        await self.call(add_phone_call(user_id, phone))
+
+    async def delete_user(self, user_id):
+        """
+        :return: None
+        """
+        await self.call(delete_user_call(user_id))
+
+    async def close(self):
+        """
+        Close the connections of the transport
+
+        :return: None
+        """
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _resolve(future, result):
+    """
+    Set the result of a lookup future
+
+    :param future: a concurrent or asyncio Future
+    :param result: the user, or an exception
+    :return: None
+    """
+    if future.done():
+        return
+    if isinstance(result, BaseException):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+def _user_or_none(user):
+    """
+    :param user: the user or the ApiError of a batch lookup
+    :return: the user, or None if it does not exist
+    """
+    if isinstance(user, UserNotFound):
+        return None
+    if isinstance(user, ApiError):
+        raise user
+    return user
@@ -0,0 +1,286 @@
+"""
+Transports of the user-service client: how a request reaches the service.
+
+A transport sends one request and returns the status code and the decoded
+JSON body. The HTTP transports keep their connections alive and reuse them
+(a pool of http.client connections for the sync client, an aiohttp
+connector for the async one). The in-process transports call an app
+created with create_app directly, for tests and benchmarks.
+"""
+# module imports
+import asyncio
+import http.client
+import json
+import queue
+import select
+from urllib.parse import urlsplit
+
+# seconds the async transport keeps idle connections, shorter than the keepalive of gunicorn.conf.py
+KEEPALIVE_TIMEOUT = 30
+# errors of http.client when a connection fails, times out or is closed by the server
+_CONNECTION_ERRORS = (OSError, http.client.HTTPException)
+# errors of a kept-alive connection the server closed before it read the request
+# (RemoteDisconnected, the server closed without sending a status line, is a ConnectionResetError)
+_CLOSED_ERRORS = (BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+
+class TransportError(Exception):
+    """
+    Raised when a request could not be sent or its response not be read.
+    These errors are retried by the clients.
+    """
+
+
+def _closed_by_server(connection):
+    """
+    Whether the server closed an idle kept-alive connection. An idle
+    connection has nothing to read, unless the server closed it (or sent
+    something it should not have), so it is checked without blocking.
+
+    :param connection: the http.client connection
+    :return: True if the connection can not be reused
+    """
+    if connection.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def _decode(data):
+    """
+    Decode a JSON response body
+
+    :param data: the body as bytes
+    :return: the decoded body, or None if it is not JSON
+    """
+    try:
+        return json.loads(data) if data else None
+    except ValueError:
+        return None
+
+
+class HTTPTransport(object):
+    """
+    Sends requests over a pool of keep-alive HTTP connections. The transport
+    can be shared by threads; every thread takes a connection from the pool
+    for the duration of a request. Servers close idle connections after a
+    while (gunicorn after its keepalive setting), such connections are
+    dropped from the pool instead of being reused.
+    """
+    def __init__(self, base_url, pool_size=10, timeout=5.0):
+        """
+        :param base_url: the URL of the service, e.g. http://localhost:5000
+        :param pool_size: maximum number of idle connections kept
+        :param timeout: seconds to wait for the connection and for every read
+        """
+        url = urlsplit(base_url)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self._host = url.hostname
+        self._port = url.port
+        self._prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # number of connections opened, to check that they are reused
+        self.connections_opened = 0
+
+    def _connect(self):
+        """
+        Create a new connection, it is opened by its first request
+
+        :return: the connection
+        """
+        self.connections_opened += 1
+        return self._connection_class(self._host, self._port, timeout=self.timeout)
+
+    def _acquire(self):
+        """
+        Take an idle connection from the pool that the server did not close,
+        or open a new one
+
+        :return: the connection
+        """
+        while True:
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if not _closed_by_server(connection):
+                return connection
+            connection.close()
+
+    def _release(self, connection):
+        """
+        Put a connection back into the pool, or close it if the pool is full
+
+        :param connection: the connection
+        :return: None
+        """
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, body=None):
+        """
+        Send a request
+
+        :param method: the HTTP method
+        :param path: the path of the request, with the query string
+        :param body: the JSON body, or None
+        :return: tuple of the status code and the decoded body
+        """
+        connection = self._acquire()
+        headers = {'Accept': 'application/json'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        reused = connection.sock is not None
+        try:
+            try:
+                connection.request(method, self._prefix + path, body=payload, headers=headers)
+                response = connection.getresponse()
+            except _CLOSED_ERRORS:
+                if not reused:
+                    raise
+                # the server closed the idle connection after it was checked and did not answer, the
+                # request is sent once more on a new connection (also writes, they were not processed)
+                connection.close()
+                connection = self._connect()
+                connection.request(method, self._prefix + path, body=payload, headers=headers)
+                response = connection.getresponse()
+            data = response.read()
+        except _CONNECTION_ERRORS as error:
+            connection.close()
+            raise TransportError('%s %s failed: %s' % (method, path, error))
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return response.status, _decode(data)
+
+    def close(self):
+        """
+        Close the idle connections
+
+        :return: None
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class InProcessTransport(object):
+    """
+    Calls an app in the same process, without a network, through the test
+    client of Flask
+    """
+    def __init__(self, app):
+        """
+        :param app: the Flask app, e.g. from create_app
+        """
+        self.app = app
+        self._client = app.test_client(use_cookies=False)
+
+    def request(self, method, path, body=None):
+        """
+        Send a request
+
+        :param method: the HTTP method
+        :param path: the path of the request, with the query string
+        :param body: the JSON body, or None
+        :return: tuple of the status code and the decoded body
+        """
+        response = self._client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+    def close(self):
+        """
+        Nothing to close
+
+        :return: None
+        """
+
+
+class AsyncHTTPTransport(object):
+    """
+    Sends requests with aiohttp over a pool of keep-alive connections. The
+    session is created on the first request, in the running event loop.
+    """
+    def __init__(self, base_url, pool_size=10, timeout=5.0):
+        """
+        :param base_url: the URL of the service, e.g. http://localhost:5000
+        :param pool_size: maximum number of connections
+        :param timeout: seconds a request may take in total
+        """
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+
+    async def request(self, method, path, body=None):
+        """
+        Send a request
+
+        :param method: the HTTP method
+        :param path: the path of the request, with the query string
+        :param body: the JSON body, or None
+        :return: tuple of the status code and the decoded body
+        """
+        # aiohttp is only needed by the async client
+        import aiohttp
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=KEEPALIVE_TIMEOUT),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            async with self._session.request(method, self.base_url + path, json=body) as response:
+                return response.status, _decode(await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise TransportError('%s %s failed: %r' % (method, path, error))
+
+    async def close(self):
+        """
+        Close the session and its connections
+
+        :return: None
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncInProcessTransport(object):
+    """
+    Calls an app in the same process from the event loop. The app runs in
+    the default executor, so the event loop is not blocked.
+    """
+    def __init__(self, app):
+        """
+        :param app: the Flask app, e.g. from create_app
+        """
+        self._transport = InProcessTransport(app)
+
+    async def request(self, method, path, body=None):
+        """
+        Send a request
+
+        :param method: the HTTP method
+        :param path: the path of the request, with the query string
+        :param body: the JSON body, or None
+        :return: tuple of the status code and the decoded body
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._transport.request, method, path, body)
+
+    async def close(self):
+        """
+        Nothing to close
+
+        :return: None
+        """
@@ -0,0 +1,12 @@
+"""
+WSGI entry point for gunicorn, see gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The config file can be chosen with the USER_SERVICE_CONFIG environment variable.
+"""
+# module imports
+import os
+from app import create_app
+
+app = create_app(os.environ.get('USER_SERVICE_CONFIG', 'config.py'))
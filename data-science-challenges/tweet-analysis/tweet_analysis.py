@@ -0,0 +1,528 @@
+"""
+Tweet analysis: counts every word among all tweets and computes the median
+number of unique words per tweet.
+
+The source file is read line by line (one tweet per line). Large files are
+split into byte ranges that are processed in parallel by a process pool;
+the partial results are mergeable counters, so memory only grows with the
+vocabulary. The median is exact: the number of unique words per tweet is a
+small integer, so a histogram of those numbers is kept instead of a list of
+all of them.
+
+In incremental mode (--checkpoint) the statistics and the byte offset that
+was processed are stored in a checkpoint file, so every run only reads the
+tweets appended since the previous one; with --follow the file is polled
+for new tweets like ``tail -f``.
+
+Usage:
+
+    python tweet_analysis.py tweets.txt --words word_count.txt --median median_unique.txt
+    python tweet_analysis.py tweets.txt --checkpoint state.json --follow
+"""
+# module imports
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import unicodedata
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# files smaller than one shard are processed without a process pool
+SHARD_SIZE = 32 * 1024 * 1024
+DEFAULT_WORDS_FILE = 'word_count.txt'
+DEFAULT_MEDIAN_FILE = 'median_unique.txt'
+# maximum number of appended bytes processed before the outputs are rewritten
+TAIL_BATCH_SIZE = 256 * 1024 * 1024
+# number of bytes at the start of the file used to recognize it after a rotation
+FINGERPRINT_SIZE = 4096
+CHECKPOINT_VERSION = 1
+
+# a token is a URL, a number like 2,2 or 50.000, or a word, hashtag or mention
+# (umlauts and other letters are matched by \w, words may contain - and ')
+_TOKEN = re.compile(r"https?://[^\s…]+|\d+(?:[.,:]\d+)+|[#@]?\w+(?:['’-]\w+)*")
+# invisible characters that may appear inside words: soft hyphen, zero width
+# characters and directional marks
+_INVISIBLE = dict.fromkeys(map(ord, '\u00ad\u200b\u200c\u200d\u200e\u200f\u2066\u2067\u2068\u2069\ufeff'))
+
+
+def tokenize(text):
+    """
+    Split a tweet into words. URLs are kept as they are, every other token is
+    lower-cased; hashtags and mentions keep their # and @ prefix.
+
+    :param text: the tweet
+    :return: list of tokens
+    """
+    if not text.isascii():
+        text = unicodedata.normalize('NFC', text).translate(_INVISIBLE)
+    if 'http' not in text:
+        # no URL, so the whole line can be lower-cased at once
+        return _TOKEN.findall(text.lower())
+    return [token if token.startswith(('http://', 'https://')) else token.lower()
+            for token in _TOKEN.findall(text)]
+
+
+class TweetStats(object):
+    """
+    Mergeable statistics of a set of tweets: the count of every word, and a
+    histogram mapping a number of unique words to the number of tweets with
+    that many unique words.
+    """
+    def __init__(self):
+        self.word_counts = Counter()
+        self.unique_histogram = Counter()
+
+    @property
+    def tweets(self):
+        """
+        The number of tweets seen
+
+        :return: the number of tweets
+        """
+        return sum(self.unique_histogram.values())
+
+    def add(self, text):
+        """
+        Add one tweet. Empty lines are not counted as tweets.
+
+        :param text: the tweet
+        :return: None
+        """
+        tokens = tokenize(text)
+        if not tokens and not text.strip():
+            return
+        self.word_counts.update(tokens)
+        self.unique_histogram[len(set(tokens))] += 1
+
+    def merge(self, other):
+        """
+        Add the statistics of another instance to this one
+
+        :param other: the TweetStats to merge
+        :return: this instance
+        """
+        self.word_counts.update(other.word_counts)
+        self.unique_histogram.update(other.unique_histogram)
+        return self
+
+    def median(self):
+        """
+        The exact median number of unique words per tweet. For an even number
+        of tweets this is the mean of the two middle values.
+
+        :return: the median, or 0.0 if there are no tweets
+        """
+        total = self.tweets
+        if not total:
+            return 0.0
+        # zero-based positions of the middle value(s)
+        lower, upper = (total - 1) // 2, total // 2
+        lower_value = None
+        seen = 0
+        for value in sorted(self.unique_histogram):
+            seen += self.unique_histogram[value]
+            if lower_value is None and seen > lower:
+                lower_value = value
+            if seen > upper:
+                return (lower_value + value) / 2.0
+
+    def to_dict(self):
+        """
+        Convert the statistics into a JSON serializable dict
+
+        :return: the dict
+        """
+        return {'words': dict(self.word_counts),
+                'unique_histogram': {str(value): count for value, count in self.unique_histogram.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create an instance from the result of to_dict()
+
+        :param data: the dict
+        :return: the TweetStats
+        """
+        stats = cls()
+        stats.word_counts.update(data['words'])
+        stats.unique_histogram.update({int(value): count for value, count in data['unique_histogram'].items()})
+        return stats
+
+
+def read_lines(path, start=0, end=None):
+    """
+    Read the tweets of a byte range of the file. A range owns the lines that
+    start within it, so consecutive ranges read every line exactly once.
+
+    :param path: the tweets file
+    :param start: the first byte of the range
+    :param end: the end of the range (exclusive), None for the end of the file
+    :return: generator of the decoded lines without line breaks
+    """
+    with open(path, 'rb') as stream:
+        position = start
+        if start > 0:
+            # skip the line that started in the previous range
+            stream.seek(start - 1)
+            position = start - 1 + len(stream.readline())
+        for line in stream:
+            if end is not None and position >= end:
+                return
+            position += len(line)
+            yield line.rstrip(b'\r\n').decode('utf-8', errors='replace')
+
+
+def analyze_range(path, start=0, end=None):
+    """
+    Compute the statistics of a byte range of the file
+
+    :param path: the tweets file
+    :param start: the first byte of the range
+    :param end: the end of the range (exclusive), None for the end of the file
+    :return: the TweetStats of the range
+    """
+    stats = TweetStats()
+    for line in read_lines(path, start, end):
+        stats.add(line)
+    return stats
+
+
+def shard_ranges(start, end, shard_size):
+    """
+    Split a byte range into shards
+
+    :param start: the first byte
+    :param end: the end of the range (exclusive)
+    :param shard_size: the maximum number of bytes per shard
+    :return: list of (start, end) tuples
+    """
+    return [(offset, min(offset + shard_size, end)) for offset in range(start, end, shard_size)]
+
+
+def analyze(path, workers=None, shard_size=SHARD_SIZE, start=0, end=None):
+    """
+    Compute the statistics of a tweets file, in parallel if it is larger than
+    one shard
+
+    :param path: the tweets file
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param shard_size: number of bytes processed per task
+    :param start: the first byte to analyze
+    :param end: the end of the part to analyze (exclusive), None for the end of the file
+    :return: the TweetStats of the file
+    """
+    if end is None:
+        end = os.path.getsize(path)
+    shards = shard_ranges(start, end, shard_size)
+    workers = workers or os.cpu_count() or 1
+    stats = TweetStats()
+    if len(shards) <= 1 or workers == 1:
+        for shard_start, shard_end in shards:
+            stats.merge(analyze_range(path, shard_start, shard_end))
+        return stats
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        for partial in executor.map(analyze_range, [path] * len(shards),
+                                    [shard[0] for shard in shards], [shard[1] for shard in shards]):
+            stats.merge(partial)
+    return stats
+
+
+def write_word_counts(stats, stream):
+    """
+    Write every word with its count, most frequent words first
+
+    :param stats: the TweetStats
+    :param stream: the text file object to write to
+    :return: None
+    """
+    for word, count in sorted(stats.word_counts.items(), key=lambda item: (-item[1], item[0])):
+        stream.write('%s\t%d\n' % (word, count))
+
+
+def write_median(stats, stream):
+    """
+    Write the median number of unique words per tweet
+
+    :param stats: the TweetStats
+    :param stream: the text file object to write to
+    :return: None
+    """
+    stream.write('%.2f\n' % stats.median())
+
+
+def atomic_write(path, write):
+    """
+    Write a file atomically: the content is written to a temporary file in the
+    same directory, which then replaces the target
+
+    :param path: the file to write
+    :param write: function writing the content to the text file object it is given
+    :return: None
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(prefix='.' + os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as stream:
+            write(stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+        # keep the permissions of the file that is replaced (mkstemp creates it private)
+        os.chmod(temporary, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def write_outputs(stats, words_path, median_path):
+    """
+    Atomically rewrite both output files
+
+    :param stats: the TweetStats
+    :param words_path: output file for the word counts
+    :param median_path: output file for the median
+    :return: None
+    """
+    atomic_write(words_path, lambda stream: write_word_counts(stats, stream))
+    atomic_write(median_path, lambda stream: write_median(stats, stream))
+
+
+def fingerprint(path, length):
+    """
+    Hash of the first bytes of a file
+
+    :param path: the file
+    :param length: number of bytes to hash
+    :return: the hex digest
+    """
+    with open(path, 'rb') as stream:
+        return hashlib.sha1(stream.read(length)).hexdigest()
+
+
+def last_line_end(path, start, end):
+    """
+    Find the end of the last complete line in a byte range. A line that is
+    still being written (no line break yet) is left for the next run.
+
+    :param path: the file
+    :param start: the first byte of the range
+    :param end: the end of the range (exclusive)
+    :return: the offset after the last line break in the range, or start if there is none
+    """
+    with open(path, 'rb') as stream:
+        position = end
+        while position > start:
+            size = min(64 * 1024, position - start)
+            stream.seek(position - size)
+            index = stream.read(size).rfind(b'\n')
+            if index >= 0:
+                return position - size + index + 1
+            position -= size
+    return start
+
+
+def next_line_end(path, start, end):
+    """
+    Find the end of the first complete line in a byte range
+
+    :param path: the file
+    :param start: the first byte of the range
+    :param end: the end of the range (exclusive)
+    :return: the offset after the first line break in the range, or start if there is none
+    """
+    with open(path, 'rb') as stream:
+        stream.seek(start)
+        position = start
+        while position < end:
+            data = stream.read(min(64 * 1024, end - position))
+            if not data:
+                break
+            index = data.find(b'\n')
+            if index >= 0:
+                return position + index + 1
+            position += len(data)
+    return start
+
+
+class Checkpoint(object):
+    """
+    The state of an incremental analysis: the statistics of all tweets read so
+    far, the offset up to which the source file was read and what is needed to
+    recognize the source file again (device, inode and a hash of its start).
+    """
+    def __init__(self, stats=None, offset=0, device=None, inode=None, head_hash=None):
+        self.stats = stats if stats is not None else TweetStats()
+        self.offset = offset
+        self.device = device
+        self.inode = inode
+        self.head_hash = head_hash
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a checkpoint file, or start a new checkpoint if it does not exist
+
+        :param path: the checkpoint file
+        :return: the Checkpoint
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding='utf-8') as stream:
+            data = json.load(stream)
+        if data.get('version') != CHECKPOINT_VERSION:
+            raise ValueError('Unsupported checkpoint version: %r' % data.get('version'))
+        return cls(TweetStats.from_dict(data['stats']), data['offset'], data['device'], data['inode'],
+                   data['head_hash'])
+
+    def save(self, path):
+        """
+        Atomically write the checkpoint file
+
+        :param path: the checkpoint file
+        :return: None
+        """
+        data = {'version': CHECKPOINT_VERSION, 'offset': self.offset, 'device': self.device,
+                'inode': self.inode, 'head_hash': self.head_hash, 'stats': self.stats.to_dict()}
+        atomic_write(path, lambda stream: json.dump(data, stream, ensure_ascii=False, separators=(',', ':')))
+
+    def source_changed(self, path):
+        """
+        Check whether the source file was truncated or replaced (rotated) since
+        the checkpoint was written
+
+        :param path: the source file
+        :return: True if the file has to be read from the start again
+        """
+        if self.offset == 0:
+            return False
+        status = os.stat(path)
+        if (status.st_dev, status.st_ino) != (self.device, self.inode) or status.st_size < self.offset:
+            return True
+        return fingerprint(path, min(self.offset, FINGERPRINT_SIZE)) != self.head_hash
+
+    def advance(self, path, stats, offset):
+        """
+        Add the statistics of newly read tweets
+
+        :param path: the source file
+        :param stats: the TweetStats of the new tweets
+        :param offset: the offset up to which the file was read
+        :return: None
+        """
+        status = os.stat(path)
+        if self.offset < FINGERPRINT_SIZE or self.head_hash is None:
+            self.head_hash = fingerprint(path, min(offset, FINGERPRINT_SIZE))
+        self.stats.merge(stats)
+        self.offset = offset
+        self.device, self.inode = status.st_dev, status.st_ino
+
+
+def tail(path, checkpoint_path, words_path, median_path, workers=None, shard_size=SHARD_SIZE,
+         batch_size=TAIL_BATCH_SIZE, checkpoint=None):
+    """
+    Process the tweets appended to the source file since the last run. After
+    every batch the checkpoint and both output files are rewritten atomically.
+
+    If the source file was truncated or rotated, the new file is read from its
+    start; the statistics of the tweets read before are kept.
+
+    :param path: the tweets file
+    :param checkpoint_path: the checkpoint file
+    :param words_path: output file for the word counts
+    :param median_path: output file for the median
+    :param workers: number of worker processes
+    :param shard_size: number of bytes processed per task
+    :param batch_size: maximum number of bytes processed per batch, unless a single line is longer
+    :param checkpoint: the Checkpoint returned by the previous call, None to load it from the checkpoint file
+    :return: the Checkpoint after the last batch
+    """
+    if checkpoint is None:
+        checkpoint = Checkpoint.load(checkpoint_path)
+        # the outputs may be older than the checkpoint if the last run was interrupted
+        write_outputs(checkpoint.stats, words_path, median_path)
+    if checkpoint.source_changed(path):
+        checkpoint.offset, checkpoint.head_hash = 0, None
+    while True:
+        size = os.path.getsize(path)
+        end = last_line_end(path, checkpoint.offset, min(size, checkpoint.offset + batch_size))
+        if end == checkpoint.offset and size > checkpoint.offset + batch_size:
+            # a line longer than a batch is processed on its own once it is complete
+            end = next_line_end(path, checkpoint.offset, size)
+        if end == checkpoint.offset:
+            return checkpoint
+        checkpoint.advance(path, analyze(path, workers, shard_size, checkpoint.offset, end), end)
+        # the checkpoint is the source of truth, the outputs are derived from it
+        checkpoint.save(checkpoint_path)
+        write_outputs(checkpoint.stats, words_path, median_path)
+
+
+def follow(path, checkpoint_path, words_path, median_path, interval=1.0, workers=None, shard_size=SHARD_SIZE,
+           batch_size=TAIL_BATCH_SIZE):
+    """
+    Keep processing new tweets as they are appended to the source file,
+    until interrupted
+
+    :param path: the tweets file
+    :param checkpoint_path: the checkpoint file
+    :param words_path: output file for the word counts
+    :param median_path: output file for the median
+    :param interval: seconds to wait before looking for new tweets again
+    :param workers: number of worker processes
+    :param shard_size: number of bytes processed per task
+    :param batch_size: maximum number of bytes processed per batch
+    :return: None
+    """
+    checkpoint = None
+    while True:
+        if os.path.exists(path):
+            checkpoint = tail(path, checkpoint_path, words_path, median_path, workers, shard_size, batch_size,
+                              checkpoint)
+        time.sleep(interval)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    :param argv: the command line arguments
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description='Count words and the median of unique words per tweet.')
+    parser.add_argument('tweets', help='the tweets file, one tweet per line')
+    parser.add_argument('--words', default=DEFAULT_WORDS_FILE, help='output file for the word counts')
+    parser.add_argument('--median', default=DEFAULT_MEDIAN_FILE, help='output file for the median')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help='bytes processed per task')
+    parser.add_argument('--checkpoint', help='checkpoint file, only tweets appended since the last run are read')
+    parser.add_argument('--follow', action='store_true', help='keep polling for new tweets (needs --checkpoint)')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls with --follow')
+    parser.add_argument('--batch-size', type=int, default=TAIL_BATCH_SIZE,
+                        help='bytes read before the outputs are rewritten with --checkpoint')
+    args = parser.parse_args(argv)
+
+    if args.follow and not args.checkpoint:
+        parser.error('--follow requires --checkpoint')
+    if args.follow:
+        try:
+            follow(args.tweets, args.checkpoint, args.words, args.median, args.interval, args.workers,
+                   args.shard_size, args.batch_size)
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.checkpoint:
+        tail(args.tweets, args.checkpoint, args.words, args.median, args.workers, args.shard_size,
+             args.batch_size)
+        return
+    stats = analyze(args.tweets, args.workers, args.shard_size)
+    with open(args.words, 'w', encoding='utf-8') as stream:
+        write_word_counts(stats, stream)
+    with open(args.median, 'w', encoding='utf-8') as stream:
+        write_median(stats, stream)
+
+
+if __name__ == '__main__':
+    main()
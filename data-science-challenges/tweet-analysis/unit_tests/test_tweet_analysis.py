@@ -0,0 +1,169 @@
+import os
+import statistics
+import pytest
+from tweet_analysis import Checkpoint, TweetStats, analyze, main, read_lines, tail, tokenize
+
+TWEETS = os.path.join(os.path.dirname(__file__), '..', 'tweets.txt')
+
+
+def test_tokenize():
+    """
+    Hashtags, mentions, URLs and umlauts are kept together and words are lower-cased
+    :return: None
+    """
+    assert tokenize('RT @certbund: Gefälschte #Rechnungen https://t.co/AbC123 Größe 2,2 Mio.') == [
+        'rt', '@certbund', 'gefälschte', '#rechnungen', 'https://t.co/AbC123', 'größe', '2,2', 'mio'
+    ]
+    # decomposed umlauts and soft hyphens give the same token
+    assert tokenize('Pru\u0308fung Sicher\u00adheit') == tokenize('Pr\u00fcfung Sicherheit')
+    assert tokenize('#Cybersecurity-Branche don’t') == ['#cybersecurity-branche', 'don’t']
+
+
+def test_median():
+    """
+    The histogram median equals the median of all values
+    :return: None
+    """
+    stats = TweetStats()
+    assert stats.median() == 0.0
+    lines = ['a', 'a b', 'a b c', 'a a a', 'b c d e', '']
+    for count, line in enumerate(lines, 1):
+        stats.add(line)
+        values = [len(set(tokenize(text))) for text in lines[:count] if text]
+        assert stats.median() == statistics.median(values)
+    assert stats.tweets == 5
+    assert stats.word_counts['a'] == 6
+
+
+def test_read_lines_ranges(tmp_path):
+    """
+    Consecutive byte ranges read every line exactly once
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    path = tmp_path / 'tweets.txt'
+    path.write_bytes('erste Zeile\nzwei\n\ndritte Zeile über\nletzte'.encode('utf-8'))
+    size = os.path.getsize(str(path))
+    for step in range(1, size + 1):
+        lines = []
+        for start in range(0, size, step):
+            lines.extend(read_lines(str(path), start, min(start + step, size)))
+        assert lines == ['erste Zeile', 'zwei', '', 'dritte Zeile über', 'letzte']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_analyze_sharded(workers):
+    """
+    Sharded analysis gives the same result as reading the file in one go
+    :param workers: number of worker processes
+    :return: None
+    """
+    expected = TweetStats()
+    with open(TWEETS, encoding='utf-8') as stream:
+        for line in stream:
+            expected.add(line.rstrip('\n'))
+    stats = analyze(TWEETS, workers=workers, shard_size=4096)
+    assert stats.word_counts == expected.word_counts
+    assert stats.unique_histogram == expected.unique_histogram
+
+
+def test_main(tmp_path):
+    """
+    The command line writes both output files
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    words, median = tmp_path / 'words.txt', tmp_path / 'median.txt'
+    main([TWEETS, '--words', str(words), '--median', str(median)])
+    lines = words.read_text(encoding='utf-8').splitlines()
+    assert lines[0] == 'und\t151'
+    assert len(lines) == len(analyze(TWEETS).word_counts)
+    assert median.read_text(encoding='utf-8') == '21.00\n'
+
+
+def _read_outputs(words, median):
+    """
+    Read both output files
+    :param words: the word count file
+    :param median: the median file
+    :return: tuple of the word counts dict and the median
+    """
+    counts = dict(line.split('\t') for line in words.read_text(encoding='utf-8').splitlines())
+    return {word: int(count) for word, count in counts.items()}, float(median.read_text(encoding='utf-8'))
+
+
+def test_tail(tmp_path):
+    """
+    Incremental runs only read appended tweets and give the same result as a full run
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    with open(TWEETS, encoding='utf-8') as stream:
+        lines = stream.read().splitlines(True)
+    source = tmp_path / 'tweets.txt'
+    checkpoint = tmp_path / 'state.json'
+    words, median = tmp_path / 'words.txt', tmp_path / 'median.txt'
+    args = (str(source), str(checkpoint), str(words), str(median))
+
+    source.write_text(''.join(lines[:100]) + 'incomplete line', encoding='utf-8')
+    state = tail(*args, workers=1, batch_size=1000)
+    # the incomplete last line is left for the next run
+    assert state.stats.tweets == 100
+    assert state.offset == len(''.join(lines[:100]).encode('utf-8'))
+
+    with open(str(source), 'w', encoding='utf-8') as stream:
+        stream.write(''.join(lines))
+    state = tail(*args, workers=1, batch_size=1000)
+    expected = analyze(TWEETS)
+    assert Checkpoint.load(str(checkpoint)).stats.word_counts == expected.word_counts
+    assert _read_outputs(words, median) == (dict(expected.word_counts), expected.median())
+    # nothing new was appended
+    assert tail(*args).offset == state.offset
+
+
+def test_tail_rotation(tmp_path):
+    """
+    A truncated or replaced source file is read from its start again
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    source = tmp_path / 'tweets.txt'
+    args = (str(source), str(tmp_path / 'state.json'), str(tmp_path / 'words.txt'), str(tmp_path / 'median.txt'))
+    source.write_text('erster tweet\nzweiter tweet\n', encoding='utf-8')
+    assert tail(*args).stats.tweets == 2
+
+    # truncated and rewritten with different content of the same length
+    source.write_text('dritter tweet\nvierter tweet\n', encoding='utf-8')
+    state = tail(*args)
+    assert state.stats.tweets == 4
+    assert state.stats.word_counts['tweet'] == 4
+
+    # rotated: the old file is moved away and a new, shorter one is created
+    source.rename(tmp_path / 'tweets.txt.1')
+    source.write_text('neu\n', encoding='utf-8')
+    state = tail(*args)
+    assert state.stats.tweets == 5
+    assert state.offset == 4
+
+
+def test_tail_long_line(tmp_path):
+    """
+    A line longer than a batch is processed once it is complete instead of
+    stopping the run at its start
+    :param tmp_path: temporary directory of the test
+    :return: None
+    """
+    source = tmp_path / 'tweets.txt'
+    args = (str(source), str(tmp_path / 'state.json'), str(tmp_path / 'words.txt'), str(tmp_path / 'median.txt'))
+    long_line = ' '.join(['wort%d' % index for index in range(100)])
+    source.write_text('kurz\n' + long_line, encoding='utf-8')
+    state = tail(*args, batch_size=50)
+    # the long line is still being written
+    assert (state.stats.tweets, state.offset) == (1, 5)
+
+    with open(str(source), 'a', encoding='utf-8') as stream:
+        stream.write('\nkurz\n')
+    state = tail(*args, batch_size=50)
+    assert state.stats.tweets == 3
+    assert state.offset == source.stat().st_size
+    assert state.stats.word_counts['wort99'] == 1